@@ -1,60 +1,73 @@
 # 标准库导入
+import asyncio
 import os
-from openai import OpenAI
-import base64
 
 from ai_tennis_dags.action_score_v2.vision_agent_fuction import process_tennis_video
 
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import re
-from airflow.models import Variable
+
+from utils.image_prep import get_model_max_edge
+from utils.image_prep import prepare_image
+from utils.llm_gateway import get_llm_gateway
+
+
+# 网球动作评价的系统提示词（不包含可变内容）
+TENNIS_ACTION_SYSTEM_PROMPT = "专业的网球教练，擅长对网球动作进行分析和评价。请结合照片中网球运动员的动作细节，" \
+                              "针对用户给出的动作类型，给出评价。格式如下：\n" \
+                              "评分等级：S|A|B|C\n" \
+                              "动作评价：10字以内\n" \
+                              "动作建议：10字以内(如果比较完美，可以不给出建议)"
+
+
+async def aget_tennis_action_comment(action_image_path: str, model_name: str = "qwen-vl-max-latest", action_type: str = "击球准备动作") -> str:
+    """
+    通过阿里云的AI模型，获取网球动作的评论（经过LLM网关，可与其他动作的评价并发执行）
+    """
+    # 系统提示词保持不变，三个动作的评价请求共享同一前缀（可命中提示词缓存），动作类型放在用户消息中
+    system_prompt = TENNIS_ACTION_SYSTEM_PROMPT
+
+    # 预处理图片（按模型缩放、压缩到字节预算），三张图片同时发送，体积影响整体耗时
+    # 解码和压缩是CPU密集操作，放到线程中执行，避免阻塞事件循环使三个评价请求串行
+    prepared_image = await asyncio.to_thread(prepare_image, action_image_path,
+                                             max_edge=get_model_max_edge(model_name))
+    messages = [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    # 需要注意，传入Base64，图像格式（即image/{format}）需要与图片的Content Type保持一致，预处理后统一为JPEG
+                    "image_url": {"url": prepared_image.to_data_url()},
+                },
+                {"type": "text", "text": f"动作类型：{action_type}"},
+            ],
+        }
+    ]
+    # 获取动作评价，API Key等接入配置由网关读取（DASHSCOPE_API_KEY）
+    result = await get_llm_gateway().chat(model_name, messages, system_prompt=system_prompt)
+    print(f"[LLM_SCORE] {action_type} 模型: {result.model}, 耗时: {result.latency_ms}ms, token用量: {result.usage}")
+    return result.text
 
 
 def get_tennis_action_comment(action_image_path: str, model_name: str = "qwen-vl-max-latest", action_type: str = "击球准备动作") -> str:
     """
     通过阿里云的AI模型，获取网球动作的评论
     """
-    system_prompt = f"专业的网球教练，擅长对网球动作进行分析和评价。请结合照片网球运动员的{action_type}的细节，给出评价。格式如下：\n" \
-                    f"评分等级：S|A|B|C\n" \
-                    f"动作评价：10字以内\n" \
-                    f"动作建议：10字以内(如果比较完美，可以不给出建议)"
+    return get_llm_gateway().run_sync(aget_tennis_action_comment(action_image_path, model_name, action_type))
 
-    #  base 64 编码格式
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode("utf-8")
 
-    # 将xxxx/test.png替换为你本地图像的绝对路径
-    base64_image = encode_image(action_image_path)
-    client = OpenAI(
-        # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx"
-        api_key=Variable.get('DASHSCOPE_API_KEY'),
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    )
-    # 获取动作评价  
-    completion = client.chat.completions.create(
-        model=model_name,
-        messages=[
-            {
-                "role": "system",
-                "content": [{"type":"text","text": system_prompt}]},
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        # 需要注意，传入Base64，图像格式（即image/{format}）需要与支持的图片列表中的Content Type保持一致。"f"是字符串格式化的方法。
-                        # PNG图像：  f"data:image/png;base64,{base64_image}"
-                        # JPEG图像： f"data:image/jpeg;base64,{base64_image}"
-                        # WEBP图像： f"data:image/webp;base64,{base64_image}"
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}, 
-                    },
-                ],
-            }
-        ],
-    )
-    return completion.choices[0].message.content
+async def get_tennis_action_comments(action_images: list) -> list:
+    """
+    并发获取多个动作的评论
+
+    Args:
+        action_images: [(图片路径, 动作类型), ...]
+    """
+    return await asyncio.gather(*[
+        aget_tennis_action_comment(image_path, action_type=action_type) for image_path, action_type in action_images
+    ])
 
 # 三张动作图片+得分合并到一张长图
 def extract_score_from_comment(comment_text):
@@ -299,16 +312,14 @@ def get_tennis_action_score(video_path: str, output_dir: str):
     contact_image = result["contact_frame"]
     follow_image = result["follow_frame"]
 
-    # 获取准备动作得分
-    preparation_score = get_tennis_action_comment(preparation_image, action_type="准备动作")
+    # 并发获取准备、击球、跟随动作得分
+    preparation_score, contact_score, follow_score = get_llm_gateway().run_sync(get_tennis_action_comments([
+        (preparation_image, "准备动作"),
+        (contact_image, "击球动作"),
+        (follow_image, "跟随动作"),
+    ]))
     print(f"preparation_score: {preparation_score}")
-
-    # 获取击球动作得分
-    contact_score = get_tennis_action_comment(contact_image, action_type="击球动作")
     print(f"contact_score: {contact_score}")
-
-    # 获取跟随动作得分
-    follow_score = get_tennis_action_comment(follow_image, action_type="跟随动作")
     print(f"follow_score: {follow_score}")
     
     # 合并三张图片和评分
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DifyAgent 连接复用基准测试
+
+在本地启动一个模拟的Dify服务（HTTP/1.1 keep-alive，每个请求固定延迟），分别测试:
+1. 每次调用都使用 requests.get/post（旧实现，每次新建连接）
+2. DifyAgent（共享Session + 连接池）
+3. AsyncDifyAgent（共享AsyncClient，并发请求）
+
+输出每种方式的总耗时、平均耗时和服务端收到的TCP连接数。
+需要在Airflow环境中运行（DifyAgent依赖airflow.models.Variable）:
+    python dags/tests/demo_dify_benchmark.py --requests 200 --delay-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.dify_sdk import DifyAgent  # noqa: E402
+from utils.dify_async_sdk import AsyncDifyAgent, close_async_clients  # noqa: E402
+
+
+class FakeDifyHandler(BaseHTTPRequestHandler):
+    """
+    模拟Dify的 /conversations 和 /chat-messages（流式）接口
+    """
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，keep-alive连接上需关闭Nagle算法，否则会叠加40ms的延迟确认
+    disable_nagle_algorithm = True
+    delay = 0.02
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with FakeDifyHandler.lock:
+            FakeDifyHandler.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self._send_json({"data": [{"id": "conv-1", "status": "normal"}], "has_more": False, "limit": 20})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        time.sleep(self.delay)
+
+        events = [{"event": "message", "task_id": "task-1", "answer": word} for word in ["你好", "，", "世界"]]
+        events.append({"event": "message_end", "task_id": "task-1", "message_id": "msg-1",
+                       "conversation_id": "conv-1", "metadata": {}, "usage": {"total_tokens": 3}})
+        body = "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeDifyServer(ThreadingHTTPServer):
+    # 默认的监听队列长度为5，并发建立连接时会丢弃SYN并等待1秒重传
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_fake_server(delay):
+    FakeDifyHandler.delay = delay
+    server = FakeDifyServer(('127.0.0.1', 0), FakeDifyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def report(name, count, elapsed, connections):
+    print(f"{name:<28} 总耗时: {elapsed:7.3f}s  平均: {elapsed / count * 1000:7.2f}ms  TCP连接数: {connections}")
+
+
+def bench_plain_requests(base_url, count):
+    headers = {'Authorization': 'Bearer test', 'Content-Type': 'application/json'}
+    start = time.perf_counter()
+    for _ in range(count):
+        requests.get(f"{base_url}/conversations", headers=headers, params={"user": "u"}).json()
+    return time.perf_counter() - start
+
+
+def bench_dify_agent(base_url, count):
+    agent = DifyAgent(api_key='test', base_url=base_url)
+    start = time.perf_counter()
+    for _ in range(count):
+        agent.list_conversations(user_id='u')
+    return time.perf_counter() - start
+
+
+def bench_dify_agent_stream(base_url, count):
+    agent = DifyAgent(api_key='test', base_url=base_url)
+    start = time.perf_counter()
+    for _ in range(count):
+        agent.create_chat_message_stream(query='hi', user_id='u')
+    return time.perf_counter() - start
+
+
+async def bench_async_agent(base_url, count, concurrency):
+    agent = AsyncDifyAgent(api_key='test', base_url=base_url)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await agent.create_chat_message_stream(query='hi', user_id='u')
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(count)])
+    elapsed = time.perf_counter() - start
+    await close_async_clients()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DifyAgent 连接复用基准测试')
+    parser.add_argument('--requests', type=int, default=200, help='每种方式的请求次数')
+    parser.add_argument('--delay-ms', type=int, default=20, help='模拟服务端每个请求的处理耗时')
+    parser.add_argument('--concurrency', type=int, default=20, help='异步客户端的并发数')
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(args.delay_ms / 1000)
+    print(f"模拟Dify服务: {base_url}, 请求次数: {args.requests}, 服务端延迟: {args.delay_ms}ms")
+
+    cases = [
+        ("requests.get（无Session）", lambda: bench_plain_requests(base_url, args.requests)),
+        ("DifyAgent 会话列表", lambda: bench_dify_agent(base_url, args.requests)),
+        ("DifyAgent 流式消息", lambda: bench_dify_agent_stream(base_url, args.requests)),
+        (f"AsyncDifyAgent 并发{args.concurrency}",
+         lambda: asyncio.run(bench_async_agent(base_url, args.requests, args.concurrency))),
+    ]
+    for name, func in cases:
+        FakeDifyHandler.connections = 0
+        elapsed = func()
+        report(name, args.requests, elapsed, FakeDifyHandler.connections)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM网关演示
+
+在本地启动一个模拟的OpenAI兼容服务，按模型注入延迟和错误:
+- fake-primary: 大部分请求 50~150ms，按比例出现长尾慢请求（2s）和500错误
+- fake-backup: 稳定的备用模型，100ms
+
+依次测试:
+1. 直接调用（OpenAI同步客户端，线程池并发，无保护）
+2. 经过网关（并发上限 + 对冲请求 + 备用模型 + 请求时限）
+3. 主模型故障（始终返回500），网关熔断后直接使用备用模型
+
+输出每种方式的 p50/p95/p99 耗时、失败数，以及模拟服务收到的各模型请求数。
+需要在Airflow环境中运行（llm_gateway依赖airflow.models.Variable）:
+    python dags/tests/demo_llm_gateway.py --requests 200 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.llm_gateway import LLMGateway, LLMRoute  # noqa: E402
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    模拟 /v1/chat/completions 接口
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    slow_rate = 0.05
+    error_rate = 0.05
+    primary_down = False
+    requests = Counter()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 对冲请求的另一路先返回后，客户端会取消未完成的请求
+            pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length))
+        model = payload.get('model')
+        with FakeOpenAIHandler.lock:
+            FakeOpenAIHandler.requests[model] += 1
+
+        if model == 'fake-primary':
+            if self.primary_down or random.random() < self.error_rate:
+                time.sleep(0.05)
+                self._send_json(500, {"error": {"message": "injected error", "type": "server_error"}})
+                return
+            time.sleep(2.0 if random.random() < self.slow_rate else random.uniform(0.05, 0.15))
+        else:
+            time.sleep(0.1)
+
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": f"reply from {model}"},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_fake_server():
+    server = FakeOpenAIServer(('127.0.0.1', 0), FakeOpenAIHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def report(name, latencies, failures):
+    ordered = sorted(latencies) or [0]
+
+    def percentile(ratio):
+        return ordered[int(ratio * (len(ordered) - 1))] * 1000
+
+    print(f"{name:<24} p50: {percentile(0.5):7.1f}ms  p95: {percentile(0.95):7.1f}ms  "
+          f"p99: {percentile(0.99):7.1f}ms  失败: {failures}  服务端请求: {dict(FakeOpenAIHandler.requests)}")
+
+
+def bench_direct(base_url, count, concurrency):
+    client = OpenAI(api_key='test', base_url=base_url, max_retries=0, timeout=10)
+    messages = [{"role": "user", "content": "hi"}]
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            client.chat.completions.create(model='fake-primary', messages=messages)
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(count)))
+    return [latency for latency, _ in results], sum(failed for _, failed in results)
+
+
+async def bench_gateway(gateway, count, concurrency, deadline_seconds):
+    messages = [{"role": "user", "content": "hi"}]
+    # 调用方并发与直接调用一致，网关的厂商并发上限更高，留出对冲请求的余量
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await timed_chat()
+
+    async def timed_chat():
+        start = time.perf_counter()
+        try:
+            await gateway.chat('fake-primary', messages, deadline_seconds=deadline_seconds)
+            return time.perf_counter() - start, False
+        except Exception:
+            return time.perf_counter() - start, True
+
+    results = await asyncio.gather(*[one() for _ in range(count)])
+    await gateway.aclose()
+    return [latency for latency, _ in results], sum(failed for _, failed in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='LLM网关演示')
+    parser.add_argument('--requests', type=int, default=200, help='每种方式的请求次数')
+    parser.add_argument('--concurrency', type=int, default=20, help='调用方并发数（网关的厂商并发上限为其2倍）')
+    parser.add_argument('--slow-rate', type=float, default=0.05, help='主模型慢请求比例')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='主模型错误比例')
+    parser.add_argument('--deadline', type=float, default=3.0, help='网关请求时限（秒）')
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.slow_rate = args.slow_rate
+    FakeOpenAIHandler.error_rate = args.error_rate
+    server, base_url = start_fake_server()
+    print(f"模拟OpenAI服务: {base_url}, 请求次数: {args.requests}, 慢请求比例: {args.slow_rate}, 错误比例: {args.error_rate}")
+
+    def make_gateway():
+        return LLMGateway(
+            routes={"fake": LLMRoute("openai", "test", base_url=base_url, max_concurrency=args.concurrency * 2)},
+            model_routes={"fake-primary": "fake", "fake-backup": "fake"},
+            fallback_models={"fake-primary": "fake-backup"},
+            deadline_seconds=args.deadline,
+        )
+
+    FakeOpenAIHandler.requests.clear()
+    latencies, failures = bench_direct(base_url, args.requests, args.concurrency)
+    report("直接调用", latencies, failures)
+
+    # 预热耗时统计，使对冲等待时间基于p95
+    gateway = make_gateway()
+    asyncio.run(bench_gateway(gateway, 50, args.concurrency, args.deadline))
+    FakeOpenAIHandler.requests.clear()
+    latencies, failures = asyncio.run(bench_gateway(gateway, args.requests, args.concurrency, args.deadline))
+    report("网关（对冲+备用）", latencies, failures)
+    print(f"{'':<24} 对冲等待时间: {gateway.get_tracker('fake-primary').hedge_delay() * 1000:.1f}ms")
+
+    FakeOpenAIHandler.primary_down = True
+    FakeOpenAIHandler.requests.clear()
+    gateway = make_gateway()
+    latencies, failures = asyncio.run(bench_gateway(gateway, args.requests, args.concurrency, args.deadline))
+    report("主模型故障（熔断）", latencies, failures)
+    print(f"{'':<24} 熔断器状态: {gateway.get_breaker('fake-primary').state}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+公众号 Access Token 管理演示
+
+在本地启动一个模拟的公众号接口，行为与微信一致: 每次获取Token都会生成新Token，旧Token立即失效（返回40001）。
+- /cgi-bin/token: 获取Token（有效期可配置）
+- /cgi-bin/message/custom/send: 发送客服消息，Token不是最新时返回40001
+
+依次测试:
+1. 每个worker各自获取Token（原来的方式）: 获取次数等于并发数，互相把对方的Token刷掉
+2. Redis共享Token（单飞）: 并发获取只请求一次
+3. 提前刷新: Token有效期很短，持续发送消息期间按有效期的80%刷新，没有失败
+4. Token被外部刷新（如其他系统获取了Token）: 收到40001后刷新并重试成功
+
+需要在Airflow环境中运行（wechat_mp_token依赖utils.redis）:
+    python dags/tests/demo_mp_access_token.py --workers 20 --redis-url redis://localhost:6379/15
+    python dags/tests/demo_mp_access_token.py --fakeredis  # 使用fakeredis（需要安装fakeredis和lupa）
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.wechat_mp_channl import WeChatMPBot  # noqa: E402
+from utils.wechat_mp_token import MP_ACCESS_TOKEN_KEY, create_mp_bot  # noqa: E402
+
+
+class FakeMPHandler(BaseHTTPRequestHandler):
+    """
+    模拟公众号接口
+    """
+    protocol_version = 'HTTP/1.1'
+    expires_in = 7200
+    token_delay = 0.2
+    current_token = None
+    token_requests = 0
+    sent = 0
+    invalid = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; encoding=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @classmethod
+    def issue_token(cls):
+        with cls.lock:
+            cls.token_requests += 1
+            cls.current_token = f"token-{cls.token_requests}"
+            return cls.current_token
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/cgi-bin/token':
+            # 模拟接口耗时，使并发请求有机会重叠
+            time.sleep(self.token_delay)
+            self._send_json({"access_token": self.issue_token(), "expires_in": self.expires_in})
+        else:
+            self._send_json({"errcode": 404, "errmsg": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        token = parse_qs(url.query).get('access_token', [''])[0]
+        with FakeMPHandler.lock:
+            if token != FakeMPHandler.current_token:
+                FakeMPHandler.invalid += 1
+                result = {"errcode": 40001, "errmsg": "invalid credential, access_token is invalid or not latest"}
+            else:
+                FakeMPHandler.sent += 1
+                result = {"errcode": 0, "errmsg": "ok"}
+        self._send_json(result)
+
+    @classmethod
+    def reset(cls, expires_in=7200):
+        cls.expires_in = expires_in
+        cls.current_token = None
+        cls.token_requests = 0
+        cls.sent = 0
+        cls.invalid = 0
+
+
+class FakeMPServer(ThreadingHTTPServer):
+    # 默认的连接队列只有5，并发worker较多时会被拒绝连接
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def start_fake_server():
+    server = FakeMPServer(('127.0.0.1', 0), FakeMPHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/cgi-bin"
+
+
+def make_redis(args):
+    if args.fakeredis:
+        import fakeredis
+        return fakeredis.FakeRedis(decode_responses=True)
+    from redis import Redis
+    return Redis.from_url(args.redis_url, decode_responses=True)
+
+
+def send_concurrently(make_bot, workers):
+    """
+    模拟多个worker同时处理消息: 每个worker创建自己的bot并发送一条消息
+    """
+    def one(index):
+        try:
+            make_bot().send_text_message(f"openid-{index}", "hello")
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(workers) as executor:
+        return sum(executor.map(one, range(workers)))
+
+
+def report(name, succeeded, total):
+    print(f"{name:<20} 成功: {succeeded}/{total}  获取Token次数: {FakeMPHandler.token_requests}  "
+          f"服务端40001次数: {FakeMPHandler.invalid}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='公众号 Access Token 管理演示')
+    parser.add_argument('--workers', type=int, default=20, help='并发的worker数')
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15', help='Redis地址（会写入演示用的键）')
+    parser.add_argument('--fakeredis', action='store_true', help='使用fakeredis代替Redis')
+    args = parser.parse_args()
+
+    server, api_base = start_fake_server()
+    redis_client = make_redis(args)
+    appid = 'demo-appid'
+    redis_client.delete(MP_ACCESS_TOKEN_KEY.format(appid=appid))
+    print(f"模拟公众号接口: {api_base}, 并发worker: {args.workers}")
+
+    # 1. 每个worker各自获取Token
+    FakeMPHandler.reset()
+    succeeded = send_concurrently(lambda: WeChatMPBot(appid, 'secret', api_base=api_base), args.workers)
+    report("各自获取Token", succeeded, args.workers)
+
+    # 2. Redis共享Token
+    FakeMPHandler.reset()
+    redis_client.delete(MP_ACCESS_TOKEN_KEY.format(appid=appid))
+    succeeded = send_concurrently(lambda: create_mp_bot(appid, 'secret', redis_client, api_base), args.workers)
+    report("Redis共享Token", succeeded, args.workers)
+
+    # 3. 提前刷新: 有效期2秒，持续发送5秒
+    FakeMPHandler.reset(expires_in=2)
+    redis_client.delete(MP_ACCESS_TOKEN_KEY.format(appid=appid))
+    total = succeeded = 0
+    start_time = time.time()
+    while time.time() - start_time < 5:
+        total += args.workers
+        succeeded += send_concurrently(lambda: create_mp_bot(appid, 'secret', redis_client, api_base), args.workers)
+        time.sleep(0.2)
+    report("提前刷新(有效期2秒)", succeeded, total)
+
+    # 4. Token被外部刷新
+    FakeMPHandler.reset()
+    redis_client.delete(MP_ACCESS_TOKEN_KEY.format(appid=appid))
+    send_concurrently(lambda: create_mp_bot(appid, 'secret', redis_client, api_base), 1)
+    FakeMPHandler.issue_token()
+    succeeded = send_concurrently(lambda: create_mp_bot(appid, 'secret', redis_client, api_base), args.workers)
+    report("Token被外部刷新", succeeded, args.workers)
+
+    redis_client.delete(MP_ACCESS_TOKEN_KEY.format(appid=appid))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
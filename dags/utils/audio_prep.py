@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+语音预处理模块
+
+语音消息原样上传做语音识别时，上传体积大，开头结尾的静音也要识别。识别前统一预处理:
+- 只解码一次（SILK / AMR / MP3 等，SILK需要安装 silk-python）
+- 转为16kHz单声道（语音识别模型的输入采样率，更高的采样率没有意义）
+- 去掉开头和结尾的静音（保留少量余量，避免截断首尾的字）
+- 编码为低码率MP3（ffmpeg不可用时输出16kHz单声道WAV）
+- 结果按 原始文件内容哈希 缓存到本地临时目录
+
+识别结果的缓存见 DifyAgent.audio_to_text_cached
+
+使用示例:
+    prepared = prepare_audio("voice.amr")
+    text = dify_agent.audio_to_text(prepared.path)
+"""
+
+# 标准库导入
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+# 第三方库导入
+from pydub import AudioSegment
+from pydub.silence import detect_leading_silence
+
+# SILK（微信语音的原始格式）解码为可选功能，依赖silk-python
+try:
+    import pysilk
+except ImportError:
+    pysilk = None
+
+
+# 语音识别的采样率
+ASR_SAMPLE_RATE = 16000
+
+# 输出MP3的码率（16kHz单声道语音足够清晰）
+ASR_MP3_BITRATE = "32k"
+
+# 静音阈值: 低于整段音频平均音量该分贝数视为静音，且不高于绝对阈值
+SILENCE_RELATIVE_DB = 16
+SILENCE_MAX_DBFS = -35
+
+# 去掉静音后首尾保留的余量（毫秒）
+SILENCE_PADDING_MS = 200
+
+# 处理结果的缓存目录和过期时间（秒）
+AUDIO_CACHE_DIR = os.path.join(tempfile.gettempdir(), "audio_prep_cache")
+AUDIO_CACHE_TTL = 24 * 60 * 60
+
+
+@dataclass
+class PreparedAudio:
+    """
+    预处理后的语音
+    """
+    path: str
+    duration_ms: int
+    original_bytes: int
+    trimmed_ms: int = 0
+    cached: bool = False
+
+
+def _decode(raw_data: bytes, source_format: str) -> AudioSegment:
+    """
+    解码语音，SILK格式先解码为PCM
+    """
+    if source_format == "silk" or raw_data[:10].lstrip(b"\x02").startswith(b"#!SILK_V3"):
+        if pysilk is None:
+            raise RuntimeError("未安装silk-python，无法解码SILK语音")
+        pcm_output = io.BytesIO()
+        # 微信的SILK语音前面可能有一个0x02字节
+        pysilk.decode(io.BytesIO(raw_data.lstrip(b"\x02")), pcm_output, ASR_SAMPLE_RATE)
+        return AudioSegment(pcm_output.getvalue(), sample_width=2, frame_rate=ASR_SAMPLE_RATE, channels=1)
+    return AudioSegment.from_file(io.BytesIO(raw_data), format=source_format)
+
+
+def trim_silence(sound: AudioSegment) -> AudioSegment:
+    """
+    去掉开头和结尾的静音，首尾保留 SILENCE_PADDING_MS 的余量
+    """
+    if len(sound) == 0 or sound.dBFS == float("-inf"):
+        return sound[:0]
+    threshold = min(sound.dBFS - SILENCE_RELATIVE_DB, SILENCE_MAX_DBFS)
+    start = detect_leading_silence(sound, silence_threshold=threshold)
+    end = len(sound) - detect_leading_silence(sound.reverse(), silence_threshold=threshold)
+    if start >= end:
+        return sound[:0]
+    return sound[max(0, start - SILENCE_PADDING_MS):min(len(sound), end + SILENCE_PADDING_MS)]
+
+
+def _prune_cache(max_age: int = AUDIO_CACHE_TTL):
+    """
+    删除过期的缓存文件
+    """
+    now = time.time()
+    try:
+        with os.scandir(AUDIO_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+    except OSError as error:
+        print(f"[AUDIO_PREP] 清理缓存失败: {error}")
+
+
+def prepare_audio(audio_path: str, source_format: str = None) -> PreparedAudio:
+    """
+    预处理语音: 解码、转为16kHz单声道、去掉首尾静音、编码为低码率MP3
+
+    Args:
+        audio_path: 原始语音路径
+        source_format: 原始格式（amr、silk、mp3等），默认使用文件扩展名
+
+    Returns:
+        PreparedAudio: 处理后的语音，path为缓存目录中的文件
+    """
+    with open(audio_path, "rb") as audio_file:
+        raw_data = audio_file.read()
+    source_format = (source_format or os.path.splitext(audio_path)[1][1:] or "mp3").lower()
+
+    digest = hashlib.sha256(raw_data).hexdigest()[:32]
+    for ext in ("mp3", "wav"):
+        cache_path = os.path.join(AUDIO_CACHE_DIR, f"{digest}.{ext}")
+        if os.path.exists(cache_path):
+            duration_ms = len(AudioSegment.from_file(cache_path, format=ext))
+            print(f"[AUDIO_PREP] 命中缓存: {audio_path}")
+            return PreparedAudio(cache_path, duration_ms, len(raw_data), cached=True)
+
+    start_time = time.perf_counter()
+    sound = _decode(raw_data, source_format)
+    original_ms = len(sound)
+    sound = sound.set_frame_rate(ASR_SAMPLE_RATE).set_channels(1).set_sample_width(2)
+    # 整段都是静音时不裁剪，交给语音识别处理
+    sound = trim_silence(sound) or sound
+
+    os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
+    _prune_cache()
+    cache_path = os.path.join(AUDIO_CACHE_DIR, f"{digest}.mp3")
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        sound.export(temp_path, format="mp3", bitrate=ASR_MP3_BITRATE)
+    except Exception as error:
+        # ffmpeg不可用时输出WAV（16kHz单声道，仍比原始文件小）
+        print(f"[AUDIO_PREP] 编码MP3失败，输出WAV: {error}")
+        cache_path = os.path.join(AUDIO_CACHE_DIR, f"{digest}.wav")
+        sound.export(temp_path, format="wav")
+    # 先写临时文件再重命名，避免并发读到不完整的文件
+    os.replace(temp_path, cache_path)
+
+    prepared = PreparedAudio(cache_path, len(sound), len(raw_data), trimmed_ms=original_ms - len(sound))
+    print(f"[AUDIO_PREP] {audio_path}: {original_ms}ms {len(raw_data)}B -> {prepared.duration_ms}ms "
+          f"{os.path.getsize(cache_path)}B, 去掉静音: {prepared.trimmed_ms}ms, "
+          f"耗时: {(time.perf_counter() - start_time) * 1000:.0f}ms")
+    return prepared
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并发预取工具
+
+消息处理任务开头有多个互相独立的I/O（读Airflow变量、读Redis、下载文件等），依次执行时耗时是所有调用之和。
+prefetch 把这些调用放到共享线程池中同时执行，耗时接近其中最慢的一个:
+- 每个调用可以单独设置超时，超时或失败时使用默认值，没有默认值时抛出 PrefetchError
+- 返回（或抛出异常）前取消还未开始执行的调用；已经开始执行的调用无法中断，在后台执行完后丢弃结果
+
+使用示例:
+    results = prefetch({
+        "api_key": lambda: Variable.get("xxx_dify_api_key"),
+        "msg_list": lambda: redis_handler.get_msg_list("xxx_msg_list"),
+    }, timeouts={"msg_list": 3}, defaults={"msg_list": []})
+"""
+
+# 标准库导入
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+# 默认超时（秒）
+DEFAULT_PREFETCH_TIMEOUT = 30
+
+# 进程内共享的线程池，调用数超过线程数时排队执行
+PREFETCH_MAX_WORKERS = 16
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="prefetch")
+
+
+class PrefetchError(Exception):
+    """
+    预取的调用失败或超时，且没有默认值
+    """
+
+    def __init__(self, name: str, error: Exception):
+        super().__init__(f"{name}: {error!r}")
+        self.name = name
+        self.error = error
+
+
+def prefetch(calls: Dict[str, Callable[[], Any]], timeout: float = DEFAULT_PREFETCH_TIMEOUT,
+             timeouts: Dict[str, float] = None, defaults: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    并发执行互相独立的调用
+
+    Args:
+        calls: 名称 -> 无参数的调用
+        timeout: 默认超时（秒），从开始预取时计算
+        timeouts: 名称 -> 单个调用的超时（秒）
+        defaults: 名称 -> 调用失败或超时时使用的默认值
+
+    Returns:
+        dict: 名称 -> 调用结果
+
+    Raises:
+        PrefetchError: 没有默认值的调用失败或超时
+    """
+    timeouts = timeouts or {}
+    defaults = defaults or {}
+    durations = {}
+
+    def timed(name, func):
+        call_start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            durations[name] = round((time.perf_counter() - call_start) * 1000)
+
+    start_time = time.perf_counter()
+    futures = {name: _executor.submit(timed, name, func) for name, func in calls.items()}
+    results = {}
+    try:
+        for name, future in futures.items():
+            remaining = timeouts.get(name, timeout) - (time.perf_counter() - start_time)
+            try:
+                results[name] = future.result(timeout=max(remaining, 0))
+            except Exception as error:
+                if name not in defaults:
+                    raise PrefetchError(name, error) from error
+                print(f"[PREFETCH] {name} 失败，使用默认值: {error!r}")
+                results[name] = defaults[name]
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+    print(f"[PREFETCH] 总耗时: {round((time.perf_counter() - start_time) * 1000)}ms, 各调用耗时: {durations}")
+    return results
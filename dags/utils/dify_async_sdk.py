@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify API 异步客户端
+
+接口与 utils.dify_sdk.DifyAgent 保持一致，所有方法都是协程，供asyncio环境（如FastAPI服务、异步Worker）使用:
+- 同一事件循环内，每个base_url共享一个 httpx.AsyncClient，复用连接
+- 连接/读取超时与同步客户端一致
+- 幂等请求（GET/DELETE）在连接失败或网关错误时退避重试，POST不自动重试
+- 缓存的会话不存在时与同步客户端一样用新会话（conversation_id为空）重试；会话ID缓存的Redis/Variable读写在线程中执行，不阻塞事件循环
+- 不包含同步客户端的上传文件缓存（upload_file_cached / refresh_upload_files），需要复用上传ID时使用 DifyAgent
+
+使用示例:
+    agent = AsyncDifyAgent(api_key, base_url)
+    answer, metadata = await agent.create_chat_message_stream(query, user_id)
+"""
+
+# 标准库导入
+import asyncio
+import os
+import weakref
+
+# 第三方库导入
+import httpx
+
+# 自定义库导入
+from utils.dify_sdk import DEFAULT_TIMEOUT, STREAM_TIMEOUT, FILE_TIMEOUT, POOL_MAXSIZE, StreamCollector
+from utils.dify_sdk import (get_room_conversation_id, get_user_conversation_id, forget_conversation_id,
+                            is_conversation_not_found)
+
+
+# 幂等请求的重试次数、退避系数和需要重试的状态码
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# 事件循环 -> {base_url: AsyncClient}，AsyncClient不能跨事件循环使用
+# 以事件循环对象为弱引用键: 循环被回收后其客户端随之丢弃，新循环不会因复用旧循环的id而拿到绑定在已关闭循环上的客户端
+_clients = weakref.WeakKeyDictionary()
+
+
+def to_httpx_timeout(timeout):
+    """
+    将 (连接超时, 读取超时) 转换为httpx的超时配置
+    """
+    connect, read = timeout
+    return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+
+def get_async_client(base_url):
+    """
+    获取当前事件循环中base_url对应的共享AsyncClient
+    """
+    loop_clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=POOL_MAXSIZE, max_keepalive_connections=POOL_MAXSIZE),
+            timeout=to_httpx_timeout(DEFAULT_TIMEOUT),
+            # 连接失败时由传输层重试（此时请求尚未发出，POST也是安全的）
+            transport=httpx.AsyncHTTPTransport(retries=2)
+        )
+        loop_clients[base_url] = client
+    return client
+
+
+async def close_async_clients():
+    """
+    关闭当前事件循环中的所有AsyncClient，服务退出时调用
+    """
+    loop_clients = _clients.pop(asyncio.get_running_loop(), {})
+    for client in loop_clients.values():
+        await client.aclose()
+
+
+class AsyncDifyAgent:
+    def __init__(self, api_key, base_url, timeout=DEFAULT_TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = to_httpx_timeout(timeout)
+        self.headers = {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        }
+
+    @property
+    def client(self):
+        return get_async_client(self.base_url)
+
+    async def _request(self, method, url, **kwargs):
+        """
+        发送请求，幂等请求在连接失败或网关错误时退避重试
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if method not in ('GET', 'DELETE'):
+            return await self.client.request(method, url, **kwargs)
+
+        for attempt in range(RETRY_TOTAL + 1):
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS or attempt == RETRY_TOTAL:
+                    return response
+            except httpx.TransportError:
+                if attempt == RETRY_TOTAL:
+                    raise
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    async def create_chat_message(self, query, user_id, conversation_id="", inputs=None, files=None):
+        """
+        创建聊天消息
+        """
+        url = f"{self.base_url}/chat-messages"
+        payload = {
+            "inputs": inputs or {},
+            "query": query,
+            "response_mode": "blocking",
+            "conversation_id": conversation_id,
+            "user": user_id,
+            "auto_generate_name": False,
+            "files": files or []
+        }
+        response = await self._request('POST', url, headers=self.headers, json=payload)
+        if conversation_id and is_conversation_not_found(response):
+            # 缓存的会话已失效，使用新会话重试
+            print(f"会话 {conversation_id} 不存在，创建新会话")
+            return await self.create_chat_message(query, user_id, "", inputs, files)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"创建消息失败: {response.text}")
+
+    async def list_conversations(self, user_id, last_id="", limit=20, sort_by="-updated_at"):
+        """
+        获取用户会话列表
+        """
+        url = f"{self.base_url}/conversations"
+        params = {
+            "user": user_id,
+            "last_id": last_id,
+            "limit": limit,
+            "sort_by": sort_by
+        }
+        response = await self._request('GET', url, headers=self.headers, params=params)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"获取会话列表失败: {response.text}")
+
+    async def get_conversation_id_for_room(self, user_id, room_id):
+        """
+        根据房间ID获取缓存的会话ID，没有时返回空字符串（不校验会话状态，失效时发送消息会自动创建新会话）
+        """
+        conversation_id = await asyncio.to_thread(get_room_conversation_id, user_id, room_id)
+        if conversation_id:
+            print(f"{user_id} 使用已存在的会话ID: {conversation_id}")
+        else:
+            print(f"{user_id} 没有找到会话ID")
+        return conversation_id
+
+    async def get_conversation_id_for_user(self, user_id):
+        """
+        根据用户ID获取缓存的会话ID（微信公众号等一对一对话场景），没有时返回空字符串
+        """
+        conversation_id = await asyncio.to_thread(get_user_conversation_id, user_id)
+        if conversation_id:
+            print(f"用户 {user_id} 使用已存在的会话ID: {conversation_id}")
+        else:
+            print(f"用户 {user_id} 没有找到会话ID")
+        return conversation_id
+
+    async def rename_conversation(self, conversation_id, user_id, name="", auto_generate=False):
+        """
+        重命名会话
+        """
+        if not user_id:
+            raise ValueError("user_id 是必填参数")
+
+        payload = {"user": user_id}
+        if auto_generate:
+            payload["auto_generate"] = True
+        elif name:
+            payload["name"] = name
+        else:
+            raise ValueError("必须提供name或设置auto_generate=True")
+
+        url = f"{self.base_url}/conversations/{conversation_id}/name"
+        response = await self._request('POST', url, headers=self.headers, json=payload)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"重命名会话失败: {response.text}")
+
+    async def get_conversation_messages(self, conversation_id, user_id, first_id="", limit=100):
+        """
+        获取会话历史消息
+        """
+        url = f"{self.base_url}/messages"
+        params = {
+            "conversation_id": conversation_id,
+            "user": user_id,
+            "first_id": first_id,
+            "limit": limit
+        }
+        response = await self._request('GET', url, headers=self.headers, params=params)
+        if response.status_code == 200:
+            return response.json()["data"]
+        else:
+            raise Exception(f"获取会话历史消息失败: {response.text}")
+
+    async def delete_conversation(self, conversation_id, user_id):
+        """
+        删除指定的会话
+        """
+        url = f"{self.base_url}/conversations/{conversation_id}"
+        response = await self._request('DELETE', url, headers=self.headers, json={"user": user_id})
+        if response.status_code == 200:
+            # 从缓存中删除会话ID映射
+            await asyncio.to_thread(forget_conversation_id, user_id, conversation_id)
+            return response.json()
+        else:
+            raise Exception(f"删除会话失败: {response.text}")
+
+    async def create_message_feedback(self, message_id, user_id, rating="like", content=""):
+        """
+        为消息添加反馈（点赞/点踩）
+        """
+        url = f"{self.base_url}/messages/{message_id}/feedbacks"
+        payload = {
+            "rating": rating,
+            "user": user_id,
+            "content": content
+        }
+        response = await self._request('POST', url, headers=self.headers, json=payload)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"创建消息反馈失败: 状态码: {response.status_code}, 响应内容: {response.text}")
+
+    async def iter_chat_message_stream(self, query, user_id, conversation_id="", inputs=None, files=None,
+                                       collector=None):
+        """
+        创建聊天消息，以异步生成器方式逐个返回类型化的流式事件（同 DifyAgent.iter_chat_message_stream）
+        """
+        if collector is None:
+            collector = StreamCollector()
+
+        url = f"{self.base_url}/chat-messages"
+        payload = {
+            "inputs": inputs or {},
+            "query": query,
+            "response_mode": "streaming",
+            "conversation_id": conversation_id,
+            "user": user_id,
+            "auto_generate_name": False,
+            "files": files or []
+        }
+
+        collector.start()
+        # 缓存的会话已失效时，使用新会话重试一次
+        while True:
+            async with self.client.stream('POST', url, headers=self.headers, json=payload,
+                                          timeout=to_httpx_timeout(STREAM_TIMEOUT)) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    if payload["conversation_id"] and is_conversation_not_found(response):
+                        print(f"会话 {payload['conversation_id']} 不存在，创建新会话")
+                        payload["conversation_id"] = ""
+                        continue
+                    raise Exception(f"创建消息失败: {response.text}")
+
+                async for line in response.aiter_lines():
+                    if line:
+                        event = collector.feed_line(line)
+                        if event is not None:
+                            yield event
+                return
+
+    async def create_chat_message_stream(self, query, user_id, conversation_id="", inputs=None, files=None):
+        """
+        创建聊天消息并以流式方式返回结果
+
+        Returns:
+            tuple: (完整回答文本, 元数据字典)
+        """
+        collector = StreamCollector()
+        async for _ in self.iter_chat_message_stream(query, user_id, conversation_id, inputs, files, collector=collector):
+            pass
+        print(f"流式响应完成, {collector.summary()}")
+        return collector.result()
+
+    async def stop_chat_message(self, task_id, user_id):
+        """
+        停止流式响应
+        """
+        url = f"{self.base_url}/chat-messages/{task_id}/stop"
+        response = await self._request('POST', url, headers=self.headers, json={"user": user_id})
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise Exception(f"停止响应失败: {response.text}")
+
+    async def audio_to_text(self, audio_file_path):
+        """
+        将语音文件转换为文字
+        """
+        api_url = f"{self.base_url}/audio-to-text"
+
+        ext = os.path.splitext(audio_file_path)[1].lower()[1:]
+        if ext in ['mp3', 'mp4', 'mpeg', 'mpga', 'm4a', 'wav', 'webm']:
+            mime_type = f'audio/{ext}'
+        else:
+            mime_type = 'audio/wav'
+
+        with open(audio_file_path, 'rb') as audio_file:
+            files = {'file': (os.path.basename(audio_file_path), audio_file.read(), mime_type)}
+
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        response = await self._request('POST', api_url, headers=headers, files=files,
+                                       timeout=to_httpx_timeout(FILE_TIMEOUT))
+        if response.status_code == 200:
+            return response.json().get('text', '')
+        else:
+            raise Exception(f"语音转文字失败: [{response.status_code}] {response.text}")
+
+    async def text_to_audio(self, text, user_id, save_path):
+        """
+        将文字转换为语音并保存到指定路径
+        """
+        api_url = f"{self.base_url}/text-to-audio"
+        payload = {
+            "text": text,
+            "user": user_id
+        }
+        async with self.client.stream('POST', api_url, headers=self.headers, json=payload,
+                                      timeout=to_httpx_timeout(FILE_TIMEOUT)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise Exception(f"文字转语音失败: [{response.status_code}] {response.text}")
+            with open(save_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(chunk_size=8192):
+                    f.write(chunk)
+        print(f"文字已转换为语音，保存到: {save_path}")
+        return save_path
+
+    async def upload_file(self, file_path, user_id):
+        """
+        上传文件到 Dify 平台
+        """
+        api_url = f"{self.base_url}/files/upload"
+
+        mime_types = {
+            'png': 'image/png',
+            'jpg': 'image/jpeg',
+            'jpeg': 'image/jpeg',
+            'webp': 'image/webp',
+            'gif': 'image/gif'
+        }
+        ext = os.path.splitext(file_path)[1].lower()[1:]
+        mime_type = mime_types.get(ext)
+        if not mime_type:
+            raise ValueError(f"不支持的文件类型: {ext}。仅支持: {', '.join(mime_types.keys())}")
+
+        with open(file_path, 'rb') as file:
+            files = {'file': (os.path.basename(file_path), file.read(), mime_type)}
+
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        response = await self._request('POST', api_url, headers=headers, files=files, data={'user': user_id},
+                                       timeout=to_httpx_timeout(FILE_TIMEOUT))
+        if response.status_code in [200, 201]:
+            return response.json()
+        else:
+            raise Exception(f"文件上传失败: [{response.status_code}] {response.text}")
@@ -4,15 +4,433 @@
 
 # 第三方库导入
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from airflow.models import Variable
+from utils.redis import RedisHandler
+from dataclasses import dataclass, field, asdict
+from typing import Iterator, Optional
+import hashlib
 import json
 import os
+import threading
+import time
+
+
+# 超时配置（秒）: (连接超时, 读取超时)
+# 流式响应的读取超时指两个数据块之间的最大间隔，而不是整个响应的耗时
+DEFAULT_TIMEOUT = (5, 60)
+STREAM_TIMEOUT = (5, 120)
+FILE_TIMEOUT = (5, 120)
+
+# 连接池大小，同一个Worker进程内并发访问同一个Dify时最多保持的连接数
+POOL_MAXSIZE = 20
+
+# 幂等请求（GET/DELETE）在连接失败或网关错误时的重试次数和退避系数
+# POST（发送消息、上传文件等）不自动重试，避免重复生成回复
+IDEMPOTENT_RETRY = Retry(
+    total=3,
+    connect=3,
+    read=2,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS', 'DELETE']),
+    raise_on_status=False
+)
+
+# 每个base_url共享一个Session，复用TCP/TLS连接
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url):
+    """
+    获取base_url对应的共享Session（带连接池和幂等请求重试）
+    """
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=IDEMPOTENT_RETRY)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[base_url] = session
+        return session
+
+
+# 会话ID缓存（Redis哈希表）: 个人微信按 Dify用户 存储 房间ID -> 会话ID，公众号按 OpenID 存储
+ROOM_CONVERSATION_CACHE_KEY = "{user_id}_conversation_ids"
+MP_CONVERSATION_CACHE_KEY = "wechat_mp_conversation_ids"
+
+# 旧版本保存在Airflow Variable中的会话映射，缓存未命中时读取一次并迁移到Redis
+ROOM_CONVERSATION_VARIABLE_KEY = "{user_id}_conversation_infos"
+MP_CONVERSATION_VARIABLE_KEY = "wechat_mp_conversation_infos"
+
+
+class ConversationNotFoundError(Exception):
+    """
+    Dify返回会话不存在（会话已被删除或已过期）
+    """
+
+
+def _get_cached_conversation_id(cache_key, field, variable_key):
+    """
+    读取缓存的会话ID，不校验会话是否仍然有效（失效时发送消息会返回会话不存在，再创建新会话）
+    """
+    redis_handler = RedisHandler()
+    conversation_id = redis_handler.get_hash_field(cache_key, field)
+    if conversation_id:
+        return conversation_id
+
+    # 兼容旧版本: 从Variable迁移
+    conversation_infos = Variable.get(variable_key, default_var={}, deserialize_json=True)
+    conversation_id = conversation_infos.get(field, "")
+    if conversation_id:
+        redis_handler.set_hash_field(cache_key, field, conversation_id)
+    return conversation_id
+
+
+def _clear_cached_conversation_id(cache_key, field, variable_key):
+    """
+    删除缓存的会话ID（同时删除旧版本Variable中的映射，避免被重新迁移）
+    """
+    RedisHandler().delete_hash_field(cache_key, field)
+    conversation_infos = Variable.get(variable_key, default_var={}, deserialize_json=True)
+    if field in conversation_infos:
+        del conversation_infos[field]
+        Variable.set(variable_key, conversation_infos, serialize_json=True)
+
+
+def get_room_conversation_id(user_id, room_id):
+    """
+    获取房间对应的会话ID，没有时返回空字符串
+    """
+    return _get_cached_conversation_id(ROOM_CONVERSATION_CACHE_KEY.format(user_id=user_id), room_id,
+                                       ROOM_CONVERSATION_VARIABLE_KEY.format(user_id=user_id))
+
+
+def save_room_conversation_id(user_id, room_id, conversation_id):
+    """
+    保存房间对应的会话ID
+    """
+    RedisHandler().set_hash_field(ROOM_CONVERSATION_CACHE_KEY.format(user_id=user_id), room_id, conversation_id)
+
+
+def clear_room_conversation_id(user_id, room_id):
+    """
+    清除房间对应的会话ID，下次对话时创建新会话
+    """
+    _clear_cached_conversation_id(ROOM_CONVERSATION_CACHE_KEY.format(user_id=user_id), room_id,
+                                  ROOM_CONVERSATION_VARIABLE_KEY.format(user_id=user_id))
+
+
+def forget_conversation_id(user_id, conversation_id):
+    """
+    会话被删除后，清除指向该会话的房间映射
+    """
+    cache_key = ROOM_CONVERSATION_CACHE_KEY.format(user_id=user_id)
+    conversation_ids = RedisHandler().get_hash_all(cache_key)
+    for room_id, conv_id in conversation_ids.items():
+        if conv_id == conversation_id:
+            clear_room_conversation_id(user_id, room_id)
+
+
+def get_user_conversation_id(user_id):
+    """
+    获取公众号用户对应的会话ID，没有时返回空字符串
+    """
+    return _get_cached_conversation_id(MP_CONVERSATION_CACHE_KEY, user_id, MP_CONVERSATION_VARIABLE_KEY)
+
+
+def save_user_conversation_id(user_id, conversation_id):
+    """
+    保存公众号用户对应的会话ID
+    """
+    RedisHandler().set_hash_field(MP_CONVERSATION_CACHE_KEY, user_id, conversation_id)
+
+
+def is_conversation_not_found(response):
+    """
+    判断Dify的错误响应是否为会话不存在
+    """
+    return response.status_code == 404 and "conversation" in response.text.lower()
+
+
+# 上传文件缓存: 按 Dify地址+API Key 和 文件内容哈希 缓存上传后的文件信息，相同图片（表情包、转发的海报等）不重复上传
+UPLOAD_FILE_CACHE_KEY = "dify_upload_file:{agent_fingerprint}:{content_hash}"
+# 上传文件ID -> 缓存键和本地文件路径，文件在Dify失效时删除缓存并重新上传
+UPLOAD_FILE_SOURCE_KEY = "dify_upload_file_source:{upload_file_id}"
+# 缓存时间（秒），不超过Dify清理上传文件的周期，可通过Airflow变量 DIFY_UPLOAD_FILE_CACHE_TTL 修改
+DEFAULT_UPLOAD_FILE_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+# 语音识别结果缓存: 按 Dify地址+API Key 和 原始语音内容哈希 缓存识别出的文字（转发的语音、重试时不重复识别）
+TRANSCRIPT_CACHE_KEY = "dify_transcript:{agent_fingerprint}:{content_hash}"
+DEFAULT_TRANSCRIPT_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def get_file_content_hash(file_path):
+    """
+    计算文件内容的SHA256
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_upload_file_not_found(response):
+    """
+    判断Dify的错误响应是否为上传的文件不存在（文件已被清理）
+    """
+    text = response.text.lower()
+    return response.status_code in (400, 404) and (
+        "invalid upload file" in text or ("file" in text and ("not found" in text or "not exist" in text))
+    )
+
+
+@dataclass
+class StreamEvent:
+    """
+    流式响应事件基类，raw为Dify返回的原始事件数据
+    """
+    event: str
+    task_id: Optional[str] = None
+    raw: dict = field(default_factory=dict, repr=False)
+
+
+@dataclass
+class MessageChunk(StreamEvent):
+    """
+    回答文本片段（message / agent_message 事件）
+    """
+    answer: str = ""
+    message_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+
+
+@dataclass
+class WorkflowStarted(StreamEvent):
+    workflow_run_id: Optional[str] = None
+
+
+@dataclass
+class WorkflowFinished(StreamEvent):
+    status: Optional[str] = None
+    elapsed_time: Optional[float] = None
+    total_tokens: Optional[int] = None
+
+
+@dataclass
+class NodeStarted(StreamEvent):
+    node_id: Optional[str] = None
+    node_type: Optional[str] = None
+    title: Optional[str] = None
+
+
+@dataclass
+class NodeFinished(StreamEvent):
+    node_id: Optional[str] = None
+    node_type: Optional[str] = None
+    title: Optional[str] = None
+    status: Optional[str] = None
+    elapsed_time: Optional[float] = None
+
+
+@dataclass
+class MessageEnd(StreamEvent):
+    """
+    回答结束，metadata与create_chat_message_stream返回的元数据字典一致（含stream_metrics）
+    """
+    message_id: Optional[str] = None
+    conversation_id: Optional[str] = None
+    usage: dict = field(default_factory=dict)
+    metadata: dict = field(default_factory=dict)
+
+
+@dataclass
+class StreamMetrics:
+    """
+    流式响应的耗时和用量统计，时间单位为毫秒，从发出请求开始计时
+    """
+    ttft_ms: Optional[float] = None
+    total_latency_ms: Optional[float] = None
+    chunk_count: int = 0
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    node_durations_ms: dict = field(default_factory=dict)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class StreamCollector:
+    """
+    解析Dify流式响应（SSE），把原始事件转换为类型化事件，同时汇总完整回答文本、元数据和耗时统计
+    同步和异步客户端共用
+    """
+
+    def __init__(self):
+        self.full_answer = ""
+        self.metadata = {}
+        self.task_id = None
+        self.workflow_metadata = {}
+        self.metrics = StreamMetrics()
+        self._start = time.perf_counter()
+        self._node_starts = {}
+
+    def start(self):
+        """
+        发出请求时调用，作为TTFT和总耗时的起点
+        """
+        self._start = time.perf_counter()
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self._start) * 1000, 1)
+
+    def feed_line(self, line):
+        """
+        处理一行SSE数据，非 "data: " 开头的行（如心跳）直接忽略
+
+        Returns:
+            StreamEvent: 类型化事件，无法识别的事件返回None
+        """
+        if not line.startswith("data: "):
+            return None
+        # 跳过 "data: " 前缀并解析 JSON
+        return self.feed(json.loads(line[6:]))
+
+    def feed(self, data):
+        """
+        处理一个事件
+
+        Returns:
+            StreamEvent: 类型化事件，无法识别的事件返回None
+        """
+        event = data.get("event")
+        workflow_metadata = self.workflow_metadata
+        
+        # 保存task_id
+        if "task_id" in data:
+            self.task_id = data["task_id"]
+
+        # 处理不同类型的事件
+        if event in ("message", "agent_message"):
+            # 累积回答文本
+            answer_chunk = data.get("answer", "")
+            if answer_chunk and self.metrics.ttft_ms is None:
+                self.metrics.ttft_ms = self._elapsed_ms()
+            self.metrics.chunk_count += 1
+            self.full_answer += answer_chunk
+            return MessageChunk(event=event, task_id=self.task_id, raw=data, answer=answer_chunk,
+                                message_id=data.get("message_id"), conversation_id=data.get("conversation_id"))
+            
+        elif event == "message_end":
+            usage = data.get("usage") or {}
+            self.metrics.total_latency_ms = self._elapsed_ms()
+            self.metrics.prompt_tokens = usage.get("prompt_tokens")
+            self.metrics.completion_tokens = usage.get("completion_tokens")
+            self.metrics.total_tokens = usage.get("total_tokens")
+
+            # 保存元数据
+            self.metadata = {
+                "message_id": data.get("message_id"),
+                "conversation_id": data.get("conversation_id"),
+                "metadata": data.get("metadata"),
+                "usage": data.get("usage"),
+                "retriever_resources": data.get("retriever_resources"),
+                "task_id": self.task_id,  # 添加task_id到元数据中
+                "workflow_metadata": workflow_metadata,  # 添加workflow相关信息
+                "stream_metrics": self.metrics.to_dict()  # 添加耗时统计
+            }
+            return MessageEnd(event=event, task_id=self.task_id, raw=data, message_id=data.get("message_id"),
+                              conversation_id=data.get("conversation_id"), usage=usage, metadata=self.metadata)
+            
+        elif event == "workflow_started":
+            workflow_metadata["workflow_id"] = data.get("workflow_run_id")
+            workflow_metadata["started_at"] = data.get("data", {}).get("created_at")
+            return WorkflowStarted(event=event, task_id=self.task_id, raw=data,
+                                   workflow_run_id=data.get("workflow_run_id"))
+            
+        elif event == "workflow_finished":
+            workflow_data = data.get("data", {})
+            workflow_metadata.update({
+                "status": workflow_data.get("status"),
+                "elapsed_time": workflow_data.get("elapsed_time"),
+                "total_tokens": workflow_data.get("total_tokens"),
+                "total_steps": workflow_data.get("total_steps"),
+                "finished_at": workflow_data.get("finished_at")
+            })
+            return WorkflowFinished(event=event, task_id=self.task_id, raw=data, status=workflow_data.get("status"),
+                                    elapsed_time=workflow_data.get("elapsed_time"),
+                                    total_tokens=workflow_data.get("total_tokens"))
+            
+        elif event == "node_started":
+            node_data = data.get("data", {})
+            self._node_starts[node_data.get("node_id")] = time.perf_counter()
+            if "nodes" not in workflow_metadata:
+                workflow_metadata["nodes"] = []
+            workflow_metadata["nodes"].append({
+                "node_id": node_data.get("node_id"),
+                "node_type": node_data.get("node_type"),
+                "title": node_data.get("title"),
+                "status": "started",
+                "started_at": node_data.get("created_at")
+            })
+            return NodeStarted(event=event, task_id=self.task_id, raw=data, node_id=node_data.get("node_id"),
+                               node_type=node_data.get("node_type"), title=node_data.get("title"))
+            
+        elif event == "node_finished":
+            node_data = data.get("data", {})
+            node_id = node_data.get("node_id")
+            started = self._node_starts.pop(node_id, None)
+            if started is not None:
+                node_name = node_data.get("title") or node_id
+                self.metrics.node_durations_ms[node_name] = round((time.perf_counter() - started) * 1000, 1)
+            for node in workflow_metadata.get("nodes", []):
+                if node.get("node_id") == node_id:
+                    node.update({
+                        "status": node_data.get("status"),
+                        "elapsed_time": node_data.get("elapsed_time"),
+                        "execution_metadata": node_data.get("execution_metadata"),
+                        "finished_at": node_data.get("created_at")
+                    })
+            return NodeFinished(event=event, task_id=self.task_id, raw=data, node_id=node_id,
+                                node_type=node_data.get("node_type"), title=node_data.get("title"),
+                                status=node_data.get("status"), elapsed_time=node_data.get("elapsed_time"))
+                    
+        elif event == "error":
+            error_msg = data.get("message", "未知错误")
+            raise Exception(f"流式响应错误: {error_msg}")
+
+        return None
+
+    def result(self):
+        """
+        Returns:
+            tuple: (完整回答文本, 元数据字典)
+        """
+        if self.metrics.total_latency_ms is None:
+            self.metrics.total_latency_ms = self._elapsed_ms()
+        return self.full_answer, self.metadata
+
+    def summary(self):
+        """
+        单行的耗时统计，用于日志
+        """
+        m = self.metrics
+        return (f"TTFT: {m.ttft_ms}ms, 总耗时: {m.total_latency_ms}ms, 片段数: {m.chunk_count}, "
+                f"tokens: {m.prompt_tokens}/{m.completion_tokens}/{m.total_tokens}, 节点耗时: {m.node_durations_ms}")
 
 
 class DifyAgent:
-    def __init__(self, api_key, base_url):
+    def __init__(self, api_key, base_url, timeout=DEFAULT_TIMEOUT):
         self.api_key = api_key
         self.base_url = base_url
+        self.timeout = timeout
+        self.session = get_session(base_url)
         self.headers = {
             'Authorization': f'Bearer {api_key}',
             'Content-Type': 'application/json'
@@ -42,7 +460,15 @@ class DifyAgent:
         print(f"url: {url}")
         print(f"payload: {payload}")
         print("="*50)
-        response = requests.post(url, headers=self.headers, json=payload)
+        response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
+        if conversation_id and is_conversation_not_found(response):
+            # 缓存的会话已失效，使用新会话重试
+            print(f"会话 {conversation_id} 不存在，创建新会话")
+            return self.create_chat_message(query, user_id, "", inputs, files)
+        if files and is_upload_file_not_found(response):
+            # 缓存的上传文件已失效，重新上传后重试一次
+            payload["files"] = self.refresh_upload_files(files)
+            response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
         if response.status_code == 200:
             return response.json()
         else:
@@ -60,7 +486,7 @@ class DifyAgent:
             "sort_by": sort_by
         }
         
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self.session.get(url, headers=self.headers, params=params, timeout=self.timeout)
         if response.status_code == 200:
             print(f"获取会话列表成功: {response.json()}")  
             print("="*50)
@@ -79,36 +505,18 @@ class DifyAgent:
             room_id (str): 房间ID
             
         Returns:
-            str: 会话ID。如果找不到有效会话则返回空字符串
+            str: 会话ID。如果没有缓存的会话则返回空字符串，由调用方创建新会话
             
         说明:
-            1. 先从缓存中获取会话ID
-            2. 如果缓存中有会话ID,则检查该会话是否仍然有效
-            3. 如果会话无效或不存在,则返回空字符串,由调用方创建新会话
+            缓存的会话ID直接使用，不再每次调用会话列表接口校验；
+            会话失效时发送消息会收到会话不存在错误，create_chat_message_stream 会自动用新会话重试
         """
-        conversation_infos = Variable.get(f"{user_id}_conversation_infos", default_var={}, deserialize_json=True)
-        
-        # 检查是否存在会话ID
-        conversation_id = conversation_infos.get(room_id)
+        conversation_id = get_room_conversation_id(user_id, room_id)
         if conversation_id:
             print(f"{user_id} 使用已存在的会话ID: {conversation_id}")
-            # 尝试获取会话列表
-            conversations = self.list_conversations(user_id=user_id, limit=100)
-            conversation_exists = False
-            # 检查会话是否存在且状态正常
-            if conversations.get("data"):
-                for conv in conversations["data"]:
-                    if conv.get("id") == conversation_id and conv.get("status") == "normal":
-                        conversation_exists = True
-                        break
-            if not conversation_exists:
-                pass
-            else:
-                print(f"{user_id} 使用已存在的会话ID: {conversation_id}")
-                return conversation_id
         else:
             print(f"{user_id} 没有找到会话ID")
-        return ""
+        return conversation_id
 
     def get_conversation_id_for_user(self, user_id):
         """
@@ -118,37 +526,14 @@ class DifyAgent:
             user_id (str): 用户标识（如微信公众号的OpenID）
             
         Returns:
-            str: 会话ID。如果找不到有效会话则返回空字符串
-            
-        说明:
-            1. 先从缓存中获取会话ID
-            2. 如果缓存中有会话ID,则检查该会话是否仍然有效
-            3. 如果会话无效或不存在,则返回空字符串,由调用方创建新会话
+            str: 会话ID。如果没有缓存的会话则返回空字符串，由调用方创建新会话
         """
-        conversation_infos = Variable.get("wechat_mp_conversation_infos", default_var={}, deserialize_json=True)
-        
-        # 检查是否存在会话ID
-        conversation_id = conversation_infos.get(user_id)
+        conversation_id = get_user_conversation_id(user_id)
         if conversation_id:
             print(f"用户 {user_id} 使用已存在的会话ID: {conversation_id}")
-            # 尝试获取会话列表
-            conversations = self.list_conversations(user_id=user_id, limit=100)
-            conversation_exists = False
-            # 检查会话是否存在且状态正常
-            if conversations.get("data"):
-                for conv in conversations["data"]:
-                    if conv.get("id") == conversation_id and conv.get("status") == "normal":
-                        conversation_exists = True
-                        break
-            if not conversation_exists:
-                print(f"用户 {user_id} 的会话 {conversation_id} 不存在或状态异常")
-                return ""
-            else:
-                print(f"用户 {user_id} 使用已存在的会话ID: {conversation_id}")
-                return conversation_id
         else:
             print(f"用户 {user_id} 没有找到会话ID")
-        return ""
+        return conversation_id
 
     def rename_conversation(self, conversation_id, user_id, name="", auto_generate=False):
         """
@@ -183,7 +568,7 @@ class DifyAgent:
             raise ValueError("必须提供name或设置auto_generate=True")
         
         print(f"重命名会话, url: {url}, payload: {payload}")
-        response = requests.post(url, headers=self.headers, json=payload)
+        response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
         if response.status_code == 200:
             return response.json()
         else:
@@ -231,7 +616,7 @@ class DifyAgent:
             "limit": limit
         }
         
-        response = requests.get(url, headers=self.headers, params=params)
+        response = self.session.get(url, headers=self.headers, params=params, timeout=self.timeout)
         if response.status_code == 200:
             messages = response.json()["data"]
             return messages
@@ -257,16 +642,10 @@ class DifyAgent:
             "user": user_id
         }
         
-        response = requests.delete(url, headers=self.headers, json=payload)
+        response = self.session.delete(url, headers=self.headers, json=payload, timeout=self.timeout)
         if response.status_code == 200:
-            # 从本地存储中删除会话ID映射
-            conversation_infos = Variable.get(f"{user_id}_conversation_infos", default_var={}, deserialize_json=True)
-            # 找到并删除对应的room_id
-            for room_id, conv_id in list(conversation_infos.items()):
-                if conv_id == conversation_id:
-                    del conversation_infos[room_id]
-                    Variable.set(f"{user_id}_conversation_infos", conversation_infos, serialize_json=True)
-                    break
+            # 从缓存中删除会话ID映射
+            forget_conversation_id(user_id, conversation_id)
             return response.json()
         else:
             raise Exception(f"删除会话失败: {response.text}")
@@ -296,7 +675,7 @@ class DifyAgent:
         }
         
         print(f"创建消息反馈, url: {url}, payload: {payload}")  # 添加日志
-        response = requests.post(url, headers=self.headers, json=payload)
+        response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
         
         if response.status_code == 200:
             return response.json()
@@ -305,9 +684,10 @@ class DifyAgent:
             error_msg = f"状态码: {response.status_code}, 响应内容: {response.text}"
             raise Exception(f"创建消息反馈失败: {error_msg}")
 
-    def create_chat_message_stream(self, query, user_id, conversation_id="", inputs=None, files=None):
+    def iter_chat_message_stream(self, query, user_id, conversation_id="", inputs=None, files=None,
+                                 collector=None) -> Iterator[StreamEvent]:
         """
-        创建聊天消息并以流式方式返回结果
+        创建聊天消息，以生成器方式逐个返回类型化的流式事件，调用方可以在回答完成前处理已生成的内容
         
         Args:
             query (str): 用户输入内容
@@ -315,10 +695,9 @@ class DifyAgent:
             conversation_id (str, optional): 会话ID
             inputs (dict, optional): 输入参数
             files (list, optional): 文件列表
-        Returns:
-            tuple: (完整回答文本, 元数据字典)
-                - 完整回答文本: AI助手的完整回答内容
-                - 元数据字典: 包含message_id, conversation_id, task_id等信息
+            collector (StreamCollector, optional): 传入时可在迭代结束后读取完整回答、元数据和耗时统计
+        Yields:
+            StreamEvent: MessageChunk / NodeStarted / NodeFinished / WorkflowStarted / WorkflowFinished / MessageEnd
         """
         if inputs is None:
             inputs = {}
@@ -326,6 +705,9 @@ class DifyAgent:
         if files is None:
             files = []
 
+        if collector is None:
+            collector = StreamCollector()
+
         url = f"{self.base_url}/chat-messages"
         payload = {
             "inputs": inputs,
@@ -337,93 +719,51 @@ class DifyAgent:
             "files": files
         }
 
-        full_answer = ""
-        metadata = {}
-        task_id = None
-        workflow_metadata = {}
-        
         print(f"创建聊天消息, url: {url}, payload: {payload}")
-        with requests.post(url, headers=self.headers, json=payload, stream=True) as response:
-            if response.status_code != 200:
-                raise Exception(f"创建消息失败: {response.text}")
-            
-            for line in response.iter_lines():
-                if line:
-                    # 移除 "data: " 前缀并解析 JSON
-                    line = line.decode('utf-8')
-                    if not line.startswith("data: "):
+        collector.start()
+        # 缓存的会话已失效时，使用新会话重试一次；调用方通过元数据中的conversation_id保存新会话
+        files_refreshed = False
+        while True:
+            with self.session.post(url, headers=self.headers, json=payload, stream=True, timeout=STREAM_TIMEOUT) as response:
+                if response.status_code != 200:
+                    if payload["conversation_id"] and is_conversation_not_found(response):
+                        print(f"会话 {payload['conversation_id']} 不存在，创建新会话")
+                        payload["conversation_id"] = ""
                         continue
-                    
-                    data = json.loads(line[6:])  # 跳过 "data: " 前缀
-                    print(f"data: {data}")
-                    event = data.get("event")
-                    
-                    # 保存task_id和message_id
-                    if "task_id" in data:
-                        task_id = data["task_id"]
-                    if "message_id" in data:
-                        message_id = data["message_id"]
-
-                    # 处理不同类型的事件
-                    if event == "message":
-                        # 累积回答文本
-                        answer_chunk = data.get("answer", "")
-                        full_answer += answer_chunk
-                        
-                    elif event == "message_end":
-                        # 保存元数据
-                        metadata = {
-                            "message_id": data.get("message_id"),
-                            "conversation_id": data.get("conversation_id"),
-                            "metadata": data.get("metadata"),
-                            "usage": data.get("usage"),
-                            "retriever_resources": data.get("retriever_resources"),
-                            "task_id": task_id,  # 添加task_id到元数据中
-                            "workflow_metadata": workflow_metadata  # 添加workflow相关信息
-                        }
-                        
-                    elif event == "workflow_started":
-                        workflow_metadata["workflow_id"] = data.get("workflow_run_id")
-                        workflow_metadata["started_at"] = data.get("data", {}).get("created_at")
-                        
-                    elif event == "workflow_finished":
-                        workflow_data = data.get("data", {})
-                        workflow_metadata.update({
-                            "status": workflow_data.get("status"),
-                            "elapsed_time": workflow_data.get("elapsed_time"),
-                            "total_tokens": workflow_data.get("total_tokens"),
-                            "total_steps": workflow_data.get("total_steps"),
-                            "finished_at": workflow_data.get("finished_at")
-                        })
-                        
-                    elif event == "node_started":
-                        node_data = data.get("data", {})
-                        if "nodes" not in workflow_metadata:
-                            workflow_metadata["nodes"] = []
-                        workflow_metadata["nodes"].append({
-                            "node_id": node_data.get("node_id"),
-                            "node_type": node_data.get("node_type"),
-                            "title": node_data.get("title"),
-                            "status": "started",
-                            "started_at": node_data.get("created_at")
-                        })
-                        
-                    elif event == "node_finished":
-                        node_data = data.get("data", {})
-                        for node in workflow_metadata.get("nodes", []):
-                            if node.get("node_id") == node_data.get("node_id"):
-                                node.update({
-                                    "status": node_data.get("status"),
-                                    "elapsed_time": node_data.get("elapsed_time"),
-                                    "execution_metadata": node_data.get("execution_metadata"),
-                                    "finished_at": node_data.get("created_at")
-                                })
-                                
-                    elif event == "error":
-                        error_msg = data.get("message", "未知错误")
-                        raise Exception(f"流式响应错误: {error_msg}")
-        
-        return full_answer, metadata
+                    if payload["files"] and not files_refreshed and is_upload_file_not_found(response):
+                        # 缓存的上传文件已失效，重新上传后重试一次
+                        payload["files"] = self.refresh_upload_files(payload["files"])
+                        files_refreshed = True
+                        continue
+                    raise Exception(f"创建消息失败: {response.text}")
+
+                for line in response.iter_lines():
+                    if line:
+                        event = collector.feed_line(line.decode('utf-8'))
+                        if event is not None:
+                            yield event
+                return
+
+    def create_chat_message_stream(self, query, user_id, conversation_id="", inputs=None, files=None):
+        """
+        创建聊天消息并以流式方式返回结果（等待回答完成后一次性返回）
+        
+        Args:
+            query (str): 用户输入内容
+            user_id (str): 用户标识
+            conversation_id (str, optional): 会话ID
+            inputs (dict, optional): 输入参数
+            files (list, optional): 文件列表
+        Returns:
+            tuple: (完整回答文本, 元数据字典)
+                - 完整回答文本: AI助手的完整回答内容
+                - 元数据字典: 包含message_id, conversation_id, task_id, stream_metrics等信息
+        """
+        collector = StreamCollector()
+        for _ in self.iter_chat_message_stream(query, user_id, conversation_id, inputs, files, collector=collector):
+            pass
+        print(f"流式响应完成, {collector.summary()}")
+        return collector.result()
 
     def stop_chat_message(self, task_id, user_id):
         """
@@ -445,7 +785,7 @@ class DifyAgent:
             "user": user_id
         }
         
-        response = requests.post(url, headers=self.headers, json=payload)
+        response = self.session.post(url, headers=self.headers, json=payload, timeout=self.timeout)
         if response.status_code == 200:
             return response.json()
         else:
@@ -482,7 +822,7 @@ class DifyAgent:
             
             # 发送请求
             headers = {'Authorization': f'Bearer {self.api_key}'}
-            response = requests.post(api_url, headers=headers, files=files)
+            response = self.session.post(api_url, headers=headers, files=files, timeout=FILE_TIMEOUT)
         
         # 处理响应
         if response.status_code == 200:
@@ -491,6 +831,42 @@ class DifyAgent:
         else:
             raise Exception(f"语音转文字失败: [{response.status_code}] {response.text}")
 
+    def audio_to_text_cached(self, audio_file_path, preprocess=None):
+        """
+        将语音文件转换为文字，相同内容的语音在缓存有效期内直接返回上次的识别结果
+
+        Args:
+            audio_file_path (str): 本地语音文件路径
+            preprocess (callable, optional): 未命中缓存时的预处理函数，接收文件路径，返回处理后的文件路径
+        Returns:
+            str: 转换后的文字内容
+        """
+        redis_handler = RedisHandler()
+        cache_key = TRANSCRIPT_CACHE_KEY.format(agent_fingerprint=self.agent_fingerprint,
+                                                content_hash=get_file_content_hash(audio_file_path))
+        try:
+            cached_text = redis_handler.client.get(cache_key)
+            if cached_text:
+                print(f"语音识别命中缓存: {audio_file_path}")
+                return cached_text
+        except Exception as error:
+            # 缓存不可用时正常识别
+            print(f"读取语音识别缓存失败: {error}")
+
+        if preprocess is not None:
+            try:
+                audio_file_path = preprocess(audio_file_path)
+            except Exception as error:
+                print(f"语音预处理失败，使用原始文件: {error}")
+        text = self.audio_to_text(audio_file_path)
+
+        if text.strip():
+            try:
+                redis_handler.client.set(cache_key, text, ex=DEFAULT_TRANSCRIPT_CACHE_TTL)
+            except Exception as error:
+                print(f"写入语音识别缓存失败: {error}")
+        return text
+
     def text_to_audio(self, text, user_id, save_path):
         """
         将文字转换为语音并保存到指定路径
@@ -521,7 +897,7 @@ class DifyAgent:
         }
         
         # 使用流式下载，直接保存到文件
-        with requests.post(api_url, headers=headers, json=payload, stream=True) as response:
+        with self.session.post(api_url, headers=headers, json=payload, stream=True, timeout=FILE_TIMEOUT) as response:
             if response.status_code == 200:
                 with open(save_path, 'wb') as f:
                     for chunk in response.iter_content(chunk_size=8192):
@@ -586,10 +962,81 @@ class DifyAgent:
             
             # 发送请求
             headers = {'Authorization': f'Bearer {self.api_key}'}
-            response = requests.post(api_url, headers=headers, files=files, data=data)
+            response = self.session.post(api_url, headers=headers, files=files, data=data, timeout=FILE_TIMEOUT)
         
         # 处理响应
         if response.status_code in [200, 201]:  # 同时接受200和201状态码
             return response.json()
         else:
             raise Exception(f"文件上传失败: [{response.status_code}] {response.text}")
+
+    @property
+    def agent_fingerprint(self):
+        return hashlib.sha1(f"{self.base_url}|{self.api_key}".encode('utf-8')).hexdigest()[:12]
+
+    def _upload_file_cache_key(self, content_hash):
+        return UPLOAD_FILE_CACHE_KEY.format(agent_fingerprint=self.agent_fingerprint, content_hash=content_hash)
+
+    def upload_file_cached(self, file_path, user_id):
+        """
+        上传文件到 Dify 平台，相同内容的文件在缓存有效期内直接返回上次的上传结果
+
+        Returns:
+            dict: 同 upload_file，命中缓存时包含 "cached": True
+        """
+        redis_handler = RedisHandler()
+        cache_key = self._upload_file_cache_key(get_file_content_hash(file_path))
+        try:
+            cached_info = redis_handler.client.get(cache_key)
+            if cached_info:
+                file_info = json.loads(cached_info)
+                print(f"上传文件命中缓存: {file_path}, 文件ID: {file_info.get('id')}")
+                return dict(file_info, cached=True)
+        except Exception as error:
+            # 缓存不可用时正常上传
+            print(f"读取上传文件缓存失败: {error}")
+
+        file_info = self.upload_file(file_path, user_id)
+        try:
+            ttl = int(Variable.get("DIFY_UPLOAD_FILE_CACHE_TTL", default_var=DEFAULT_UPLOAD_FILE_CACHE_TTL))
+            source = {"cache_key": cache_key, "file_path": os.path.abspath(file_path), "user_id": user_id}
+            pipe = redis_handler.client.pipeline()
+            pipe.set(cache_key, json.dumps(file_info, ensure_ascii=False), ex=ttl)
+            pipe.set(UPLOAD_FILE_SOURCE_KEY.format(upload_file_id=file_info['id']), json.dumps(source, ensure_ascii=False), ex=ttl)
+            pipe.execute()
+        except Exception as error:
+            print(f"写入上传文件缓存失败: {error}")
+        return file_info
+
+    def refresh_upload_files(self, files):
+        """
+        Dify返回上传的文件不存在时调用: 删除失效的缓存，本地文件仍存在时重新上传，否则去掉该文件
+
+        Args:
+            files (list): 发送消息的文件列表
+        Returns:
+            list: 更新后的文件列表
+        """
+        redis_handler = RedisHandler()
+        refreshed_files = []
+        for file in files:
+            upload_file_id = file.get("upload_file_id")
+            if file.get("transfer_method") != "local_file" or not upload_file_id:
+                refreshed_files.append(file)
+                continue
+
+            source_key = UPLOAD_FILE_SOURCE_KEY.format(upload_file_id=upload_file_id)
+            source = redis_handler.client.get(source_key)
+            source = json.loads(source) if source else {}
+            redis_handler.client.delete(source_key)
+            if source.get("cache_key"):
+                redis_handler.client.delete(source["cache_key"])
+
+            file_path = source.get("file_path")
+            if file_path and os.path.exists(file_path):
+                file_info = self.upload_file_cached(file_path, source.get("user_id", ""))
+                print(f"文件 {upload_file_id} 已失效，重新上传: {file_info.get('id')}")
+                refreshed_files.append(dict(file, upload_file_id=file_info['id']))
+            else:
+                print(f"文件 {upload_file_id} 已失效，本地文件不存在，不再发送该文件")
+        return refreshed_files
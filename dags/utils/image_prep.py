@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片预处理模块
+
+微信收到的手机照片通常有3~8MB，原图直接base64发给视觉模型或上传到Dify，上传慢、请求体大，
+视觉token也按分辨率计费。发送前统一预处理:
+- 只解码一次，按EXIF方向旋转后丢弃EXIF（同时去掉GPS等隐私信息）
+- 按模型缩放到最长边上限（超过上限的部分模型也会在服务端缩小，多传的像素没有意义）
+- 重新编码为JPEG，二分查找满足字节预算的最高质量，最低质量仍超出预算时继续缩小
+- 结果按 原图内容哈希 + 处理参数 缓存到本地临时目录，同一张图片（如重试、多次提问）不重复处理
+
+使用示例:
+    prepared = prepare_image("photo.jpg", max_edge=get_model_max_edge("gpt-4o"))
+    data_url = prepared.to_data_url()
+"""
+
+# 标准库导入
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+# 第三方库导入
+from PIL import Image, ImageOps
+
+
+# 默认最长边（像素）和字节预算
+DEFAULT_MAX_EDGE = 1568
+DEFAULT_MAX_BYTES = 1024 * 1024
+
+# 按模型前缀的最长边上限，服务端会把超出的图片缩小，这里提前缩小到相同尺寸
+MODEL_MAX_EDGES = (
+    ("gpt-", 2048),
+    ("claude-", 1568),
+    ("qwen-vl", 1280),
+)
+
+# 上传到Dify的图片（由Dify再转发给智能体配置的模型）
+DIFY_MAX_EDGE = 1568
+
+# JPEG质量的二分查找范围
+MIN_JPEG_QUALITY = 40
+MAX_JPEG_QUALITY = 90
+
+# 最低质量仍超出预算时，每次缩小的比例
+DOWNSCALE_RATIO = 0.75
+
+# 处理结果的缓存目录和过期时间（秒）
+IMAGE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "image_prep_cache")
+IMAGE_CACHE_TTL = 24 * 60 * 60
+
+
+@dataclass
+class PreparedImage:
+    """
+    预处理后的图片
+    """
+    path: str
+    data: bytes
+    width: int
+    height: int
+    original_bytes: int
+    mime_type: str = "image/jpeg"
+    cached: bool = False
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.to_base64()}"
+
+
+def get_model_max_edge(model_name: str) -> int:
+    """
+    获取模型的图片最长边上限
+    """
+    for prefix, max_edge in MODEL_MAX_EDGES:
+        if (model_name or "").startswith(prefix):
+            return max_edge
+    return DEFAULT_MAX_EDGE
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """
+    转为RGB，透明背景填充为白色（JPEG不支持透明通道）
+    """
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    # 不传exif参数，输出的JPEG不包含EXIF
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _encode_within_budget(image: Image.Image, max_bytes: int) -> bytes:
+    """
+    二分查找不超过字节预算的最高JPEG质量，最低质量仍超出时缩小图片后重试
+    """
+    while True:
+        best = None
+        low, high = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY
+        while low <= high:
+            quality = (low + high) // 2
+            data = _encode_jpeg(image, quality)
+            if len(data) <= max_bytes:
+                best = data
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is not None:
+            return best
+        if max(image.size) <= 256:
+            # 已经很小了，返回最低质量的结果
+            return _encode_jpeg(image, MIN_JPEG_QUALITY)
+        new_size = (max(1, int(image.width * DOWNSCALE_RATIO)), max(1, int(image.height * DOWNSCALE_RATIO)))
+        image = image.resize(new_size, Image.LANCZOS)
+
+
+def _prune_cache(max_age: int = IMAGE_CACHE_TTL):
+    """
+    删除过期的缓存文件
+    """
+    now = time.time()
+    try:
+        with os.scandir(IMAGE_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+    except OSError as error:
+        print(f"[IMAGE_PREP] 清理缓存失败: {error}")
+
+
+def prepare_image(image_path: str, max_edge: int = DEFAULT_MAX_EDGE, max_bytes: int = DEFAULT_MAX_BYTES) -> PreparedImage:
+    """
+    预处理图片: 按EXIF方向旋转、去掉EXIF、缩放到最长边上限、按字节预算重新编码为JPEG
+
+    Args:
+        image_path: 原图路径
+        max_edge: 最长边上限（像素）
+        max_bytes: 字节预算
+
+    Returns:
+        PreparedImage: 处理后的图片，path为缓存目录中的JPEG文件
+    """
+    with open(image_path, "rb") as image_file:
+        raw_data = image_file.read()
+
+    digest = hashlib.sha256(raw_data).hexdigest()
+    cache_path = os.path.join(IMAGE_CACHE_DIR, f"{digest[:32]}_{max_edge}_{max_bytes}.jpg")
+    if os.path.exists(cache_path):
+        with open(cache_path, "rb") as cache_file:
+            data = cache_file.read()
+        with Image.open(io.BytesIO(data)) as cached_image:
+            width, height = cached_image.size
+        print(f"[IMAGE_PREP] 命中缓存: {image_path}")
+        return PreparedImage(cache_path, data, width, height, len(raw_data), cached=True)
+
+    start_time = time.perf_counter()
+    with Image.open(io.BytesIO(raw_data)) as original:
+        original_size = original.size
+        # 动图只取第一帧
+        image = ImageOps.exif_transpose(original)
+        image = _to_rgb(image)
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    data = _encode_within_budget(image, max_bytes)
+
+    with Image.open(io.BytesIO(data)) as encoded:
+        width, height = encoded.size
+
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    _prune_cache()
+    # 先写临时文件再重命名，避免并发读到不完整的文件（可能在多个线程中同时处理同一张图片）
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as cache_file:
+        cache_file.write(data)
+    os.replace(temp_path, cache_path)
+
+    print(f"[IMAGE_PREP] {image_path}: {original_size[0]}x{original_size[1]} {len(raw_data)}B -> "
+          f"{width}x{height} {len(data)}B, 耗时: {(time.perf_counter() - start_time) * 1000:.0f}ms")
+    return PreparedImage(cache_path, data, width, height, len(raw_data))
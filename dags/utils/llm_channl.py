@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
-from anthropic import Anthropic
-from openai import OpenAI
 from airflow.models import Variable
-from contextlib import contextmanager
-import base64
+
+from utils.image_prep import get_model_max_edge
+from utils.image_prep import prepare_image
+from utils.llm_gateway import get_llm_gateway
 
 # LLM模型参数配置
 LLM_CONFIG = {
@@ -16,36 +15,6 @@ LLM_CONFIG = {
     "frequency_penalty": 0.2 # 降低重复内容
 }
 
-@contextmanager
-def proxy_context():
-    """
-    代理设置的上下文管理器
-    """
-    # 保存原始代理设置
-    original_http_proxy = os.environ.get('HTTP_PROXY')
-    original_https_proxy = os.environ.get('HTTPS_PROXY')
-    
-    try:
-        # 设置新代理
-        proxy_url = Variable.get("PROXY_URL", default_var="")
-        if proxy_url:
-            os.environ['HTTPS_PROXY'] = proxy_url
-            os.environ['HTTP_PROXY'] = proxy_url
-        else:
-            os.environ.pop('HTTP_PROXY', None)
-            os.environ.pop('HTTPS_PROXY', None)
-        yield
-    finally:
-        # 恢复原始代理
-        if original_http_proxy:
-            os.environ['HTTP_PROXY'] = original_http_proxy
-        else:
-            os.environ.pop('HTTP_PROXY', None)
-            
-        if original_https_proxy:
-            os.environ['HTTPS_PROXY'] = original_https_proxy
-        else:
-            os.environ.pop('HTTPS_PROXY', None)
 
 def get_llm_response(user_question: str, model_name: str = None, system_prompt: str = None, chat_history: list = None) -> str:
     """
@@ -71,41 +40,22 @@ def get_llm_response(user_question: str, model_name: str = None, system_prompt:
         print(f"[AI] 历史对话: {chat_history}")
         print(f"[AI] 问题: {user_question}")
 
-        # 创建消息列表
-        messages = chat_history or []
-        # 添加当前用户问题
-        messages.append({"role": "user", "content": user_question})
+        # 历史对话作为固定前缀（可命中提示词缓存），只有当前用户问题每次变化
+        prefix_messages = list(chat_history or [])
+        messages = [{"role": "user", "content": user_question}]
 
         print("[AI] 输入消息:")
         print("="*100)
-        for msg in messages:
+        for msg in prefix_messages + messages:
             print(msg)
         print("="*100)
 
-        with proxy_context():
-            if model_name.startswith("gpt-"):
-                api_key = Variable.get("OPENAI_API_KEY")
-                os.environ['OPENAI_API_KEY'] = api_key
-                
-                client = OpenAI()
-                # 加入系统提示词
-                messages.insert(0, {"role": "system", "content": system_prompt})
-                response = client.chat.completions.create(model=model_name, messages=messages, **LLM_CONFIG)
-                ai_response = response.choices[0].message.content.strip()
-                
-            elif model_name.startswith("claude-"):            
-                api_key = Variable.get("CLAUDE_API_KEY")
-                client = Anthropic(api_key=api_key)
-                
-                # 剔除模型不支持的参数
-                LLM_CONFIG.pop("presence_penalty", None)
-                LLM_CONFIG.pop("frequency_penalty", None)
-
-                response = client.messages.create(model=model_name, messages=messages, system=system_prompt, **LLM_CONFIG)
-                ai_response = response.content[0].text
-                
-            else:
-                raise ValueError(f"不支持的模型: {model_name}")
+        # 通过网关调用（并发上限、对冲请求、熔断切换备用模型）
+        result = get_llm_gateway().chat_sync(model_name, messages, system_prompt=system_prompt,
+                                             prefix_messages=prefix_messages, **LLM_CONFIG)
+        print(f"[AI] 模型: {result.model}, 耗时: {result.latency_ms}ms, 对冲: {result.hedged}, 备用: {result.fallback}")
+        print(f"[AI] token用量: {result.usage}")
+        ai_response = result.text.strip()
         
         print(f"[AI] 回复: {ai_response}")
         return ai_response
@@ -141,95 +91,57 @@ def get_llm_response_with_image(user_question: str, image_path: str, model_name:
         print(f"[AI] 图片路径: {image_path}")
         print(f"[AI] 问题: {user_question}")
         
-        # 读取图片文件
-        with open(image_path, "rb") as image_file:
-            image_data = image_file.read()
+        # 预处理图片（按模型缩放、去掉EXIF、压缩到字节预算）
+        prepared_image = prepare_image(image_path, max_edge=get_model_max_edge(model_name))
             
-        with proxy_context():
-            if model_name.startswith("gpt-"):
-                api_key = Variable.get("OPENAI_API_KEY")
-                os.environ['OPENAI_API_KEY'] = api_key
-                client = OpenAI()
-                
-                # 构建消息
-                messages = [{"role": "system", "content": system_prompt}]
-                if chat_history:
-                    messages.extend(chat_history)
-                    
-                # 添加图片和问题
-                if user_question:
-                    messages.append({
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": user_question},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64.b64encode(image_data).decode()}"
-                                }
-                            }
-                        ]
-                    })
-                else:
-                    messages.append({
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64.b64encode(image_data).decode()}"
-                                }
-                            }
-                        ]
-                    })
-                
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=messages,
-                    max_tokens=LLM_CONFIG["max_tokens"],
-                    temperature=LLM_CONFIG["temperature"]
-                )
-                ai_response = response.choices[0].message.content.strip()
-                
-            elif model_name.startswith("claude-"):
-                api_key = Variable.get("CLAUDE_API_KEY")
-                client = Anthropic(api_key=api_key)
-                
-                # 构建消息
-                messages = chat_history or []
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": base64.b64encode(image_data).decode()
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": user_question
+        # 历史对话作为固定前缀（可命中提示词缓存），本次只发送图片和问题（不修改调用方的历史列表）
+        prefix_messages = list(chat_history or [])
+
+        gateway = get_llm_gateway()
+        if gateway.get_protocol(model_name) == "openai":
+            # 添加图片和问题
+            content = [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": prepared_image.to_data_url()
+                    }
+                }
+            ]
+            if user_question:
+                content.insert(0, {"type": "text", "text": user_question})
+            messages = [{"role": "user", "content": content}]
+            
+            params = {"max_tokens": LLM_CONFIG["max_tokens"], "temperature": LLM_CONFIG["temperature"]}
+            
+        else:
+            # 添加图片和问题
+            messages = [{
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image",
+                        "source": {
+                            "type": "base64",
+                            "media_type": prepared_image.mime_type,
+                            "data": prepared_image.to_base64()
                         }
-                    ]
-                })
-                
-                # 剔除模型不支持的参数
-                config = LLM_CONFIG.copy()
-                config.pop("presence_penalty", None)
-                config.pop("frequency_penalty", None)
-                
-                response = client.messages.create(
-                    model=model_name,
-                    messages=messages,
-                    system=system_prompt,
-                    **config
-                )
-                ai_response = response.content[0].text
-                
-            else:
-                raise ValueError(f"不支持的模型: {model_name}")
+                    },
+                    {
+                        "type": "text",
+                        "text": user_question
+                    }
+                ]
+            }]
+            
+            params = LLM_CONFIG
+
+        # 通过网关调用（并发上限、对冲请求、熔断切换备用模型）
+        result = gateway.chat_sync(model_name, messages, system_prompt=system_prompt,
+                                   prefix_messages=prefix_messages, **params)
+        print(f"[AI] 模型: {result.model}, 耗时: {result.latency_ms}ms, 对冲: {result.hedged}, 备用: {result.fallback}")
+        print(f"[AI] token用量: {result.usage}")
+        ai_response = result.text.strip()
                 
         print(f"[AI] 回复: {ai_response}")
         return ai_response
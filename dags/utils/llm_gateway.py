@@ -0,0 +1,687 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 调用网关（进程内）
+
+所有大模型调用经过网关，避免单个厂商变慢时占满所有worker:
+- 每个厂商一个并发上限（信号量），超出的请求排队等待
+- 对冲请求: 请求超过该模型近期p95耗时仍未返回时，再发起一次相同请求，先返回的为准
+- 熔断: 模型连续失败达到阈值后熔断一段时间，期间直接切换到配置的备用模型
+- 每个请求有总时限，包括排队、对冲和切换备用模型的时间
+- 提示词缓存: 系统提示词和固定前缀消息标记为可缓存（见 LLMPrompt），调用结果中记录命中缓存的token数
+
+同步代码（Airflow任务）通过 chat_sync / run_sync 调用，请求在进程内共享的后台事件循环中执行，
+多个线程的请求共用同一组并发上限、连接池、熔断和耗时统计。
+
+使用示例:
+    gateway = get_llm_gateway()
+    result = gateway.chat_sync("gpt-4o-mini", [{"role": "user", "content": "你好"}], system_prompt="...")
+    print(result.text, result.model, result.latency_ms)
+"""
+
+# 标准库导入
+import asyncio
+import concurrent.futures
+import threading
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# 第三方库导入
+from anthropic import AsyncAnthropic
+from anthropic import DefaultAsyncHttpxClient as AnthropicAsyncHttpClient
+from anthropic import Timeout as AnthropicTimeout
+from openai import AsyncOpenAI
+from openai import DefaultAsyncHttpxClient as OpenAIAsyncHttpClient
+from openai import Timeout as OpenAITimeout
+from airflow.models import Variable
+
+
+# 连接超时和单次请求的读取超时（秒），请求总时限由网关控制
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_READ_TIMEOUT = 60.0
+
+# Anthropic协议不支持的参数
+ANTHROPIC_UNSUPPORTED_PARAMS = ("presence_penalty", "frequency_penalty")
+
+# 模型名前缀 -> 路由名称
+MODEL_PREFIX_ROUTES = (
+    ("gpt-", "openai"),
+    ("claude-", "anthropic"),
+    ("qwen", "dashscope"),
+)
+
+# 默认配置，可通过Airflow变量 LLM_GATEWAY_CONFIG（JSON）覆盖
+DEFAULT_GATEWAY_CONFIG = {
+    "vendor_concurrency": {"openai": 8, "anthropic": 4, "dashscope": 8},
+    "fallback_models": {},
+    "deadline_seconds": 60,
+    "hedge": True,
+}
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+# 接口协议 -> (SDK客户端类, HTTP客户端类, 超时类)，HTTP客户端需使用SDK自带的类型
+LLM_VENDORS = {
+    "openai": (AsyncOpenAI, OpenAIAsyncHttpClient, OpenAITimeout),
+    "anthropic": (AsyncAnthropic, AnthropicAsyncHttpClient, AnthropicTimeout),
+}
+
+# 事件循环 -> {(协议, base_url, 代理): HTTP客户端}，客户端只能在创建它们的事件循环中使用
+_http_clients = weakref.WeakKeyDictionary()
+
+# 事件循环 -> {(协议, base_url, 代理, api_key): SDK客户端}
+_llm_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client(protocol: str, base_url: str = None, proxy: str = None):
+    """
+    获取当前事件循环中共享的HTTP客户端，代理只作用于该客户端，不修改进程的环境变量
+
+    Args:
+        protocol: 接口协议，openai 或 anthropic
+        base_url: API地址，为空时使用SDK默认地址
+        proxy: 代理地址，为空时直连
+    """
+    if protocol not in LLM_VENDORS:
+        raise ValueError(f"不支持的接口协议: {protocol}")
+
+    loop_clients = _http_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (protocol, base_url, proxy)
+    if key not in loop_clients:
+        _, http_client_class, _ = LLM_VENDORS[protocol]
+        loop_clients[key] = http_client_class(proxy=proxy or None)
+    return loop_clients[key]
+
+
+def get_llm_client(protocol: str, api_key: str, base_url: str = None, proxy: str = None):
+    """
+    获取当前事件循环中共享的LLM客户端
+
+    Returns:
+        AsyncOpenAI | AsyncAnthropic: SDK客户端
+    """
+    loop_clients = _llm_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (protocol, base_url, proxy, api_key)
+    if key not in loop_clients:
+        client_class, _, timeout_class = LLM_VENDORS[protocol]
+        loop_clients[key] = client_class(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=get_http_client(protocol, base_url, proxy),
+            timeout=timeout_class(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            # 重试由网关的对冲和备用模型负责
+            max_retries=0
+        )
+    return loop_clients[key]
+
+
+def get_llm_params(protocol: str, params: dict) -> dict:
+    """
+    获取模型参数（返回副本，不修改调用方的配置）
+    """
+    if protocol == "anthropic":
+        # 剔除模型不支持的参数
+        return {k: v for k, v in params.items() if k not in ANTHROPIC_UNSUPPORTED_PARAMS}
+    return dict(params)
+
+
+async def close_llm_clients():
+    """
+    关闭当前事件循环中的所有共享客户端
+    """
+    loop = asyncio.get_running_loop()
+    _llm_clients.pop(loop, None)
+    for client in _http_clients.pop(loop, {}).values():
+        await client.aclose()
+
+
+class LLMGatewayError(Exception):
+    """
+    所有可用模型都调用失败或超过请求时限
+    """
+
+
+@dataclass
+class LLMRoute:
+    """
+    一个厂商的接入配置
+
+    protocol: 接口协议，openai（OpenAI兼容接口，包括阿里云百炼）或 anthropic
+    """
+    protocol: str
+    api_key: str
+    base_url: Optional[str] = None
+    proxy: Optional[str] = None
+    max_concurrency: int = 8
+
+
+@dataclass
+class LLMResult:
+    """
+    网关调用结果
+    """
+    text: str
+    model: str
+    latency_ms: float
+    hedged: bool = False
+    fallback: bool = False
+    usage: Dict[str, int] = field(default_factory=dict)
+
+
+class LatencyTracker:
+    """
+    记录模型最近的请求耗时，计算对冲请求的等待时间（p95）
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20, default_delay: float = 3.0,
+                 min_delay: float = 0.2, max_delay: float = 20.0):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, ratio: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(ratio * (len(ordered) - 1))]
+
+    def hedge_delay(self) -> float:
+        """
+        样本不足时使用默认等待时间
+        """
+        if len(self.samples) < self.min_samples:
+            return self.default_delay
+        return min(max(self.percentile(0.95), self.min_delay), self.max_delay)
+
+
+class CircuitBreaker:
+    """
+    熔断器: 连续失败达到阈值后打开，冷却时间过后放行一个试探请求，成功则关闭
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def release(self):
+        """
+        请求未真正发出（如在本地排队时超时），不计入成功或失败
+        """
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+@dataclass
+class LLMPrompt:
+    """
+    一次调用的提示词，按 系统提示词 -> 固定前缀消息 -> 本次消息 的顺序发送
+
+    固定前缀（评分标准、few-shot示例、历史对话等）在多次调用间保持不变，放在前面才能命中厂商的提示词缓存:
+    - Anthropic: 在系统提示词和固定前缀的最后一条消息上添加 cache_control 断点
+    - OpenAI兼容接口: 厂商自动缓存相同前缀（通常需超过1024个token），只需保证前缀稳定
+    """
+    messages: List[dict]
+    system_prompt: Optional[str] = None
+    prefix_messages: List[dict] = field(default_factory=list)
+    cache_prompt: bool = True
+
+
+# Anthropic的缓存断点
+ANTHROPIC_CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def mark_cache_breakpoint(message: dict) -> dict:
+    """
+    在消息的最后一个内容块上添加Anthropic缓存断点（返回副本）
+    """
+    content = message.get("content")
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [dict(block) for block in content]
+    content[-1]["cache_control"] = ANTHROPIC_CACHE_CONTROL
+    return dict(message, content=content)
+
+
+def build_anthropic_request(prompt: LLMPrompt) -> dict:
+    """
+    构建Anthropic Messages接口的参数
+    """
+    prefix_messages = list(prompt.prefix_messages)
+    request = {}
+    if prompt.system_prompt:
+        if prompt.cache_prompt:
+            request["system"] = [{"type": "text", "text": prompt.system_prompt, "cache_control": ANTHROPIC_CACHE_CONTROL}]
+        else:
+            request["system"] = prompt.system_prompt
+    if prompt.cache_prompt and prefix_messages:
+        prefix_messages[-1] = mark_cache_breakpoint(prefix_messages[-1])
+    request["messages"] = prefix_messages + list(prompt.messages)
+    return request
+
+
+def build_openai_request(prompt: LLMPrompt) -> dict:
+    """
+    构建OpenAI兼容接口的参数（系统提示词和固定前缀在前，厂商自动缓存）
+    """
+    messages = []
+    if prompt.system_prompt:
+        messages.append({"role": "system", "content": prompt.system_prompt})
+    return {"messages": messages + list(prompt.prefix_messages) + list(prompt.messages)}
+
+
+def get_usage(protocol: str, response) -> Dict[str, int]:
+    """
+    提取token用量，包括命中缓存的输入token数
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    if protocol == "anthropic":
+        return {
+            "input_tokens": usage.input_tokens or 0,
+            "output_tokens": usage.output_tokens or 0,
+            "cached_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        }
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "input_tokens": usage.prompt_tokens or 0,
+        "output_tokens": usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+        "cache_write_tokens": 0,
+    }
+
+
+class LLMGateway:
+    """
+    LLM调用网关，熔断和耗时统计按模型，并发上限和连接池按路由（厂商）
+    """
+
+    def __init__(self, routes: Dict[str, LLMRoute], fallback_models: Dict[str, str] = None,
+                 model_routes: Dict[str, str] = None, deadline_seconds: float = 60.0, hedge: bool = True,
+                 failure_threshold: int = 5, reset_seconds: float = 30.0):
+        """
+        Args:
+            routes: 路由名称 -> 接入配置
+            fallback_models: 模型 -> 备用模型，可以链式配置；备用模型的接口协议必须与原模型一致
+                （调用方按原模型的协议构建图片等消息），不一致或不支持的配置会被忽略
+            model_routes: 模型 -> 路由名称，未配置的模型按名称前缀匹配
+            deadline_seconds: 默认的请求总时限
+            hedge: 是否启用对冲请求
+            failure_threshold: 熔断的连续失败次数
+            reset_seconds: 熔断的冷却时间
+        """
+        self.routes = routes
+        self.model_routes = model_routes or {}
+        self.fallback_models = self._check_fallback_models(fallback_models or {})
+        self.deadline_seconds = deadline_seconds
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+
+        self._trackers = {}
+        self._breakers = {}
+        # 信号量只能在创建它们的事件循环中使用（客户端见 get_llm_client）
+        self._semaphores = {}
+
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def reconfigure(self, routes: Dict[str, LLMRoute], fallback_models: Dict[str, str] = None,
+                    deadline_seconds: float = None, hedge: bool = None):
+        """
+        更新接入配置（API Key、代理、并发上限、备用模型等），保留耗时统计和熔断状态
+
+        客户端按API Key和代理缓存（见 get_llm_client），新配置的请求自动使用新客户端；
+        并发上限变化的路由重新创建信号量，正在执行的请求在原信号量内完成
+        """
+        changed = {name for name, route in routes.items()
+                   if name not in self.routes or self.routes[name].max_concurrency != route.max_concurrency}
+        self._semaphores = {key: semaphore for key, semaphore in self._semaphores.items() if key[0] not in changed}
+        self.routes = routes
+        self.fallback_models = self._check_fallback_models(fallback_models or {})
+        if deadline_seconds is not None:
+            self.deadline_seconds = deadline_seconds
+        if hedge is not None:
+            self.hedge = hedge
+
+    def _check_fallback_models(self, fallback_models: Dict[str, str]) -> Dict[str, str]:
+        """
+        只保留与原模型接口协议一致的备用模型，跨协议的备用模型会收到格式错误的消息
+        """
+        checked = {}
+        for model, fallback in fallback_models.items():
+            try:
+                protocols = (self.get_protocol(model), self.get_protocol(fallback))
+            except ValueError as error:
+                print(f"[LLM_GATEWAY] 忽略备用模型配置 {model} -> {fallback}: {error}")
+                continue
+            if protocols[0] != protocols[1]:
+                print(f"[LLM_GATEWAY] 忽略跨协议的备用模型配置 {model}({protocols[0]}) -> {fallback}({protocols[1]})")
+                continue
+            checked[model] = fallback
+        return checked
+
+    def get_route_name(self, model: str) -> str:
+        if model in self.model_routes:
+            return self.model_routes[model]
+        for prefix, route_name in MODEL_PREFIX_ROUTES:
+            if model.startswith(prefix) and route_name in self.routes:
+                return route_name
+        raise ValueError(f"不支持的模型: {model}")
+
+    def get_protocol(self, model: str) -> str:
+        """
+        获取模型的接口协议，调用方据此构建图片等协议相关的消息格式
+        """
+        return self.routes[self.get_route_name(model)].protocol
+
+    def get_tracker(self, model: str) -> LatencyTracker:
+        if model not in self._trackers:
+            self._trackers[model] = LatencyTracker()
+        return self._trackers[model]
+
+    def get_breaker(self, model: str) -> CircuitBreaker:
+        if model not in self._breakers:
+            self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        return self._breakers[model]
+
+    def _get_semaphore(self, route_name: str) -> asyncio.Semaphore:
+        key = (route_name, asyncio.get_running_loop())
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.routes[route_name].max_concurrency)
+        return self._semaphores[key]
+
+    def _get_client(self, route_name: str):
+        route = self.routes[route_name]
+        return get_llm_client(route.protocol, route.api_key, route.base_url, route.proxy)
+
+    async def _call(self, model: str, prompt: LLMPrompt, params: dict, started: asyncio.Event):
+        """
+        单次请求（在厂商的并发上限内执行），获得并发名额后设置started
+
+        Returns:
+            tuple: (回复文本, token用量)
+        """
+        route_name = self.get_route_name(model)
+        route = self.routes[route_name]
+        async with self._get_semaphore(route_name):
+            started.set()
+            client = self._get_client(route_name)
+            start_time = time.perf_counter()
+            if route.protocol == "anthropic":
+                response = await client.messages.create(model=model, **build_anthropic_request(prompt),
+                                                        **get_llm_params(route.protocol, params))
+                text = response.content[0].text
+            else:
+                response = await client.chat.completions.create(model=model, **build_openai_request(prompt), **params)
+                text = response.choices[0].message.content
+            self.get_tracker(model).record(time.perf_counter() - start_time)
+            return text, get_usage(route.protocol, response)
+
+    async def _hedged_call(self, model: str, prompt: LLMPrompt, params: dict, started: asyncio.Event):
+        """
+        发起请求，开始执行后超过p95耗时仍未返回时发起对冲请求，返回先成功的结果
+
+        Returns:
+            tuple: ((回复文本, token用量), 是否发起了对冲请求)
+        """
+        tasks = [asyncio.create_task(self._call(model, prompt, params, started))]
+        hedged = False
+        try:
+            if self.hedge:
+                # 排队时间不计入对冲等待时间
+                started_waiter = asyncio.create_task(started.wait())
+                await asyncio.wait([tasks[0], started_waiter], return_when=asyncio.FIRST_COMPLETED)
+                started_waiter.cancel()
+
+                done, _ = await asyncio.wait(tasks, timeout=self.get_tracker(model).hedge_delay())
+                # 厂商并发已满时不对冲，避免放大负载
+                semaphore = self._get_semaphore(self.get_route_name(model))
+                if not done and not semaphore.locked():
+                    hedged = True
+                    print(f"[LLM_GATEWAY] {model} 超过p95耗时未返回，发起对冲请求")
+                    tasks.append(asyncio.create_task(self._call(model, prompt, params, started)))
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), hedged
+                    error = task.exception()
+            raise error
+        finally:
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    async def chat(self, model: str, messages: List[dict], system_prompt: str = None,
+                   deadline_seconds: float = None, prefix_messages: List[dict] = None,
+                   cache_prompt: bool = True, **params) -> LLMResult:
+        """
+        调用模型，失败或熔断时切换到备用模型
+
+        Args:
+            model: 模型名称
+            messages: 本次的消息列表（不含系统提示词），格式需与模型的接口协议一致
+            system_prompt: 系统提示词，需保持不变才能命中提示词缓存（可变内容放到messages中）
+            deadline_seconds: 请求总时限，默认使用网关配置
+            prefix_messages: 多次调用间不变的前缀消息（few-shot示例、历史对话等）
+            cache_prompt: 是否为系统提示词和前缀消息启用提示词缓存
+            **params: temperature、max_tokens等模型参数
+
+        Raises:
+            LLMGatewayError: 所有可用模型都失败或超过请求时限
+        """
+        prompt = LLMPrompt(messages, system_prompt, list(prefix_messages or []), cache_prompt)
+        loop = asyncio.get_running_loop()
+        start_time = loop.time()
+        deadline = start_time + (deadline_seconds or self.deadline_seconds)
+
+        tried = []
+        current = model
+        last_error = None
+        while current and current not in tried:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                last_error = LLMGatewayError("超过请求时限")
+                break
+
+            tried.append(current)
+            fallback = self.fallback_models.get(current)
+            breaker = self.get_breaker(current)
+            if not breaker.allow():
+                print(f"[LLM_GATEWAY] {current} 熔断中，切换到备用模型: {fallback}")
+                last_error = LLMGatewayError(f"{current} 熔断中")
+                current = fallback
+                continue
+
+            # 有备用模型时预留部分时间给备用模型
+            timeout = remaining * 0.6 if fallback else remaining
+
+            started = asyncio.Event()
+            try:
+                (text, usage), hedged = await asyncio.wait_for(
+                    self._hedged_call(current, prompt, params, started), timeout)
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except asyncio.TimeoutError:
+                # 只有请求已发出仍超时才计为模型失败，本地排队超时不触发熔断
+                if started.is_set():
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+                last_error = LLMGatewayError(f"{current} 超时")
+                print(f"[LLM_GATEWAY] {current} 超时，切换到备用模型: {fallback}")
+                current = fallback
+                continue
+            except Exception as error:
+                breaker.record_failure()
+                last_error = error
+                print(f"[LLM_GATEWAY] {current} 调用失败: {last_error}，切换到备用模型: {fallback}")
+                current = fallback
+                continue
+
+            breaker.record_success()
+            return LLMResult(
+                text=text,
+                model=current,
+                latency_ms=round((loop.time() - start_time) * 1000, 1),
+                hedged=hedged,
+                fallback=current != model,
+                usage=usage
+            )
+
+        raise LLMGatewayError(f"模型调用失败, 已尝试: {tried}, 最后错误: {last_error}")
+
+    async def aclose(self):
+        """
+        关闭当前事件循环中的共享客户端和本网关的信号量
+        """
+        loop = asyncio.get_running_loop()
+        await close_llm_clients()
+        for key in [key for key in self._semaphores if key[1] is loop]:
+            del self._semaphores[key]
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        获取进程内共享的后台事件循环
+        """
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def run_sync(self, coro, timeout: float = None):
+        """
+        在后台事件循环中执行协程并等待结果（供同步代码调用）
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def chat_sync(self, model: str, messages: List[dict], system_prompt: str = None,
+                  deadline_seconds: float = None, prefix_messages: List[dict] = None,
+                  cache_prompt: bool = True, **params) -> LLMResult:
+        """
+        同步调用模型，参数同 chat
+        """
+        deadline_seconds = deadline_seconds or self.deadline_seconds
+        # 额外等待1秒，超时由chat内部处理并返回明确的错误
+        return self.run_sync(self.chat(model, messages, system_prompt, deadline_seconds, prefix_messages,
+                                       cache_prompt, **params),
+                             timeout=deadline_seconds + 1)
+
+
+_default_gateway = None
+_default_gateway_settings = None
+_default_gateway_loaded_at = 0.0
+_default_gateway_lock = threading.Lock()
+
+# 重新读取网关配置（Airflow变量）的间隔（秒），修改API Key、代理等配置后最多延迟这么久生效
+GATEWAY_CONFIG_TTL = 60.0
+
+
+def load_gateway_settings():
+    """
+    从Airflow变量读取网关配置
+
+    Returns:
+        tuple: (路由名称 -> 接入配置, 网关配置)
+    """
+    config = dict(DEFAULT_GATEWAY_CONFIG)
+    config.update(Variable.get("LLM_GATEWAY_CONFIG", default_var={}, deserialize_json=True))
+    concurrency = dict(DEFAULT_GATEWAY_CONFIG["vendor_concurrency"], **config["vendor_concurrency"])
+    proxy_url = Variable.get("PROXY_URL", default_var="")
+
+    routes = {
+        "openai": LLMRoute("openai", Variable.get("OPENAI_API_KEY", default_var=""),
+                           proxy=proxy_url, max_concurrency=concurrency["openai"]),
+        "anthropic": LLMRoute("anthropic", Variable.get("CLAUDE_API_KEY", default_var=""),
+                              proxy=proxy_url, max_concurrency=concurrency["anthropic"]),
+        "dashscope": LLMRoute("openai", Variable.get("DASHSCOPE_API_KEY", default_var=""),
+                              base_url=DASHSCOPE_BASE_URL, max_concurrency=concurrency["dashscope"]),
+    }
+    return routes, config
+
+
+def get_llm_gateway() -> LLMGateway:
+    """
+    获取进程内共享的网关，接入配置来自Airflow变量:
+    - OPENAI_API_KEY、CLAUDE_API_KEY、DASHSCOPE_API_KEY: 各厂商的API Key
+    - PROXY_URL: 访问OpenAI和Anthropic使用的代理
+    - LLM_GATEWAY_CONFIG: 并发上限、备用模型、请求时限等，见 DEFAULT_GATEWAY_CONFIG
+
+    每 GATEWAY_CONFIG_TTL 秒重新读取一次变量，配置变化时更新网关（保留熔断状态和耗时统计），
+    常驻的worker进程不需要重启即可使用新的API Key和代理
+    """
+    global _default_gateway, _default_gateway_settings, _default_gateway_loaded_at
+    with _default_gateway_lock:
+        if _default_gateway is not None and time.monotonic() - _default_gateway_loaded_at < GATEWAY_CONFIG_TTL:
+            return _default_gateway
+
+        routes, config = load_gateway_settings()
+        if _default_gateway is None:
+            _default_gateway = LLMGateway(
+                routes,
+                fallback_models=config["fallback_models"],
+                deadline_seconds=config["deadline_seconds"],
+                hedge=config["hedge"]
+            )
+        elif (routes, config) != _default_gateway_settings:
+            print("[LLM_GATEWAY] 网关配置已变化，更新接入配置")
+            _default_gateway.reconfigure(
+                routes,
+                fallback_models=config["fallback_models"],
+                deadline_seconds=config["deadline_seconds"],
+                hedge=config["hedge"]
+            )
+        _default_gateway_settings = (routes, config)
+        _default_gateway_loaded_at = time.monotonic()
+        return _default_gateway
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+公众号语音回复流水线
+
+回复文本按段落切分为多段（公众号语音素材限制60秒、2MB），每段在内存中完成 语音合成 -> 上传临时素材，
+各段并发执行（不超过公众号接口的并发上限），按顺序发送: 第N段上传完成且前一段已发送后立即发送，
+不写临时文件，也不需要固定的发送间隔。
+"""
+
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.tts import synthesize_speech
+
+
+# 每段语音的最大字数（语速约4字/秒，留出余量保证不超过60秒）
+MAX_SEGMENT_CHARS = 180
+
+# 公众号语音素材的大小上限
+MAX_VOICE_BYTES = 2 * 1024 * 1024
+
+# 同时合成和上传的段数
+VOICE_REPLY_CONCURRENCY = 3
+
+# 句末标点，超长段落在这些位置切分
+SENTENCE_END_PATTERN = re.compile(r'(?<=[。！？!?；;\n])')
+
+
+def split_voice_segments(text, max_chars=MAX_SEGMENT_CHARS):
+    """
+    把回复文本切分为语音段: 按段落切分，超长段落按句子切分，相邻的短段落合并
+    """
+    sentences = []
+    for paragraph in re.split(r'\\n\\n|\n\n', text):
+        paragraph = paragraph.replace('\\n', '\n').strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            sentences.append(paragraph)
+            continue
+        for sentence in SENTENCE_END_PATTERN.split(paragraph):
+            sentence = sentence.strip()
+            # 没有标点的超长句子按字数硬切
+            while len(sentence) > max_chars:
+                sentences.append(sentence[:max_chars])
+                sentence = sentence[max_chars:]
+            if sentence:
+                sentences.append(sentence)
+
+    segments = []
+    for sentence in sentences:
+        if segments and len(segments[-1]) + len(sentence) + 1 <= max_chars:
+            segments[-1] = f"{segments[-1]}\n{sentence}"
+        else:
+            segments.append(sentence)
+    return segments
+
+
+def _synthesize_and_upload(mp_bot, index, segment, model, voice):
+    """
+    合成一段语音并上传为临时素材，返回media_id
+    """
+    audio = synthesize_speech(segment, model=model, voice=voice)
+    if len(audio) > MAX_VOICE_BYTES:
+        raise Exception(f"第{index + 1}段语音超过2MB: {len(audio)}B")
+    result = mp_bot.upload_temporary_media_data("voice", io.BytesIO(audio), f"reply_{index}.mp3")
+    return result['media_id']
+
+
+def send_voice_reply(mp_bot, to_user, text, model="cosyvoice-v2", voice="longxiaoxia_v2"):
+    """
+    以语音回复公众号用户，某一段失败时，该段及后续段落改为发送文字
+
+    发送过程中的错误都在内部处理（不抛出异常），调用方根据返回的段数判断是否需要补发:
+    两者都为0时没有发出任何内容，可以整段改为文字回复；否则补发会重复已发送的内容
+
+    参数:
+        mp_bot: WeChatMPBot
+        to_user: 接收者的OpenID
+        text: 回复文本
+
+    返回:
+        tuple: (发送成功的语音段数, 改为文字发送成功的段数)
+    """
+    segments = split_voice_segments(text)
+    if not segments:
+        return 0, 0
+
+    sent = 0
+    try:
+        # 并发上传前先获取Access Token，避免多个线程同时获取
+        if not mp_bot.access_token:
+            mp_bot.get_access_token()
+
+        with ThreadPoolExecutor(max_workers=VOICE_REPLY_CONCURRENCY) as executor:
+            futures = [executor.submit(_synthesize_and_upload, mp_bot, index, segment, model, voice)
+                       for index, segment in enumerate(segments)]
+            try:
+                # 按顺序等待并发送，后面的段落在此期间继续合成和上传
+                for future in futures:
+                    mp_bot.send_voice_message(to_user, future.result())
+                    sent += 1
+            finally:
+                for future in futures[sent:]:
+                    future.cancel()
+    except Exception as e:
+        print(f"[MP_VOICE] 第{sent + 1}段语音回复失败，剩余段落改为发送文字: {e}")
+
+    text_sent = 0
+    for index, segment in enumerate(segments[sent:], start=sent + 1):
+        try:
+            mp_bot.send_text_message(to_user, segment)
+            text_sent += 1
+        except Exception as e:
+            print(f"[MP_VOICE] 第{index}段文字发送失败: {e}")
+    print(f"[MP_VOICE] 语音回复完成，语音: {sent}段，文字: {text_sent}段，失败: {len(segments) - sent - text_sent}段")
+    return sent, text_sent
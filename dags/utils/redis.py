@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from typing import List, Optional, Any, Dict, Union
+from typing import List, Optional, Any, Dict, Tuple, Union
 import redis
 import json
 from airflow.hooks.base import BaseHook
@@ -147,6 +147,198 @@ class RedisHandler:
             print(f"追加消息列表失败: {str(e)}")
             return False
     
+    def push_recent_msg(self, key: str, value: Union[Dict, str], max_length: int = 100, expire_days: int = 30) -> bool:
+        """
+        将消息写入最近消息列表的头部（最新的消息在最前面），并限制列表长度
+        Args:
+            key: Redis键名
+            value: 要写入的值（支持字典或字符串）
+            max_length: 列表最大长度，超过时仅保留最新的N个值
+            expire_days: 过期时间（天），默认30天
+        Returns:
+            bool: 操作是否成功
+        """
+        try:
+            if isinstance(value, dict):
+                value = json.dumps(value, ensure_ascii=False)
+
+            pipe = self.client.pipeline()
+            pipe.lpush(key, value)
+            pipe.ltrim(key, 0, max_length - 1)
+            pipe.expire(key, expire_days * 24 * 60 * 60)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            print(f"写入最近消息列表失败: {str(e)}")
+            return False
+
+    def get_recent_msgs(self, key: str, start: int = 0, end: int = -1) -> Tuple[List[Dict], bool]:
+        """
+        读取最近消息列表的一段，同时返回列表是否包含聊天室的全部消息（一次往返）
+        Args:
+            key: Redis键名
+            start: 起始位置（默认0）
+            end: 结束位置（默认-1，表示到列表末尾）
+        Returns:
+            tuple: (消息列表, 是否完整)，读取失败时返回([], False)
+        """
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.lrange(key, start, end)
+            pipe.exists(f"{key}_complete")
+            data, complete = pipe.execute()
+            return [json.loads(item) for item in data], bool(complete)
+        except (redis.RedisError, json.JSONDecodeError) as e:
+            print(f"读取最近消息列表失败: {str(e)}")
+            return [], False
+
+    def fill_recent_msgs(self, key: str, values: List[Dict], complete: bool = False, expire_days: int = 30) -> bool:
+        """
+        用MySQL中最新的消息（按从新到旧排列）初始化最近消息列表
+        - 列表不存在，或未标记完整且比给定的消息短时写入；已有列表的最新一条不在给定的消息中时，
+          说明查询之后又有新消息写入，放弃本次初始化
+        - complete为True表示给定的消息就是聊天室的全部消息，同时写入完整标记（{key}_complete），
+          之后条数不足的列表也可以直接作为查询结果
+        使用WATCH保证初始化期间没有新消息写入，否则放弃本次初始化
+        Args:
+            key: Redis键名
+            values: 按从新到旧排列的消息列表
+            complete: 给定的消息是否为聊天室的全部消息
+            expire_days: 过期时间（天），默认30天
+        Returns:
+            bool: 是否完成了初始化
+        """
+        if not values:
+            return False
+        ids = {str(v.get('id')) for v in values}
+        values = [json.dumps(v, ensure_ascii=False) for v in values]
+        complete_key = f"{key}_complete"
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.watch(key, complete_key)
+                if pipe.exists(complete_key) or pipe.llen(key) >= len(values):
+                    return False
+                head = pipe.lindex(key, 0)
+                if head is not None and str(json.loads(head).get('id')) not in ids:
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.rpush(key, *values)
+                pipe.expire(key, expire_days * 24 * 60 * 60)
+                if complete:
+                    # 标记不续期，最近消息列表每次写入都会续期，标记总是比列表先过期
+                    pipe.set(complete_key, 1, ex=expire_days * 24 * 60 * 60)
+                pipe.execute()
+            return True
+        except redis.WatchError:
+            print(f"初始化最近消息列表时有新消息写入，放弃初始化: {key}")
+            return False
+        except (redis.RedisError, json.JSONDecodeError) as e:
+            print(f"初始化最近消息列表失败: {str(e)}")
+            return False
+
+    def delete_recent_msgs(self, key: str) -> bool:
+        """
+        删除最近消息列表及其完整标记
+        """
+        try:
+            self.client.delete(key, f"{key}_complete")
+            return True
+        except redis.RedisError as e:
+            print(f"删除最近消息列表失败: {str(e)}")
+            return False
+
+    def get_hash_field(self, key: str, field: str) -> Optional[str]:
+        """
+        读取哈希表中的一个字段
+        Args:
+            key: Redis键名
+            field: 字段名
+        Returns:
+            str: 字段值，不存在或读取失败时返回None
+        """
+        try:
+            return self.client.hget(key, field)
+        except redis.RedisError as e:
+            print(f"读取哈希字段失败: {str(e)}")
+            return None
+
+    def set_hash_field(self, key: str, field: str, value: Union[Dict, str], expire_days: Optional[int] = None) -> bool:
+        """
+        写入哈希表中的一个字段（原子操作，无需先读取整个哈希表）
+        Args:
+            key: Redis键名
+            field: 字段名
+            value: 字段值（支持字典或字符串）
+            expire_days: 整个哈希表的过期时间（天），默认不过期
+        Returns:
+            bool: 操作是否成功
+        """
+        try:
+            if isinstance(value, dict):
+                value = json.dumps(value, ensure_ascii=False)
+            pipe = self.client.pipeline()
+            pipe.hset(key, field, value)
+            if expire_days:
+                pipe.expire(key, expire_days * 24 * 60 * 60)
+            pipe.execute()
+            return True
+        except redis.RedisError as e:
+            print(f"写入哈希字段失败: {str(e)}")
+            return False
+
+    def get_hash_all(self, key: str) -> Dict[str, str]:
+        """
+        读取整个哈希表
+        Args:
+            key: Redis键名
+        Returns:
+            dict: 所有字段和值，不存在或读取失败时返回空字典
+        """
+        try:
+            return self.client.hgetall(key)
+        except redis.RedisError as e:
+            print(f"读取哈希表失败: {str(e)}")
+            return {}
+
+    def delete_hash_field(self, key: str, *fields: str) -> bool:
+        """
+        删除哈希表中的字段
+        Args:
+            key: Redis键名
+            fields: 字段名
+        Returns:
+            bool: 操作是否成功
+        """
+        try:
+            self.client.hdel(key, *fields)
+            return True
+        except redis.RedisError as e:
+            print(f"删除哈希字段失败: {str(e)}")
+            return False
+
+    def publish_event(self, key: str, event: Dict, max_length: int = 1000, expire_days: int = 7) -> Optional[str]:
+        """
+        发布事件到Redis Stream，供推送网关（olds/push_server.py）实时推送给前端
+        Stream的消息ID单调递增，前端断线重连时可以从上次收到的ID继续读取
+        Args:
+            key: Stream键名
+            event: 事件内容（字典，JSON存储在data字段）
+            max_length: Stream的最大长度（近似裁剪），超过时丢弃最旧的事件
+            expire_days: 过期时间（天），默认7天
+        Returns:
+            str: 事件ID，失败时返回None
+        """
+        try:
+            pipe = self.client.pipeline()
+            pipe.xadd(key, {'data': json.dumps(event, ensure_ascii=False)}, maxlen=max_length, approximate=True)
+            pipe.expire(key, expire_days * 24 * 60 * 60)
+            event_id, _ = pipe.execute()
+            return event_id
+        except redis.RedisError as e:
+            print(f"发布事件失败: {str(e)}")
+            return None
+
     def delete_msg_key(self, key: str) -> bool:
         """
         删除消息键（原clear_msg_list）
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 # coding=utf-8
 
+import hashlib
 import os
+import queue
+import tempfile
+import threading
+import time
 
 import dashscope
-from dashscope.audio.tts_v2 import SpeechSynthesizer
+from dashscope.audio.tts_v2 import AudioFormat, ResultCallback, SpeechSynthesizer
 
 try:
     from airflow.models.variable import Variable
@@ -12,46 +17,196 @@ except ImportError:
     pass
 
 
+# 默认输出格式: 16kHz单声道MP3，语音足够清晰，体积约为默认格式的一半（公众号语音素材限制2MB）
+DEFAULT_AUDIO_FORMAT = AudioFormat.MP3_16000HZ_MONO_128KBPS
+
+# 合成结果的本地缓存目录和总大小上限（超出时按最近使用时间淘汰）
+TTS_CACHE_DIR = os.path.join(tempfile.gettempdir(), "tts_cache")
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# 流式合成时等待下一个音频片段的超时（秒）
+STREAM_CHUNK_TIMEOUT = 30
+
+
+class TTSCache:
+    """
+    语音合成结果的本地磁盘缓存（LRU）
+
+    以 (文本, 声音, 模型, 格式) 的哈希为文件名，命中时更新文件修改时间，写入时按修改时间淘汰最久未使用的文件
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(text, model, voice, audio_format):
+        return hashlib.sha256(f"{model}|{voice}|{audio_format}|{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.audio")
+
+    def get(self, key):
+        """
+        读取缓存的音频，未命中时返回None
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            # 更新修改时间，作为最近使用时间
+            os.utime(path)
+            return audio
+        except OSError:
+            return None
+
+    def put(self, key, audio):
+        """
+        写入音频，并淘汰超出总大小上限的旧文件
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            # 先写临时文件再重命名，避免并发读到不完整的文件（语音回复在多个线程中同时合成）
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, path)
+            self.evict()
+        except OSError as e:
+            print(f"[TTS] 写入缓存失败: {e}")
+
+    def evict(self):
+        """
+        按最近使用时间淘汰文件，直到总大小不超过上限
+        """
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(".audio"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total_bytes -= size
+            except OSError:
+                pass
+
+
+_tts_cache = TTSCache()
+
+
+class _QueueCallback(ResultCallback):
+    """
+    把流式合成的音频片段放入队列，合成结束或出错时放入结束标记
+    """
+
+    def __init__(self):
+        self.chunks = queue.Queue()
+
+    def on_data(self, data: bytes) -> None:
+        self.chunks.put(data)
+
+    def on_complete(self) -> None:
+        self.chunks.put(None)
+
+    def on_error(self, message) -> None:
+        self.chunks.put(Exception(f"语音合成失败: {message}"))
+
+    def on_close(self) -> None:
+        self.chunks.put(None)
+
+
+def _set_api_key(api_key=None):
+    # 如果提供了API密钥，则设置它
+    if api_key:
+        dashscope.api_key = api_key
+    else:
+        dashscope.api_key = Variable.get("DASH_SCOPE_API_KEY")
+
+
+def iter_speech(text, model="cosyvoice-v2", voice="longxiaoxia_v2", api_key=None, audio_format=DEFAULT_AUDIO_FORMAT):
+    """
+    流式合成语音，服务端每生成一段音频就返回，调用方可以在合成结束前开始处理（写文件、上传等）
+
+    返回:
+        生成器，依次返回音频片段（bytes，服务端已编码为audio_format）
+    """
+    _set_api_key(api_key)
+    callback = _QueueCallback()
+    synthesizer = SpeechSynthesizer(model=model, voice=voice, format=audio_format, callback=callback)
+    # 设置了callback时call立即返回，音频通过callback返回
+    synthesizer.call(text)
+    while True:
+        chunk = callback.chunks.get(timeout=STREAM_CHUNK_TIMEOUT)
+        if chunk is None:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+    # 获取请求ID和延迟指标
+    print(f'[Metric] requestId: {synthesizer.get_last_request_id()}, '
+          f'first package delay ms: {synthesizer.get_first_package_delay()}')
+
+
+def synthesize_speech(text, model="cosyvoice-v2", voice="longxiaoxia_v2", api_key=None,
+                      audio_format=DEFAULT_AUDIO_FORMAT, on_chunk=None):
+    """
+    合成语音，相同的 (文本, 声音, 模型, 格式) 直接返回缓存的音频
+
+    参数:
+        on_chunk (callable, optional): 流式合成时每收到一个音频片段调用一次（命中缓存时以完整音频调用一次）
+
+    返回:
+        bytes: 完整的音频数据
+    """
+    key = TTSCache.make_key(text, model, voice, audio_format)
+    audio = _tts_cache.get(key)
+    if audio is not None:
+        print(f"[TTS] 命中缓存: {text[:20]}")
+        if on_chunk:
+            on_chunk(audio)
+        return audio
+
+    start_time = time.perf_counter()
+    chunks = []
+    for chunk in iter_speech(text, model, voice, api_key, audio_format):
+        chunks.append(chunk)
+        if on_chunk:
+            on_chunk(chunk)
+    audio = b"".join(chunks)
+    if not audio:
+        raise Exception("语音合成结果为空")
+    print(f"[TTS] 合成完成: {len(text)}字, {len(audio)}B, 耗时: {(time.perf_counter() - start_time) * 1000:.0f}ms")
+
+    _tts_cache.put(key, audio)
+    return audio
+
+
 def text_to_speech(text, output_path='output.mp3', model="cosyvoice-v2", voice="longxiaoxia_v2", api_key=None):
     """
-    将文本转换为语音并保存为MP3文件
-    
+    将文本转换为语音并保存为MP3文件（流式合成，边合成边写入文件；相同文本直接使用缓存）
+
     参数:
         text (str): 要转换为语音的文本
         output_path (str): 输出音频文件的路径，默认为'output.mp3'
         model (str): 使用的模型，默认为'cosyvoice-v2'
         voice (str): 使用的声音，默认为'longxiaoxia'
         api_key (str, optional): DashScope API密钥，如果为None则使用环境变量中的配置
-        
+
     返回:
         tuple: (成功标志, 音频数据或错误消息)
     """
     try:
-        # 如果提供了API密钥，则设置它
-        if api_key:
-            dashscope.api_key = api_key
-        else:
-            dashscope.api_key = Variable.get("DASH_SCOPE_API_KEY")
-        
-        # 初始化语音合成器
-        synthesizer = SpeechSynthesizer(model=model, voice=voice)
-        
-        # 调用API生成语音
-        audio = synthesizer.call(text)
-        
-        # 获取请求ID和延迟指标
-        request_id = synthesizer.get_last_request_id()
-        first_package_delay = synthesizer.get_first_package_delay()
-        
-        # 记录指标
-        print(f'[Metric] requestId: {request_id}, first package delay ms: {first_package_delay}')
-        
-        # 保存音频文件
         with open(output_path, 'wb') as f:
-            f.write(audio)
-        
+            audio = synthesize_speech(text, model, voice, api_key, on_chunk=f.write)
         return True, audio
-    
+
     except Exception as e:
         error_msg = f"语音生成失败: {str(e)}"
         print(error_msg)
@@ -10,34 +10,92 @@ Author: by cursor
 Date: 2025-02-27
 """
 
+import os
+
 import requests
 import json
 
+# 公众号接口地址
+MP_API_BASE = "https://api.weixin.qq.com/cgi-bin"
+
+# Access Token 失效的错误码: 40001 不是最新的Token，40014 不合法的Token，42001 Token超时
+INVALID_TOKEN_ERRCODES = (40001, 40014, 42001)
+
+
+def fetch_access_token(appid, appsecret, api_base=MP_API_BASE):
+    """请求微信接口获取新的 Access Token
+    
+    返回:
+        tuple: (access_token, 有效期秒数)
+    """
+    url = f"{api_base}/token"
+    print(f"获取 Access Token: {url}, appid: {appid}")
+    response = requests.get(url, params={"grant_type": "client_credential", "appid": appid, "secret": appsecret}, timeout=10)
+    data = response.json()
+    if 'access_token' in data:
+        return data['access_token'], data.get('expires_in', 7200)
+    raise Exception(f"获取 Access Token 失败: {data.get('errmsg', '未知错误')}")
+
+
 class WeChatMPBot:
-    def __init__(self, appid, appsecret):
+    def __init__(self, appid, appsecret, token_manager=None, api_base=MP_API_BASE):
+        """
+        参数:
+            token_manager: 多个worker共享的Token管理器（见 utils.wechat_mp_token），为None时由当前实例自己获取
+            api_base: 公众号接口地址
+        """
         self.appid = appid
         self.appsecret = appsecret
+        self.token_manager = token_manager
+        self.api_base = api_base
         self.access_token = None
         self.token_expiry = 0
 
     def get_access_token(self):
         """获取稳定的 Access Token"""
-        url = f"https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={self.appid}&secret={self.appsecret}"
-        print(f"获取 Access Token 的 URL: {url}")
-        response = requests.get(url)
-        data = response.json()
-        if 'access_token' in data:
-            self.access_token = data['access_token']
-            self.token_expiry = data['expires_in']
-            return self.access_token
+        if self.token_manager is not None:
+            self.access_token = self.token_manager.get_token()
         else:
-            raise Exception(f"获取 Access Token 失败: {data.get('errmsg', '未知错误')}")
+            self.access_token, self.token_expiry = fetch_access_token(self.appid, self.appsecret, self.api_base)
+        return self.access_token
+
+    def _api_request(self, method, path, **kwargs):
+        """调用公众号接口，自动带上 Access Token，Token失效时刷新后重试一次
+        
+        参数:
+            method: HTTP方法
+            path: 接口路径（不含access_token参数），如 "message/custom/send"
+        """
+        for attempt in range(2):
+            # 使用共享Token时每次读取（可能已被其他worker刷新），否则复用当前实例的Token
+            if self.token_manager is not None or not self.access_token:
+                self.get_access_token()
+            token = self.access_token
+            response = requests.request(method, f"{self.api_base}/{path}", params={"access_token": token}, **kwargs)
+
+            errcode = None
+            if 'json' in response.headers.get('Content-Type', '') or 'text/plain' in response.headers.get('Content-Type', ''):
+                try:
+                    errcode = response.json().get('errcode')
+                except ValueError:
+                    pass
+            if errcode not in INVALID_TOKEN_ERRCODES or attempt > 0:
+                return response
+
+            print(f"Access Token 已失效({errcode})，刷新后重试")
+            if self.token_manager is not None:
+                self.token_manager.invalidate(token)
+            self.access_token = None
+            # 上传的文件需要从头重新读取
+            for file_value in (kwargs.get('files') or {}).values():
+                file_obj = file_value[1] if isinstance(file_value, tuple) else file_value
+                if hasattr(file_obj, 'seek'):
+                    file_obj.seek(0)
+        return response
 
     def send_text_message(self, to_user, content):
         """发送文本消息"""
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送文本消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -46,16 +104,14 @@ class WeChatMPBot:
                 "content": content
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送文本消息失败: {result.get('errmsg', '未知错误')}")
 
     def send_image_message(self, to_user, media_id):
         """发送图片消息"""
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送图片消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -64,7 +120,7 @@ class WeChatMPBot:
                 "media_id": media_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送图片消息失败: {result.get('errmsg', '未知错误')}")
@@ -79,9 +135,7 @@ class WeChatMPBot:
         注意:
             语音文件的media_id有效期为3天
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送语音消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -90,7 +144,7 @@ class WeChatMPBot:
                 "media_id": media_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送语音消息失败: {result.get('errmsg', '未知错误')}")
@@ -108,9 +162,7 @@ class WeChatMPBot:
         注意:
             视频和缩略图的media_id有效期为3天
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送视频消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -122,7 +174,7 @@ class WeChatMPBot:
                 "description": description
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送视频消息失败: {result.get('errmsg', '未知错误')}")
@@ -141,9 +193,7 @@ class WeChatMPBot:
         注意:
             缩略图的media_id有效期为3天
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送音乐消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -156,7 +206,7 @@ class WeChatMPBot:
                 "thumb_media_id": thumb_media_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送音乐消息失败: {result.get('errmsg', '未知错误')}")
@@ -174,9 +224,7 @@ class WeChatMPBot:
         注意:
             图文消息条数限制在1条以内，如果图文数超过1，则将会返回错误码45008
         """
-        if not self.access_token:
-            self.get_access_token()
-        url_api = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url_api = "message/custom/send"
         print(f"发送图文消息的 URL: {url_api}")
         data = {
             "touser": to_user,
@@ -192,7 +240,7 @@ class WeChatMPBot:
                 ]
             }
         }
-        response = requests.post(url_api, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url_api, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送图文消息失败: {result.get('errmsg', '未知错误')}")
@@ -207,9 +255,7 @@ class WeChatMPBot:
         注意:
             图文消息条数限制在1条以内，如果图文数超过1，则将会返回错误码45008
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送图文消息(mpnews)的 URL: {url}")
         data = {
             "touser": to_user,
@@ -218,7 +264,7 @@ class WeChatMPBot:
                 "media_id": media_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送图文消息(mpnews)失败: {result.get('errmsg', '未知错误')}")
@@ -233,9 +279,7 @@ class WeChatMPBot:
         注意:
             草稿接口灰度完成后，将不再支持此前客服接口中带media_id的mpnews类型的图文消息
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送图文消息(mpnewsarticle)的 URL: {url}")
         data = {
             "touser": to_user,
@@ -244,7 +288,7 @@ class WeChatMPBot:
                 "article_id": article_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送图文消息(mpnewsarticle)失败: {result.get('errmsg', '未知错误')}")
@@ -262,9 +306,7 @@ class WeChatMPBot:
         注意:
             该消息仅支持已认证服务号使用，其余账号类型不允许使用
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送菜单消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -275,7 +317,7 @@ class WeChatMPBot:
                 "tail_content": tail_content
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送菜单消息失败: {result.get('errmsg', '未知错误')}")
@@ -290,9 +332,7 @@ class WeChatMPBot:
         注意:
             客服消息接口投放卡券仅支持非自定义Code码和导入code模式的卡券
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送卡券消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -301,7 +341,7 @@ class WeChatMPBot:
                 "card_id": card_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送卡券消息失败: {result.get('errmsg', '未知错误')}")
@@ -319,9 +359,7 @@ class WeChatMPBot:
         注意:
             小程序卡片的封面图片建议大小为520*416
         """
-        if not self.access_token:
-            self.get_access_token()
-        url = f"https://api.weixin.qq.com/cgi-bin/message/custom/send?access_token={self.access_token}"
+        url = "message/custom/send"
         print(f"发送小程序卡片消息的 URL: {url}")
         data = {
             "touser": to_user,
@@ -333,7 +371,7 @@ class WeChatMPBot:
                 "thumb_media_id": thumb_media_id
             }
         }
-        response = requests.post(url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
         result = response.json()
         if result.get('errcode') != 0:
             raise Exception(f"发送小程序卡片消息失败: {result.get('errmsg', '未知错误')}")
@@ -357,13 +395,10 @@ class WeChatMPBot:
             - qr_scene: 二维码扫码场景
             - qr_scene_str: 二维码扫码场景描述
         """
-        if not self.access_token:
-            self.get_access_token()
-        
-        url = f"https://api.weixin.qq.com/cgi-bin/user/info?access_token={self.access_token}&openid={openid}"
+        url = f"user/info?openid={openid}"
         print(f"获取用户信息的 URL: {url}")
         
-        response = requests.get(url)
+        response = self._api_request('GET', url)
         result = response.json()
         print(f"获取用户信息的结果: {result}")  
         
@@ -372,6 +407,30 @@ class WeChatMPBot:
         
         return result
 
+    def batch_get_user_info(self, openids, lang="zh_CN"):
+        """批量获取用户基本信息，每次最多100个用户
+
+        参数:
+            openids: 用户OpenID列表（不超过100个）
+            lang: 国家地区语言版本
+        返回:
+            用户信息列表，每项字段同 get_user_info
+        """
+        if len(openids) > 100:
+            raise ValueError("批量获取用户信息每次最多100个用户")
+        url = "user/info/batchget"
+        print(f"批量获取用户信息的 URL: {url}, 用户数: {len(openids)}")
+        data = {
+            "user_list": [{"openid": openid, "lang": lang} for openid in openids]
+        }
+        response = self._api_request('POST', url, data=json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        result = response.json()
+
+        if 'errcode' in result and result['errcode'] != 0:
+            raise Exception(f"批量获取用户信息失败: {result.get('errmsg', '未知错误')}")
+
+        return result.get('user_info_list', [])
+
     def get_followers(self, next_openid=None):
         """获取公众号关注者列表
         
@@ -400,16 +459,13 @@ class WeChatMPBot:
                 all_openids.extend(result['data']['openid'])
                 next_openid = result['next_openid']
         """
-        if not self.access_token:
-            self.get_access_token()
-        
-        url = f"https://api.weixin.qq.com/cgi-bin/user/get?access_token={self.access_token}"
+        url = "user/get"
         if next_openid:
-            url += f"&next_openid={next_openid}"
+            url += f"?next_openid={next_openid}"
         
         print(f"获取关注者列表的 URL: {url}")
         
-        response = requests.get(url)
+        response = self._api_request('GET', url)
         result = response.json()
         #print(f"获取关注者列表的结果: {result}")
 
@@ -474,16 +530,24 @@ class WeChatMPBot:
                - 视频（video）：10MB，支持MP4格式
                - 缩略图（thumb）：64KB，支持JPG格式
         """
-        if not self.access_token:
-            self.get_access_token()
+        with open(media_file_path, 'rb') as media_file:
+            return self.upload_temporary_media_data(media_type, media_file, os.path.basename(media_file_path))
+
+    def upload_temporary_media_data(self, media_type, media_data, filename):
+        """上传内存中的临时素材（不写临时文件）
+        
+        参数:
+            media_type: 媒体文件类型，同 upload_temporary_media
+            media_data: 文件对象（如BytesIO）或bytes
+            filename: 文件名，微信根据扩展名判断格式
             
-        url = f"https://api.weixin.qq.com/cgi-bin/media/upload?access_token={self.access_token}&type={media_type}"
+        返回:
+            dict: 同 upload_temporary_media
+        """
+        url = f"media/upload?type={media_type}"
         print(f"上传临时素材的 URL: {url}")
         
-        # 准备文件数据
-        with open(media_file_path, 'rb') as media_file:
-            files = {'media': media_file}
-            response = requests.post(url, files=files)
+        response = self._api_request('POST', url, files={'media': (filename, media_data)})
             
         result = response.json()
         print(f"上传临时素材的结果: {result}")
@@ -506,13 +570,10 @@ class WeChatMPBot:
         注意:
             临时素材的media_id在微信服务器上保存3天，3天后media_id失效
         """
-        if not self.access_token:
-            self.get_access_token()
-            
-        url = f"https://api.weixin.qq.com/cgi-bin/media/get?access_token={self.access_token}&media_id={media_id}"
+        url = f"media/get?media_id={media_id}"
         print(f"获取临时素材的 URL: {url}")
         
-        response = requests.get(url)
+        response = self._api_request('GET', url)
         
         # 检查是否是JSON错误响应
         if response.headers.get('Content-Type') == 'application/json' or response.headers.get('Content-Type') == 'text/plain':
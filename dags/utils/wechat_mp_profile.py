@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+微信公众号用户资料缓存
+
+每条消息都调用 user/info 接口获取用户资料，既增加一次HTTP往返，也消耗接口调用次数。
+这里把用户资料保存在Redis哈希表中（每个公众号一个，字段为openid，值为资料JSON）:
+- 消息处理时只做一次往返（HGET资料 + 记录最近活跃时间），未命中或过期时才调用 user/info 并写入（懒加载）
+- 后台DAG（wx_mp_profile_refresh）定时用 user/info/batchget 批量刷新最近活跃用户的资料（每次100个），
+  并删除不活跃和已取消关注的用户，缓存和接口调用量只与活跃用户数相关
+
+使用示例:
+    profile = MPProfileCache(appid).get_or_fetch(openid, mp_bot)
+"""
+
+import json
+import time
+
+import redis
+
+from utils.redis import RedisHandler
+
+
+# Redis键名: 用户资料（哈希表，字段为openid）和最近活跃时间（有序集合，分数为时间戳）
+MP_USER_PROFILE_KEY = "wx_mp_user_profile:{appid}"
+MP_USER_ACTIVE_KEY = "wx_mp_user_active:{appid}"
+
+# 单条资料的有效期（秒），超过后消息处理时重新获取
+PROFILE_TTL = 7 * 24 * 60 * 60
+
+# 超过该时间的资料由后台DAG批量刷新（秒）
+PROFILE_REFRESH_AGE = 24 * 60 * 60
+
+# 超过该时间没有发消息的用户不再刷新，并从缓存中删除（秒），再次发消息时重新获取
+PROFILE_ACTIVE_SECONDS = 7 * 24 * 60 * 60
+
+# 整个哈希表的过期时间（天），每次写入时续期
+PROFILE_KEY_EXPIRE_DAYS = 30
+
+# user/info/batchget 每次最多获取的用户数
+BATCH_GET_LIMIT = 100
+
+
+class MPProfileCache:
+    """
+    公众号用户资料的Redis缓存
+    """
+
+    def __init__(self, appid, redis_handler=None):
+        self.appid = appid
+        self.redis_handler = redis_handler or RedisHandler()
+        self.key = MP_USER_PROFILE_KEY.format(appid=appid)
+        self.active_key = MP_USER_ACTIVE_KEY.format(appid=appid)
+
+    @staticmethod
+    def _load(value, max_age=PROFILE_TTL):
+        """
+        解析缓存的资料JSON，无效或超过max_age时返回None
+        """
+        if not value:
+            return None
+        try:
+            profile = json.loads(value)
+        except ValueError:
+            return None
+        if time.time() - profile.get("cached_at", 0) > max_age:
+            return None
+        return profile
+
+    def get_and_touch(self, openid, max_age=PROFILE_TTL):
+        """
+        读取缓存的用户资料，同时记录用户的最近活跃时间（一次往返）
+        """
+        try:
+            pipe = self.redis_handler.client.pipeline()
+            pipe.hget(self.key, openid)
+            pipe.zadd(self.active_key, {openid: time.time()})
+            pipe.expire(self.active_key, PROFILE_KEY_EXPIRE_DAYS * 24 * 60 * 60)
+            value = pipe.execute()[0]
+        except redis.RedisError as error:
+            print(f"[MP_PROFILE] 读取用户资料失败: {error}")
+            return None
+        return self._load(value, max_age)
+
+    def put_many(self, profiles):
+        """
+        写入多条用户资料（一次往返），返回写入的条数
+        """
+        now = time.time()
+        mapping = {}
+        for profile in profiles:
+            if profile.get("openid"):
+                mapping[profile["openid"]] = json.dumps({**profile, "cached_at": now}, ensure_ascii=False)
+        if not mapping:
+            return 0
+        pipe = self.redis_handler.client.pipeline()
+        pipe.hset(self.key, mapping=mapping)
+        pipe.expire(self.key, PROFILE_KEY_EXPIRE_DAYS * 24 * 60 * 60)
+        pipe.execute()
+        return len(mapping)
+
+    def put(self, profile):
+        return self.put_many([profile])
+
+    def remove(self, openids):
+        """
+        删除用户的资料和活跃记录
+        """
+        if not openids:
+            return
+        pipe = self.redis_handler.client.pipeline()
+        pipe.hdel(self.key, *openids)
+        pipe.zrem(self.active_key, *openids)
+        pipe.execute()
+
+    def get_or_fetch(self, openid, mp_bot):
+        """
+        读取用户资料并记录活跃时间，未命中时调用 user/info 获取并写入缓存
+
+        Returns:
+            dict: 用户资料，获取失败时返回None
+        """
+        start_time = time.perf_counter()
+        profile = self.get_and_touch(openid)
+        if profile is not None:
+            print(f"[MP_PROFILE] 命中缓存: {openid}, 耗时: {(time.perf_counter() - start_time) * 1000:.1f}ms")
+            return profile
+
+        try:
+            profile = mp_bot.get_user_info(openid)
+        except Exception as error:
+            print(f"[MP_PROFILE] 获取用户资料失败: {openid}, {error}")
+            return None
+        self.put(profile)
+        print(f"[MP_PROFILE] 未命中缓存，已获取并写入: {openid}, 耗时: {(time.perf_counter() - start_time) * 1000:.1f}ms")
+        return profile
+
+    def evict_inactive(self, active_seconds=PROFILE_ACTIVE_SECONDS):
+        """
+        删除超过active_seconds没有发消息的用户（包括没有活跃记录的资料）
+
+        Returns:
+            int: 删除的用户数
+        """
+        client = self.redis_handler.client
+        cutoff = time.time() - active_seconds
+        active = set(client.zrangebyscore(self.active_key, cutoff, "+inf"))
+        inactive = set(client.zrangebyscore(self.active_key, "-inf", f"({cutoff}"))
+        inactive.update(openid for openid, _ in client.hscan_iter(self.key, count=500) if openid not in active)
+        inactive = list(inactive)
+        for start in range(0, len(inactive), 500):
+            self.remove(inactive[start:start + 500])
+        return len(inactive)
+
+    def stale_openids(self, max_age=PROFILE_REFRESH_AGE, active_seconds=PROFILE_ACTIVE_SECONDS):
+        """
+        返回最近活跃、且缓存时间超过max_age（或没有缓存）的openid列表
+        """
+        client = self.redis_handler.client
+        active = client.zrangebyscore(self.active_key, time.time() - active_seconds, "+inf")
+        openids = []
+        for start in range(0, len(active), 500):
+            batch = active[start:start + 500]
+            for openid, value in zip(batch, client.hmget(self.key, batch)):
+                if self._load(value, max_age) is None:
+                    openids.append(openid)
+        return openids
+
+    def refresh(self, mp_bot, openids):
+        """
+        用 user/info/batchget 批量刷新用户资料，每次最多100个，已取消关注的用户从缓存中删除
+
+        Returns:
+            tuple: (刷新的用户数, 删除的已取消关注用户数)
+        """
+        refreshed = unsubscribed = 0
+        for start in range(0, len(openids), BATCH_GET_LIMIT):
+            profiles = mp_bot.batch_get_user_info(openids[start:start + BATCH_GET_LIMIT])
+            removed = [profile["openid"] for profile in profiles if profile.get("subscribe") == 0]
+            self.remove(removed)
+            refreshed += self.put_many([profile for profile in profiles if profile.get("subscribe") != 0])
+            unsubscribed += len(removed)
+        print(f"[MP_PROFILE] 批量刷新用户资料: {refreshed}/{len(openids)}, 已取消关注: {unsubscribed}")
+        return refreshed, unsubscribed
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+微信公众号 Access Token 管理
+
+公众号的 Access Token 每天的获取次数有限，而且重新获取后旧的Token会在短时间内失效，
+每条消息都创建 WeChatMPBot 并获取新Token时，既浪费次数，并发的任务之间也会互相把对方的Token刷掉。
+
+这里把Token保存在Redis中，所有worker共享:
+- 提前刷新: 超过有效期的80%后刷新，刷新期间其他worker继续使用旧Token
+- 单飞: 只有拿到Redis锁的worker请求微信接口，其他worker等待新Token写入后直接读取
+- Token失效（40001/40014/42001）时，只删除与失效Token相同的缓存，避免删掉其他worker刚获取的新Token
+
+使用示例:
+    mp_bot = create_mp_bot(appid, appsecret)
+    mp_bot.send_text_message(openid, "你好")
+"""
+
+import time
+import uuid
+
+from utils.redis import RedisHandler
+from utils.wechat_mp_channl import MP_API_BASE
+from utils.wechat_mp_channl import WeChatMPBot
+from utils.wechat_mp_channl import fetch_access_token
+
+
+# Redis键名: Token信息（哈希表）和刷新锁
+MP_ACCESS_TOKEN_KEY = "wx_mp_access_token:{appid}"
+MP_ACCESS_TOKEN_LOCK_KEY = "wx_mp_access_token_lock:{appid}"
+
+# 超过有效期的该比例后提前刷新
+REFRESH_RATIO = 0.8
+
+# 刷新锁的超时（毫秒），获取Token的请求超过该时间时其他worker可以重新获取锁
+LOCK_TIMEOUT_MS = 10 * 1000
+
+# 没有可用Token时，等待其他worker刷新的最长时间（秒）和轮询间隔（秒）
+WAIT_TIMEOUT = 15
+WAIT_INTERVAL = 0.1
+
+# 只删除与指定Token相同的缓存
+_DELETE_IF_TOKEN_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'token') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 只释放自己持有的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MPAccessTokenManager:
+    """
+    Redis共享的公众号 Access Token（提前刷新 + 单飞）
+    """
+
+    def __init__(self, appid, appsecret, redis_client=None, api_base=MP_API_BASE):
+        self.appid = appid
+        self.appsecret = appsecret
+        self.api_base = api_base
+        self.redis = redis_client or RedisHandler().client
+        self.token_key = MP_ACCESS_TOKEN_KEY.format(appid=appid)
+        self.lock_key = MP_ACCESS_TOKEN_LOCK_KEY.format(appid=appid)
+        self.refresh_count = 0
+
+    def _acquire_lock(self):
+        lock_id = str(uuid.uuid4())
+        if self.redis.set(self.lock_key, lock_id, nx=True, px=LOCK_TIMEOUT_MS):
+            return lock_id
+        return None
+
+    def _release_lock(self, lock_id):
+        self.redis.eval(_RELEASE_LOCK_SCRIPT, 1, self.lock_key, lock_id)
+
+    def _refresh(self, lock_id):
+        """
+        持有锁时请求微信接口获取新Token，写入Redis
+        """
+        try:
+            token, expires_in = fetch_access_token(self.appid, self.appsecret, self.api_base)
+            now = time.time()
+            pipe = self.redis.pipeline()
+            pipe.hset(self.token_key, mapping={
+                "token": token,
+                "expires_at": now + expires_in,
+                "refresh_at": now + expires_in * REFRESH_RATIO,
+            })
+            pipe.expire(self.token_key, int(expires_in))
+            pipe.execute()
+            self.refresh_count += 1
+            print(f"[MP_TOKEN] 已刷新 Access Token，有效期: {expires_in}秒")
+            return token
+        finally:
+            self._release_lock(lock_id)
+
+    def get_token(self):
+        """
+        获取可用的 Access Token
+
+        Raises:
+            Exception: 获取Token失败，或等待其他worker刷新超时
+        """
+        deadline = time.time() + WAIT_TIMEOUT
+        while True:
+            cached = self.redis.hgetall(self.token_key)
+            token = cached.get("token")
+            now = time.time()
+            if token and now < float(cached.get("refresh_at", 0)):
+                return token
+
+            if token and now < float(cached.get("expires_at", 0)):
+                # 即将过期: 抢到锁的worker刷新，其他worker继续使用当前Token
+                lock_id = self._acquire_lock()
+                if not lock_id:
+                    return token
+                try:
+                    return self._refresh(lock_id)
+                except Exception as error:
+                    print(f"[MP_TOKEN] 提前刷新失败，继续使用当前Token: {error}")
+                    return token
+
+            # 没有可用Token: 抢到锁的worker刷新，其他worker等待新Token写入
+            lock_id = self._acquire_lock()
+            if lock_id:
+                # 拿到锁后再检查一次，可能其他worker刚刚刷新完
+                cached = self.redis.hgetall(self.token_key)
+                if cached.get("token") and time.time() < float(cached.get("refresh_at", 0)):
+                    self._release_lock(lock_id)
+                    return cached["token"]
+                return self._refresh(lock_id)
+
+            if time.time() > deadline:
+                raise Exception("等待其他worker刷新 Access Token 超时")
+            time.sleep(WAIT_INTERVAL)
+
+    def invalidate(self, token):
+        """
+        Token被微信判定为失效时调用，只删除与该Token相同的缓存
+        """
+        deleted = self.redis.eval(_DELETE_IF_TOKEN_SCRIPT, 1, self.token_key, token)
+        print(f"[MP_TOKEN] Access Token 已失效{'，删除缓存' if deleted else '，缓存已被其他worker更新'}")
+
+
+def create_mp_bot(appid, appsecret, redis_client=None, api_base=MP_API_BASE):
+    """
+    创建使用Redis共享Token的公众号机器人
+    """
+    token_manager = MPAccessTokenManager(appid, appsecret, redis_client=redis_client, api_base=api_base)
+    return WeChatMPBot(appid, appsecret, token_manager=token_manager, api_base=api_base)
@@ -12,11 +12,64 @@ MySQL数据库工具模块
 1. 支持多账号数据隔离
 2. 自动创建账号专属数据表
 3. 异常重试和事务回滚
+4. 每个聊天室最近的消息写入Redis列表，读取第一页聊天记录时无需访问MySQL
+5. 基于服务端游标流式读取聊天记录，用于大批量导出
 """
 
+from datetime import datetime
+from typing import Iterator
 
+import pymysql
 from airflow.hooks.base import BaseHook
 
+from utils.redis import RedisHandler
+
+
+# 每个聊天室在Redis中缓存的最近消息条数
+RECENT_MSG_CACHE_SIZE = 100
+
+# 缓存记录中的字段，与wx_chat_records表的字段一致
+RECENT_MSG_FIELDS = (
+    'id', 'msg_id', 'wx_user_id', 'wx_user_name', 'room_id', 'room_name', 'sender_id', 'sender_name',
+    'msg_type', 'msg_type_name', 'content', 'is_self', 'is_group', 'source_ip', 'msg_timestamp',
+    'msg_datetime', 'created_at', 'updated_at'
+)
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def get_recent_msg_cache_key(wx_user_id: str, room_id: str) -> str:
+    """
+    获取聊天室最近消息缓存的Redis键名
+    """
+    return f'{wx_user_id}_{room_id}_recent_msgs'
+
+
+def to_recent_msg_record(row: dict) -> dict:
+    """
+    将一条聊天记录转换为缓存用的紧凑记录（日期时间转为字符串）
+    """
+    record = {}
+    for field in RECENT_MSG_FIELDS:
+        value = row.get(field)
+        if isinstance(value, datetime):
+            value = value.strftime(DATETIME_FORMAT)
+        record[field] = value
+    return record
+
+
+def from_recent_msg_record(record: dict) -> dict:
+    """
+    将缓存的紧凑记录还原为与get_wx_chat_history查询结果一致的格式
+    """
+    result = dict(record)
+    for field in ('msg_datetime', 'created_at', 'updated_at'):
+        if result.get(field):
+            result[field] = datetime.strptime(result[field], DATETIME_FORMAT)
+    result['is_self'] = bool(result.get('is_self'))
+    result['is_group'] = bool(result.get('is_group'))
+    return result
+
 
 def init_wx_chat_records_table(wx_user_id: str):
     """
@@ -52,7 +105,8 @@ def init_wx_chat_records_table(wx_user_id: str):
         KEY `idx_room_id` (`room_id`),
         KEY `idx_sender_id` (`sender_id`),
         KEY `idx_wx_user_id` (`wx_user_id`),
-        KEY `idx_msg_datetime` (`msg_datetime`)
+        KEY `idx_msg_datetime` (`msg_datetime`),
+        FULLTEXT KEY `ft_content` (`content`) WITH PARSER ngram
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='微信聊天记录';
     """
 
@@ -84,7 +138,8 @@ def init_wx_chat_records_table(wx_user_id: str):
         KEY `idx_room_id` (`room_id`),
         KEY `idx_sender_id` (`sender_id`),
         KEY `idx_wx_user_id` (`wx_user_id`),
-        KEY `idx_msg_datetime` (`msg_datetime`)
+        KEY `idx_msg_datetime` (`msg_datetime`),
+        FULLTEXT KEY `ft_content` (`content`) WITH PARSER ngram
     ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='微信聊天记录';
     """
     
@@ -175,6 +230,25 @@ def save_data_to_db(msg_data: dict):
         # 提交事务
         db_conn.commit()
         print(f"[DB_SAVE] 成功保存消息到数据库: {msg_id}")
+
+        # 新插入的消息（affected rows为1, 重复消息的更新为2）写入最近消息缓存
+        if cursor.rowcount == 1:
+            now_str = datetime.now().strftime(DATETIME_FORMAT)
+            cache_record = to_recent_msg_record(dict(
+                msg_data,
+                id=cursor.lastrowid,
+                is_self=is_self,
+                is_group=is_group,
+                msg_datetime=msg_datetime,
+                created_at=now_str,
+                updated_at=now_str
+            ))
+            try:
+                RedisHandler().push_recent_msg(get_recent_msg_cache_key(wx_user_id, room_id), cache_record,
+                                               max_length=RECENT_MSG_CACHE_SIZE)
+            except Exception as error:
+                # 缓存写入失败不影响主流程，读取时会回退到MySQL
+                print(f"[DB_SAVE] 写入最近消息缓存失败: {error}")
     except Exception as e:
         print(f"[DB_SAVE] 保存消息到数据库失败: {e}")
         if db_conn:
@@ -200,6 +274,9 @@ def save_data_to_db(msg_data: dict):
 def get_wx_chat_history(room_id: str, wx_user_id: str = None, start_time: str = None, end_time: str = None, limit: int = 100, offset: int = 0):
     """
     获取微信聊天记录
+
+    指定wx_user_id且不带时间过滤时，优先从Redis最近消息缓存读取；
+    缓存未命中时查询缓存窗口内的全部消息（RECENT_MSG_CACHE_SIZE条）初始化缓存，再返回当前页
     
     Args:
         room_id (str): 聊天室ID
@@ -212,6 +289,34 @@ def get_wx_chat_history(room_id: str, wx_user_id: str = None, start_time: str =
     Returns:
         list: 聊天记录列表
     """
+    use_cache = bool(wx_user_id) and not start_time and not end_time and offset + limit <= RECENT_MSG_CACHE_SIZE
+    if not use_cache:
+        return query_wx_chat_history_from_db(room_id, wx_user_id, start_time, end_time, limit, offset)
+
+    cache_key = get_recent_msg_cache_key(wx_user_id, room_id)
+    try:
+        cached_records, complete = RedisHandler().get_recent_msgs(cache_key, offset, offset + limit - 1)
+        # 条数不足时，只有缓存包含聊天室的全部消息才能直接使用
+        if len(cached_records) == limit or complete:
+            print(f"[DB_QUERY] 从最近消息缓存读取聊天记录: {cache_key}, 数量: {len(cached_records)}")
+            return [from_recent_msg_record(record) for record in cached_records]
+    except Exception as error:
+        print(f"[DB_QUERY] 读取最近消息缓存失败, 回退到MySQL: {error}")
+
+    results = list(query_wx_chat_history_from_db(room_id, wx_user_id, limit=RECENT_MSG_CACHE_SIZE))
+    # 查询结果不足缓存窗口时就是聊天室的全部消息，标记为完整
+    try:
+        RedisHandler().fill_recent_msgs(cache_key, [to_recent_msg_record(row) for row in results],
+                                        complete=len(results) < RECENT_MSG_CACHE_SIZE)
+    except Exception as error:
+        print(f"[DB_QUERY] 初始化最近消息缓存失败: {error}")
+    return results[offset:offset + limit]
+
+
+def query_wx_chat_history_from_db(room_id: str, wx_user_id: str = None, start_time: str = None, end_time: str = None, limit: int = 100, offset: int = 0):
+    """
+    从MySQL查询微信聊天记录，参数同get_wx_chat_history
+    """
     db_conn = None
     cursor = None
     try:
@@ -243,6 +348,7 @@ def get_wx_chat_history(room_id: str, wx_user_id: str = None, start_time: str =
         # 构建查询SQL
         query_sql = f"""
             SELECT 
+                id,
                 msg_id,
                 wx_user_id,
                 wx_user_name,
@@ -258,10 +364,11 @@ def get_wx_chat_history(room_id: str, wx_user_id: str = None, start_time: str =
                 source_ip,
                 msg_timestamp,
                 msg_datetime,
-                created_at
+                created_at,
+                updated_at
             FROM {table_name}
             WHERE {' AND '.join(conditions)}
-            ORDER BY msg_datetime DESC
+            ORDER BY msg_datetime DESC, id DESC
             LIMIT %s OFFSET %s
         """
         
@@ -306,4 +413,97 @@ def get_wx_chat_history(room_id: str, wx_user_id: str = None, start_time: str =
                 db_conn.close()
             except:
                 pass
-        
\ No newline at end of file
+
+
+def check_recent_msg_cache(room_id: str, wx_user_id: str, limit: int = RECENT_MSG_CACHE_SIZE, repair: bool = False) -> dict:
+    """
+    对比Redis最近消息缓存与MySQL中的最新记录，用于排查缓存与数据库不一致的问题
+
+    Args:
+        room_id (str): 聊天室ID
+        wx_user_id (str): 微信用户ID
+        limit (int, optional): 对比的记录数量，默认与缓存长度一致
+        repair (bool, optional): 不一致时是否删除缓存，下次读取时由MySQL重新初始化
+
+    Returns:
+        dict: 对比结果，包含缓存缺失的、缓存多余的msg_id以及顺序是否一致
+    """
+    cache_key = get_recent_msg_cache_key(wx_user_id, room_id)
+    redis_handler = RedisHandler()
+
+    cached_records, _ = redis_handler.get_recent_msgs(cache_key, 0, limit - 1)
+    cached_ids = [record.get('msg_id') for record in cached_records]
+    db_ids = [row['msg_id'] for row in query_wx_chat_history_from_db(room_id, wx_user_id, limit=len(cached_ids) or limit)]
+
+    missing = [msg_id for msg_id in db_ids if msg_id not in cached_ids]
+    extra = [msg_id for msg_id in cached_ids if msg_id not in db_ids]
+    result = {
+        'cache_key': cache_key,
+        'cached_count': len(cached_ids),
+        'missing_in_cache': missing,
+        'extra_in_cache': extra,
+        'order_match': cached_ids == db_ids,
+    }
+    result['consistent'] = not missing and not extra and result['order_match']
+    print(f"[CACHE_CHECK] 最近消息缓存对比结果: {result}")
+
+    if repair and cached_ids and not result['consistent']:
+        redis_handler.delete_recent_msgs(cache_key)
+        print(f"[CACHE_CHECK] 已删除不一致的缓存: {cache_key}")
+
+    return result
+
+
+def iter_wx_chat_records(room_id: str, wx_user_id: str, after_id: int = 0, batch_size: int = 1000) -> Iterator[dict]:
+    """
+    使用服务端游标（SSDictCursor）按id升序流式读取聊天室的全部聊天记录
+
+    结果集不会一次性加载到内存，每次只从MySQL拉取batch_size条，内存占用与聊天室大小无关。
+    调用方可以记录最后一条记录的id，中断后通过after_id从断点继续读取。
+
+    Args:
+        room_id (str): 聊天室ID
+        wx_user_id (str): 微信用户ID
+        after_id (int, optional): 只读取id大于该值的记录，默认从头读取
+        batch_size (int, optional): 每次从服务端拉取的记录数，默认1000
+
+    Yields:
+        dict: 聊天记录，日期时间字段已转换为字符串
+    """
+    # 服务端游标需要独占连接，这里单独创建连接而不是复用hook的连接
+    conn_info = BaseHook.get_connection("wx_db")
+    db_conn = pymysql.connect(
+        host=conn_info.host,
+        port=int(conn_info.port or 3306),
+        user=conn_info.login,
+        password=conn_info.password,
+        database=conn_info.schema,
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.SSDictCursor
+    )
+    try:
+        with db_conn.cursor() as cursor:
+            # 消费端写文件较慢时，避免MySQL因等待客户端读取超时（默认60秒）而断开连接
+            cursor.execute("SET SESSION net_write_timeout = 600")
+            cursor.execute(
+                """
+                SELECT * FROM wx_chat_records
+                WHERE room_id = %s AND wx_user_id = %s AND id > %s
+                ORDER BY id ASC
+                """,
+                (room_id, wx_user_id, after_id)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    for key, value in row.items():
+                        if isinstance(value, datetime):
+                            row[key] = value.strftime(DATETIME_FORMAT)
+                    yield row
+    finally:
+        try:
+            db_conn.close()
+        except:
+            pass
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI回复缓存模块
+
+客服类账号经常收到相同的问题（如"地址在哪"、"营业时间"），命中缓存时直接回复，不再请求Dify。
+
+说明:
+- 按账号开启，配置保存在Airflow变量 {wx_user_name}_{wx_user_id}_reply_cache（JSON），默认关闭:
+  {"enabled": true, "ttl_seconds": 86400, "fold_traditional": false}
+- 缓存键为归一化后的问题文本（NFKC、小写、去掉空白和标点，可选繁体转简体）
+- 只缓存和使用"独立的首轮问题": 只有一条待回复消息，且该聊天室此前没有消息或已超过30分钟没有消息，
+  避免打断上下文相关的追问
+- 缓存命名空间包含Dify API Key的指纹和版本号，更换智能体自动失效，修改智能体配置后调用
+  invalidate_reply_cache（或发送管理员命令 clearcache）使旧缓存全部失效
+- 命中、未命中、写入次数记录在 reply_cache_stats:{账号} 哈希表中
+"""
+
+# 标准库导入
+import hashlib
+import time
+import unicodedata
+
+# Airflow相关导入
+from airflow.models import Variable
+
+# 自定义库导入
+from utils.redis import RedisHandler
+from wx_dags.common.mysql_tools import get_recent_msg_cache_key
+
+# 繁体转简体为可选功能，依赖opencc
+try:
+    from opencc import OpenCC
+    _t2s_converter = OpenCC('t2s')
+except ImportError:
+    _t2s_converter = None
+
+
+# 默认缓存时间（秒）
+DEFAULT_REPLY_CACHE_TTL = 24 * 60 * 60
+
+# 聊天室超过该时间没有消息，新问题视为首轮问题
+REPLY_CACHE_IDLE_SECONDS = 30 * 60
+
+# 归一化后超过该长度的问题不缓存（长问题几乎不会重复）
+REPLY_CACHE_MAX_QUESTION_LENGTH = 100
+
+
+def get_reply_cache_version_key(agent_id: str) -> str:
+    """
+    获取账号回复缓存版本号的Redis键名
+    """
+    return f"reply_cache_version:{agent_id}"
+
+
+def normalize_question(text: str, fold_traditional: bool = False) -> str:
+    """
+    归一化问题文本: 全角转半角、小写、去掉空白/标点/符号，可选繁体转简体
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    if fold_traditional:
+        if _t2s_converter is not None:
+            text = _t2s_converter.convert(text)
+        else:
+            print("[REPLY_CACHE] 未安装opencc，跳过繁体转简体")
+    return ''.join(ch for ch in text if unicodedata.category(ch)[0] not in 'PSZC')
+
+
+def is_standalone_question(wx_user_id: str, room_id: str, pending_msgs: list, idle_seconds: int = REPLY_CACHE_IDLE_SECONDS) -> bool:
+    """
+    判断是否为独立的首轮问题: 只有一条待回复消息，且聊天室此前没有消息或已超过idle_seconds没有消息
+
+    Args:
+        pending_msgs: 本次合并回复的消息列表（Redis中的待回复消息）
+    """
+    if len(pending_msgs) != 1:
+        return False
+
+    pending_ids = {str(msg.get('id')) for msg in pending_msgs}
+    # 最近消息缓存按时间倒序，跳过本次待回复的消息
+    recent_msgs = RedisHandler().get_msg_list(get_recent_msg_cache_key(wx_user_id, room_id), 0, 10)
+    for record in recent_msgs:
+        if not isinstance(record, dict) or str(record.get('msg_id')) in pending_ids:
+            continue
+        last_timestamp = int(record.get('msg_timestamp') or 0)
+        return time.time() - last_timestamp >= idle_seconds
+    return True
+
+
+class ReplyCache:
+    """
+    单个账号（智能体）的回复缓存
+    """
+
+    def __init__(self, wx_user_name: str, wx_user_id: str, dify_api_key: str):
+        self.agent_id = f"{wx_user_name}_{wx_user_id}"
+        config = Variable.get(f"{self.agent_id}_reply_cache", default_var={}, deserialize_json=True)
+        self.enabled = bool(config.get('enabled', False))
+        self.ttl_seconds = int(config.get('ttl_seconds', DEFAULT_REPLY_CACHE_TTL))
+        self.fold_traditional = bool(config.get('fold_traditional', False))
+        # 同一账号的单聊和群聊可能使用不同的智能体
+        self.api_key_fingerprint = hashlib.sha1(dify_api_key.encode('utf-8')).hexdigest()[:8]
+        self.redis_handler = RedisHandler()
+
+    @property
+    def stats_key(self) -> str:
+        return f"reply_cache_stats:{self.agent_id}"
+
+    def _cache_key(self, question: str):
+        """
+        获取问题对应的缓存键，问题不适合缓存时返回None
+        """
+        normalized = normalize_question(question, self.fold_traditional)
+        if not normalized or len(normalized) > REPLY_CACHE_MAX_QUESTION_LENGTH:
+            return None
+        version = self.redis_handler.client.get(get_reply_cache_version_key(self.agent_id)) or 0
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        return f"reply_cache:{self.agent_id}:{self.api_key_fingerprint}:v{version}:{digest}"
+
+    def get(self, question: str):
+        """
+        读取缓存的回复，未命中时返回None
+        """
+        try:
+            cache_key = self._cache_key(question)
+            if not cache_key:
+                return None
+            reply = self.redis_handler.client.get(cache_key)
+            self.redis_handler.client.hincrby(self.stats_key, 'hits' if reply else 'misses', 1)
+            print(f"[REPLY_CACHE] {'命中' if reply else '未命中'}: {question}")
+            return reply
+        except Exception as error:
+            # 缓存异常不影响正常回复
+            print(f"[REPLY_CACHE] 读取缓存失败: {error}")
+            return None
+
+    def set(self, question: str, reply: str) -> bool:
+        """
+        写入回复缓存
+        """
+        try:
+            cache_key = self._cache_key(question)
+            if not cache_key or not reply:
+                return False
+            pipe = self.redis_handler.client.pipeline()
+            pipe.set(cache_key, reply, ex=self.ttl_seconds)
+            pipe.hincrby(self.stats_key, 'stores', 1)
+            pipe.execute()
+            print(f"[REPLY_CACHE] 写入缓存: {question}")
+            return True
+        except Exception as error:
+            print(f"[REPLY_CACHE] 写入缓存失败: {error}")
+            return False
+
+
+def invalidate_reply_cache(wx_user_name: str, wx_user_id: str) -> int:
+    """
+    使账号的回复缓存全部失效（版本号+1，旧缓存不再被读取，到期后自动删除）
+
+    Returns:
+        int: 新的版本号
+    """
+    version = RedisHandler().client.incr(get_reply_cache_version_key(f"{wx_user_name}_{wx_user_id}"))
+    print(f"[REPLY_CACHE] 回复缓存已失效: {wx_user_name}_{wx_user_id}, 版本: {version}")
+    return version
+
+
+def get_reply_cache_stats(wx_user_name: str, wx_user_id: str) -> dict:
+    """
+    获取账号的缓存命中统计
+    """
+    stats = RedisHandler().get_hash_all(f"reply_cache_stats:{wx_user_name}_{wx_user_id}")
+    hits = int(stats.get('hits', 0))
+    misses = int(stats.get('misses', 0))
+    return {
+        'hits': hits,
+        'misses': misses,
+        'stores': int(stats.get('stores', 0)),
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+    }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天数据小时级汇总模块
+
+功能:
+1. 初始化汇总表 wx_msg_hourly_rollup（按 账号 + 聊天室 + 小时 汇总）和水位表 wx_rollup_watermark
+2. 按id水位增量汇总 wx_chat_records 中的新消息: 收到的消息数、AI回复数、AI平均回复延迟
+3. 记录转人工次数（转人工不落聊天记录表，由消息处理流程直接计数）
+
+说明:
+- AI回复: is_self=1 且 msg_id 为uuid（副作用队列的 save_ai_reply 任务写入），手动发送的消息使用微信的数字msg_id
+- 回复延迟: AI回复时间与同一聊天室中此前最近一条收到的消息时间之差（秒）
+- 汇总与水位更新在同一个事务中提交，任务重试不会重复计数
+"""
+
+from datetime import datetime
+
+from airflow.hooks.base import BaseHook
+
+
+# 水位名称
+ROLLUP_WATERMARK_NAME = 'wx_msg_hourly_rollup'
+
+# 只汇总写入超过该秒数的消息，避免自增id较小但事务尚未提交的消息被水位跳过
+ROLLUP_SETTLE_SECONDS = 30
+
+
+def get_db_conn():
+    """
+    获取wx_db数据库连接
+    """
+    db_hook = BaseHook.get_connection("wx_db").get_hook()
+    return db_hook.get_conn()
+
+
+def init_rollup_tables():
+    """
+    初始化汇总表和水位表
+    """
+    db_conn = get_db_conn()
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `wx_msg_hourly_rollup` (
+            `wx_user_id` varchar(64) NOT NULL COMMENT '微信账号ID',
+            `room_id` varchar(64) NOT NULL COMMENT '聊天室ID',
+            `stat_hour` datetime NOT NULL COMMENT '统计小时',
+            `inbound_count` int NOT NULL DEFAULT 0 COMMENT '收到的消息数',
+            `ai_reply_count` int NOT NULL DEFAULT 0 COMMENT 'AI回复数',
+            `handoff_count` int NOT NULL DEFAULT 0 COMMENT '转人工次数',
+            `reply_latency_sum` bigint NOT NULL DEFAULT 0 COMMENT 'AI回复延迟总和（秒）',
+            `reply_latency_count` int NOT NULL DEFAULT 0 COMMENT '计入延迟的AI回复数',
+            `updated_at` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+            PRIMARY KEY (`wx_user_id`, `room_id`, `stat_hour`),
+            KEY `idx_stat_hour` (`stat_hour`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='微信聊天小时级汇总';
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS `wx_rollup_watermark` (
+            `name` varchar(64) NOT NULL COMMENT '汇总名称',
+            `last_id` bigint NOT NULL DEFAULT 0 COMMENT '已汇总的最大消息id',
+            `updated_at` datetime DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+            PRIMARY KEY (`name`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='汇总任务水位';
+        """)
+        cursor.execute(
+            "INSERT IGNORE INTO `wx_rollup_watermark` (name, last_id) VALUES (%s, 0)",
+            (ROLLUP_WATERMARK_NAME,)
+        )
+        db_conn.commit()
+    finally:
+        cursor.close()
+        db_conn.close()
+
+
+def rollup_new_messages(batch_size: int = 5000, max_batches: int = 20) -> dict:
+    """
+    从水位之后增量汇总新消息，每批最多batch_size条，直到追上或达到max_batches
+
+    Returns:
+        dict: 本次汇总的批次数、消息数和最新水位
+    """
+    db_conn = get_db_conn()
+    cursor = db_conn.cursor()
+    batches = 0
+    rolled_rows = 0
+    try:
+        while batches < max_batches:
+            # 锁定水位行，避免并发运行时重复汇总
+            cursor.execute(
+                "SELECT last_id FROM `wx_rollup_watermark` WHERE name = %s FOR UPDATE",
+                (ROLLUP_WATERMARK_NAME,)
+            )
+            last_id = cursor.fetchone()[0]
+
+            # 本批次的上界: 水位之后连续的、已写入超过ROLLUP_SETTLE_SECONDS的消息（主键范围扫描）
+            cursor.execute(
+                """
+                SELECT id, created_at < NOW() - INTERVAL %s SECOND AS settled
+                FROM wx_chat_records
+                WHERE id > %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                (ROLLUP_SETTLE_SECONDS, last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            end_id = None
+            row_count = 0
+            for msg_id, settled in rows:
+                if not settled:
+                    break
+                end_id = msg_id
+                row_count += 1
+            if end_id is None:
+                db_conn.commit()
+                break
+
+            cursor.execute(
+                """
+                INSERT INTO wx_msg_hourly_rollup
+                    (wx_user_id, room_id, stat_hour, inbound_count, ai_reply_count,
+                     reply_latency_sum, reply_latency_count)
+                SELECT
+                    m.wx_user_id,
+                    m.room_id,
+                    DATE_FORMAT(m.msg_datetime, '%%Y-%%m-%%d %%H:00:00') AS stat_hour,
+                    SUM(m.is_self = 0) AS inbound_count,
+                    SUM(m.is_ai_reply) AS ai_reply_count,
+                    COALESCE(SUM(m.latency), 0) AS reply_latency_sum,
+                    COUNT(m.latency) AS reply_latency_count
+                FROM (
+                    SELECT
+                        r.wx_user_id,
+                        r.room_id,
+                        r.msg_datetime,
+                        r.is_self,
+                        (r.is_self = 1 AND r.msg_id LIKE '%%-%%') AS is_ai_reply,
+                        IF(r.is_self = 1 AND r.msg_id LIKE '%%-%%',
+                           TIMESTAMPDIFF(SECOND, (
+                               SELECT MAX(i.msg_datetime) FROM wx_chat_records i
+                               WHERE i.room_id = r.room_id
+                                 AND i.wx_user_id = r.wx_user_id
+                                 AND i.is_self = 0
+                                 AND i.msg_datetime <= r.msg_datetime
+                           ), r.msg_datetime),
+                           NULL) AS latency
+                    FROM wx_chat_records r
+                    WHERE r.id > %s AND r.id <= %s
+                ) m
+                GROUP BY m.wx_user_id, m.room_id, stat_hour
+                ON DUPLICATE KEY UPDATE
+                    inbound_count = inbound_count + VALUES(inbound_count),
+                    ai_reply_count = ai_reply_count + VALUES(ai_reply_count),
+                    reply_latency_sum = reply_latency_sum + VALUES(reply_latency_sum),
+                    reply_latency_count = reply_latency_count + VALUES(reply_latency_count)
+                """,
+                (last_id, end_id)
+            )
+
+            # 汇总结果与水位在同一事务中提交
+            cursor.execute(
+                "UPDATE `wx_rollup_watermark` SET last_id = %s WHERE name = %s",
+                (end_id, ROLLUP_WATERMARK_NAME)
+            )
+            db_conn.commit()
+
+            batches += 1
+            rolled_rows += row_count
+            print(f"[ROLLUP] 汇总消息 id ({last_id}, {end_id}], 共 {row_count} 条")
+
+            if row_count < len(rows) or len(rows) < batch_size:
+                break
+
+        cursor.execute("SELECT last_id FROM `wx_rollup_watermark` WHERE name = %s", (ROLLUP_WATERMARK_NAME,))
+        watermark = cursor.fetchone()[0]
+        return {'batches': batches, 'rows': rolled_rows, 'watermark': watermark}
+    except Exception as e:
+        print(f"[ROLLUP] 汇总失败: {e}")
+        try:
+            db_conn.rollback()
+        except:
+            pass
+        raise
+    finally:
+        cursor.close()
+        db_conn.close()
+
+
+def record_handoff(wx_user_id: str, room_id: str):
+    """
+    转人工次数+1（计入当前小时）
+    """
+    stat_hour = datetime.now().strftime('%Y-%m-%d %H:00:00')
+    db_conn = get_db_conn()
+    cursor = db_conn.cursor()
+    try:
+        cursor.execute(
+            """
+            INSERT INTO wx_msg_hourly_rollup (wx_user_id, room_id, stat_hour, handoff_count)
+            VALUES (%s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE handoff_count = handoff_count + 1
+            """,
+            (wx_user_id, room_id, stat_hour)
+        )
+        db_conn.commit()
+    finally:
+        cursor.close()
+        db_conn.close()
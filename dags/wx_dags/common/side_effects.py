@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台副作用队列模块
+
+消息处理任务发送完AI回复后，把不影响回复的收尾工作（重命名会话、删除缓存变量、保存AI回复到DB、
+消息计数等）写入Redis队列后立即返回，由 wx_side_effect_worker DAG 统一执行，尽快释放worker槽位。
+
+队列结构:
+- wx_side_effect_queue: 待执行的任务（LPUSH写入，BRPOPLPUSH取出，先进先出）
+- wx_side_effect_processing: 执行中的任务，worker异常退出后下次启动时放回待执行队列
+- wx_side_effect_delayed: 等待重试的任务（有序集合，score为重试时间戳）
+- wx_side_effect_dead_letter: 超过重试次数的任务，保留最近1000条，供人工排查
+
+说明:
+- 任务至少执行一次，任务处理函数需保证幂等（如AI回复的msg_id在入队时生成）
+- 入队失败（Redis不可用）时直接同步执行，不丢失任务
+"""
+
+# 标准库导入
+import json
+import time
+import uuid
+from datetime import datetime
+
+# Airflow相关导入
+from airflow.models import Variable
+
+# 自定义库导入
+from utils.dify_sdk import DifyAgent
+from utils.redis import RedisHandler
+from wx_dags.common.wx_tools import WX_MSG_TYPES
+from wx_dags.common.wx_tools import get_contact_name
+from wx_dags.common.wx_tools import publish_wx_event
+from wx_dags.common.mysql_tools import save_data_to_db
+
+
+SIDE_EFFECT_QUEUE_KEY = 'wx_side_effect_queue'
+SIDE_EFFECT_PROCESSING_KEY = 'wx_side_effect_processing'
+SIDE_EFFECT_DELAYED_KEY = 'wx_side_effect_delayed'
+SIDE_EFFECT_DEAD_LETTER_KEY = 'wx_side_effect_dead_letter'
+
+# 死信队列保留的最大任务数
+DEAD_LETTER_MAX_LENGTH = 1000
+
+# 默认重试次数和退避基数（秒）
+DEFAULT_MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 10
+
+# 任务类型 -> 处理函数
+SIDE_EFFECT_HANDLERS = {}
+
+
+def side_effect(job_type):
+    """
+    注册任务处理函数的装饰器，处理函数接收任务的payload字典，失败时抛出异常
+    """
+    def decorator(func):
+        SIDE_EFFECT_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def enqueue_side_effect(job_type, payload, max_retries=DEFAULT_MAX_RETRIES):
+    """
+    写入一个副作用任务
+
+    Args:
+        job_type (str): 任务类型，需已通过 side_effect 注册
+        payload (dict): 任务参数，需可以JSON序列化
+        max_retries (int): 失败后的最大重试次数
+
+    Returns:
+        bool: 是否已入队（入队失败时同步执行，执行失败只记录日志，返回False）
+    """
+    if job_type not in SIDE_EFFECT_HANDLERS:
+        raise ValueError(f"未知的副作用任务类型: {job_type}")
+
+    job = {
+        'id': str(uuid.uuid4()),
+        'type': job_type,
+        'payload': payload,
+        'attempts': 0,
+        'max_retries': max_retries,
+        'created_at': int(time.time()),
+    }
+    try:
+        RedisHandler().client.lpush(SIDE_EFFECT_QUEUE_KEY, json.dumps(job, ensure_ascii=False))
+        print(f"[SIDE_EFFECT] 任务入队: {job_type} {job['id']}")
+        return True
+    except Exception as error:
+        print(f"[SIDE_EFFECT] 任务入队失败，同步执行: {job_type}, {error}")
+
+    # 副作用在回复发送之后执行，失败只记录日志，不能让回复任务失败（任务重试会重复发送回复）
+    try:
+        SIDE_EFFECT_HANDLERS[job_type](payload)
+    except Exception as error:
+        print(f"[SIDE_EFFECT] 同步执行失败: {job_type}, {error}")
+    return False
+
+
+def recover_processing_jobs(client):
+    """
+    把上次worker未完成的任务放回待执行队列（worker只有一个实例运行时调用）
+    """
+    recovered = 0
+    while client.rpoplpush(SIDE_EFFECT_PROCESSING_KEY, SIDE_EFFECT_QUEUE_KEY):
+        recovered += 1
+    if recovered:
+        print(f"[SIDE_EFFECT] 恢复未完成的任务: {recovered}")
+    return recovered
+
+
+def move_due_retries(client):
+    """
+    把已到重试时间的任务放回待执行队列
+    """
+    now = time.time()
+    due_jobs = client.zrangebyscore(SIDE_EFFECT_DELAYED_KEY, 0, now)
+    for raw_job in due_jobs:
+        # ZREM成功才入队，避免重复
+        if client.zrem(SIDE_EFFECT_DELAYED_KEY, raw_job):
+            client.lpush(SIDE_EFFECT_QUEUE_KEY, raw_job)
+    return len(due_jobs)
+
+
+def handle_failed_job(client, job, error):
+    """
+    任务失败: 未超过重试次数时延迟重试，否则写入死信队列
+    """
+    job['attempts'] += 1
+    job['last_error'] = str(error)
+    raw_job = json.dumps(job, ensure_ascii=False)
+    if job['attempts'] <= job.get('max_retries', DEFAULT_MAX_RETRIES):
+        retry_at = time.time() + RETRY_BACKOFF_SECONDS * (2 ** (job['attempts'] - 1))
+        client.zadd(SIDE_EFFECT_DELAYED_KEY, {raw_job: retry_at})
+        print(f"[SIDE_EFFECT] 任务失败，第{job['attempts']}次重试: {job['type']} {job['id']}, {error}")
+    else:
+        job['failed_at'] = int(time.time())
+        pipe = client.pipeline()
+        pipe.lpush(SIDE_EFFECT_DEAD_LETTER_KEY, json.dumps(job, ensure_ascii=False))
+        pipe.ltrim(SIDE_EFFECT_DEAD_LETTER_KEY, 0, DEAD_LETTER_MAX_LENGTH - 1)
+        pipe.execute()
+        print(f"[SIDE_EFFECT] 任务超过重试次数，写入死信队列: {job['type']} {job['id']}, {error}")
+
+
+def run_side_effect_worker(max_seconds=55, block_seconds=5):
+    """
+    循环执行副作用任务，直到运行时间超过max_seconds
+
+    Returns:
+        dict: 执行统计
+    """
+    client = RedisHandler().client
+    stats = {'recovered': recover_processing_jobs(client), 'succeeded': 0, 'failed': 0}
+
+    start_time = time.time()
+    while time.time() - start_time < max_seconds:
+        move_due_retries(client)
+
+        raw_job = client.brpoplpush(SIDE_EFFECT_QUEUE_KEY, SIDE_EFFECT_PROCESSING_KEY, timeout=block_seconds)
+        if not raw_job:
+            continue
+
+        try:
+            job = json.loads(raw_job)
+        except json.JSONDecodeError:
+            print(f"[SIDE_EFFECT] 丢弃无法解析的任务: {raw_job}")
+            client.lrem(SIDE_EFFECT_PROCESSING_KEY, 1, raw_job)
+            continue
+
+        handler = SIDE_EFFECT_HANDLERS.get(job.get('type'))
+        try:
+            if handler is None:
+                raise ValueError(f"未知的副作用任务类型: {job.get('type')}")
+            handler(job['payload'])
+            stats['succeeded'] += 1
+        except Exception as error:
+            stats['failed'] += 1
+            handle_failed_job(client, job, error)
+        finally:
+            client.lrem(SIDE_EFFECT_PROCESSING_KEY, 1, raw_job)
+
+    return stats
+
+
+@side_effect('rename_conversation')
+def rename_conversation(payload):
+    """
+    重命名Dify会话
+    payload: wx_user_name, wx_user_id, is_group, conversation_id, dify_user_id, name
+    """
+    wx_user_name = payload['wx_user_name']
+    wx_user_id = payload['wx_user_id']
+
+    # 如果是群聊，先检查是否有群聊专用的API key
+    dify_api_key = None
+    if payload.get('is_group'):
+        dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_group_dify_api_key", default_var=None)
+    if not dify_api_key:
+        dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
+
+    dify_agent = DifyAgent(api_key=dify_api_key, base_url=Variable.get("DIFY_BASE_URL"))
+    dify_agent.rename_conversation(payload['conversation_id'], payload['dify_user_id'], payload['name'])
+
+
+@side_effect('delete_variable')
+def delete_variable(payload):
+    """
+    删除Airflow变量
+    payload: key
+    """
+    Variable.delete(payload['key'])
+
+
+@side_effect('incr_msg_count')
+def incr_msg_count(payload):
+    """
+    账号的消息计时器+1（由单个worker串行执行，避免并发读写丢失计数）
+    payload: wx_user_name
+    """
+    key = f"{payload['wx_user_name']}_msg_count"
+    msg_count = Variable.get(key, default_var=0, deserialize_json=True)
+    Variable.set(key, msg_count + 1, serialize_json=True)
+
+
+@side_effect('save_ai_reply')
+def save_ai_reply(payload):
+    """
+    保存AI回复的消息到DB，并推送AI回复事件到前端
+    payload: msg_id, room_id, content, is_group, msg_timestamp, source_ip, wx_user_name, wx_user_id
+    """
+    save_msg = {}
+    save_msg['room_id'] = payload['room_id']
+    save_msg['sender_id'] = payload['wx_user_id']
+    save_msg['msg_id'] = payload['msg_id']
+    save_msg['msg_type'] = 1  # 消息类型
+    save_msg['msg_type_name'] = WX_MSG_TYPES.get(save_msg['msg_type'], '文本')
+    save_msg['content'] = payload['content']
+    save_msg['is_self'] = True  # 是否自己发送的消息
+    save_msg['is_group'] = payload.get('is_group', False)  # 是否群聊
+    save_msg['msg_timestamp'] = payload['msg_timestamp']
+    save_msg['msg_datetime'] = datetime.fromtimestamp(payload['msg_timestamp'])
+    save_msg['source_ip'] = payload.get('source_ip', '')
+    save_msg['wx_user_name'] = payload['wx_user_name']
+    save_msg['wx_user_id'] = payload['wx_user_id']
+
+    # 获取房间信息
+    save_msg['room_name'] = get_contact_name(save_msg['source_ip'], save_msg['room_id'], save_msg['wx_user_name'])
+    save_msg['sender_name'] = save_msg['wx_user_name']
+
+    # 保存消息到DB（msg_id在入队时生成，重试不会重复写入）
+    save_data_to_db(save_msg)
+
+    # 推送AI回复事件到前端
+    publish_wx_event('ai_reply', save_msg['wx_user_id'], {
+        'msg_id': save_msg['msg_id'],
+        'room_id': save_msg['room_id'],
+        'room_name': save_msg['room_name'],
+        'sender_id': save_msg['sender_id'],
+        'sender_name': save_msg['sender_name'],
+        'msg_type': save_msg['msg_type'],
+        'content': save_msg['content'],
+        'is_self': True,
+        'is_group': save_msg['is_group'],
+        'msg_timestamp': save_msg['msg_timestamp'],
+    })
+
+    try:
+        # 账号的消息计时器+1
+        incr_msg_count({'wx_user_name': save_msg['wx_user_name']})
+    except Exception as error:
+        # 不影响消息保存，避免重试时重复推送事件
+        print(f"[SIDE_EFFECT] 更新消息计时器失败: {error}")
+
+
+def enqueue_ai_reply(message_data, wx_account_info, content):
+    """
+    AI回复发送成功后，入队保存AI回复的任务
+    """
+    enqueue_side_effect('save_ai_reply', {
+        'msg_id': str(uuid.uuid4()),
+        'room_id': message_data.get('roomid', ''),
+        'content': content,
+        'is_group': message_data.get('is_group', False),
+        'msg_timestamp': int(datetime.now().timestamp()),
+        'source_ip': message_data.get('source_ip', ''),
+        'wx_user_name': wx_account_info.get('name', ''),
+        'wx_user_id': wx_account_info.get('wxid', ''),
+    })
@@ -15,6 +15,7 @@ Date: 2025-01-09
 from datetime import datetime
 
 from airflow.models import Variable
+from utils.concurrency import prefetch
 from utils.wechat_channl import get_wx_self_info
 from utils.wechat_channl import get_wx_contact_list
 from wx_dags.common.mysql_tools import init_wx_chat_records_table
@@ -35,6 +36,7 @@ from airflow.exceptions import AirflowException
 from utils.wechat_channl import save_wx_image
 from utils.wechat_channl import send_wx_image
 from utils.wechat_channl import save_wx_audio
+from utils.redis import RedisHandler
 
 # 第三方库导入
 from smbclient import register_session, open_file
@@ -78,6 +80,18 @@ WX_MSG_TYPES = {
 }
 
 
+def publish_wx_event(event_type: str, wx_user_id: str, payload: dict):
+    """
+    发布消息事件到账号的事件流（{wx_user_id}_events），推送网关据此实时推送给前端
+    """
+    try:
+        event = dict(payload, type=event_type, wx_user_id=wx_user_id)
+        RedisHandler().publish_event(f'{wx_user_id}_events', event)
+    except Exception as error:
+        # 推送失败不影响主流程，前端仍可通过轮询获取消息
+        print(f"[WATCHER] 发布消息事件失败: {error}")
+
+
 def update_wx_user_info(source_ip: str) -> dict:
     """
     获取用户信息，并缓存。对于新用户，会初始化其专属的 enable_ai_room_ids 列表
@@ -215,13 +229,17 @@ def check_ai_enable(wx_user_name: str, wx_user_id: str, room_id: str, is_group:
     
     单个会话的开关优先级高于全局设置
     """
-    # 获取单个会话设置
-    enable_rooms = Variable.get(f"{wx_user_name}_{wx_user_id}_enable_ai_room_ids", default_var=[], deserialize_json=True)
-    disable_rooms = Variable.get(f"{wx_user_name}_{wx_user_id}_disable_ai_room_ids", default_var=[], deserialize_json=True)
-    
-    # 获取全局设置
-    single_chat_global = Variable.get(f"{wx_user_name}_{wx_user_id}_single_chat_ai_global", default_var="off")
-    group_chat_global = Variable.get(f"{wx_user_name}_{wx_user_id}_group_chat_ai_global", default_var="off")
+    # 并发读取单个会话设置和全局设置
+    settings = prefetch({
+        "enable_rooms": lambda: Variable.get(f"{wx_user_name}_{wx_user_id}_enable_ai_room_ids", default_var=[], deserialize_json=True),
+        "disable_rooms": lambda: Variable.get(f"{wx_user_name}_{wx_user_id}_disable_ai_room_ids", default_var=[], deserialize_json=True),
+        "single_chat_global": lambda: Variable.get(f"{wx_user_name}_{wx_user_id}_single_chat_ai_global", default_var="off"),
+        "group_chat_global": lambda: Variable.get(f"{wx_user_name}_{wx_user_id}_group_chat_ai_global", default_var="off"),
+    })
+    enable_rooms = settings["enable_rooms"]
+    disable_rooms = settings["disable_rooms"]
+    single_chat_global = settings["single_chat_global"]
+    group_chat_global = settings["group_chat_global"]
     
     print(f"个人会话全局设置: {single_chat_global}, 群聊全局设置: {group_chat_global}")
     print(f"显式开启AI的会话: {enable_rooms}")
@@ -247,6 +265,17 @@ def check_ai_enable(wx_user_name: str, wx_user_id: str, room_id: str, is_group:
         return single_chat_global == "on"
 
 
+def get_dify_api_key(wx_user_name: str, wx_user_id: str, is_group: bool) -> str:
+    """
+    获取账号的Dify API Key，群聊优先使用群聊专用的API Key
+    """
+    if is_group:
+        group_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_group_dify_api_key", default_var=None)
+        if group_api_key:
+            return group_api_key
+    return Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
+
+
 def download_image_from_windows_server(source_ip: str, msg_id: str, extra: str, max_retries: int = 2, retry_delay: int = 5):
     """从SMB服务器下载文件到服务器本地
     
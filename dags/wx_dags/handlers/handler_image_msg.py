@@ -15,6 +15,8 @@ from airflow.models.variable import Variable
 
 # 自定义库导入
 from utils.dify_sdk import DifyAgent
+from utils.image_prep import DIFY_MAX_EDGE
+from utils.image_prep import prepare_image
 from utils.wechat_channl import send_wx_msg
 from wx_dags.common.wx_tools import get_contact_name
 from wx_dags.common.wx_tools import download_image_from_windows_server
@@ -66,7 +68,13 @@ def handler_image_msg(**context):
             dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
             
         dify_agent = DifyAgent(api_key=dify_api_key, base_url=Variable.get("DIFY_BASE_URL"))
-        online_img_info = dify_agent.upload_file(image_file_path, dify_user_id)
+        # 上传前预处理（缩小、去掉EXIF、压缩），手机原图通常有数MB
+        try:
+            upload_file_path = prepare_image(image_file_path, max_edge=DIFY_MAX_EDGE).path
+        except Exception as error:
+            print(f"[WATCHER] 图片预处理失败，上传原图: {error}")
+            upload_file_path = image_file_path
+        online_img_info = dify_agent.upload_file_cached(upload_file_path, dify_user_id)
         print(f"[WATCHER] 上传图片到Dify成功: {online_img_info}")
 
         # 这里不发起聊天消息,缓存到Airflow的变量中,等待文字消息来触发
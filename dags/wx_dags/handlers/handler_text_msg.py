@@ -15,10 +15,21 @@ from airflow.models.variable import Variable
 
 # 自定义库导入
 from utils.dify_sdk import DifyAgent
+from utils.dify_sdk import MessageChunk
+from utils.dify_sdk import StreamCollector
+from utils.dify_sdk import get_room_conversation_id
+from utils.dify_sdk import save_room_conversation_id
+from utils.concurrency import prefetch
 from utils.wechat_channl import send_wx_msg
 from utils.wechat_channl import send_wx_image
 from utils.redis import RedisHandler
 from wx_dags.common.wx_tools import get_contact_name
+from wx_dags.common.wx_tools import get_dify_api_key
+from wx_dags.common.rollup_tools import record_handoff
+from wx_dags.common.side_effects import enqueue_side_effect
+from wx_dags.common.side_effects import enqueue_ai_reply
+from wx_dags.common.reply_cache import ReplyCache
+from wx_dags.common.reply_cache import is_standalone_question
 
 
 def should_pre_stop(current_message, wx_user_id, room_id):
@@ -43,6 +54,65 @@ def should_pre_stop(current_message, wx_user_id, room_id):
         print(f"[PRE_STOP] 最新消息id一致，继续执行")
 
 
+# 段落分隔符，兼容Dify返回的转义换行
+PARAGRAPH_SEPARATOR = re.compile(r'\\n\\n|\n\n')
+
+# 控制标签，只出现在回答末尾，发送前需要去掉
+CONTROL_TAGS = ("#转人工#", "#沉默#")
+
+
+def iter_reply_paragraphs(events):
+    """
+    从Dify的流式事件中逐段取出回答，遇到段落分隔符就返回已完整的段落，不等待整个回答生成完毕
+
+    Args:
+        events: DifyAgent.iter_chat_message_stream 返回的事件迭代器
+
+    Yields:
+        str: 一个段落（可能为空白或只包含控制标签，由调用方处理）
+    """
+    buffer = ""
+    for event in events:
+        if not isinstance(event, MessageChunk):
+            continue
+        buffer += event.answer
+        while True:
+            match = PARAGRAPH_SEPARATOR.search(buffer)
+            if not match:
+                break
+            yield buffer[:match.start()]
+            buffer = buffer[match.end():]
+    if buffer:
+        yield buffer
+
+
+def strip_control_tags(text):
+    """
+    去掉回答中的控制标签
+    """
+    for tag in CONTROL_TAGS:
+        text = text.replace(tag, "")
+    return text
+
+
+def send_reply_part(source_ip, room_id, response_part):
+    """
+    发送一段回答，图片/视频文件名发送对应的文件，其他内容按文本发送
+    """
+    response_part = response_part.replace('\\n', '\n')
+    if response_part.strip().endswith('.png'):
+        # 发送图片
+        image_file_path = f"C:/Users/Administrator/Desktop/files/{response_part.strip()}"
+        send_wx_image(wcf_ip=source_ip, image_path=image_file_path, receiver=room_id)
+    elif response_part.strip().endswith('.mp4'):
+        # 发送视频
+        image_file_path = f"C:/Users/Administrator/Desktop/files/{response_part.strip()}"
+        send_wx_image(wcf_ip=source_ip, image_path=image_file_path, receiver=room_id)
+    else:
+        # 发送文本
+        send_wx_msg(wcf_ip=source_ip, message=response_part, receiver=room_id)
+
+
 def handler_text_msg(**context):
     """
     处理文本类消息, 通过Dify的AI助手进行聊天, 并回复微信消息
@@ -71,34 +141,37 @@ def handler_text_msg(**context):
     # 检查是否需要提前停止流程 
     should_pre_stop(message_data, wx_user_id, room_id)
 
-    # 获取房间和发送者信息
-    room_name = get_contact_name(source_ip, room_id, wx_user_name)
-    sender_name = get_contact_name(source_ip, sender, wx_user_name) or (wx_user_name if is_self else None)
+    # 并发读取回复需要的信息（联系人名称、Dify配置、会话ID、待回复的消息、在线图片），耗时接近最慢的一个
+    redis_handler = RedisHandler()
+
+    def get_room_info():
+        # 会话ID按房间名称区分Dify用户，需要在获取房间名称之后读取
+        room_name = get_contact_name(source_ip, room_id, wx_user_name)
+        sender_name = get_contact_name(source_ip, sender, wx_user_name) or (wx_user_name if is_self else None)
+        dify_user_id = f"{wx_user_name}_{wx_user_id}_{room_name}"
+        return room_name, sender_name, dify_user_id, get_room_conversation_id(dify_user_id, room_id)
+
+    prefetched = prefetch({
+        "room_info": get_room_info,
+        "dify_api_key": lambda: get_dify_api_key(wx_user_name, wx_user_id, is_group),
+        "dify_base_url": lambda: Variable.get("DIFY_BASE_URL"),
+        "room_msg_list": lambda: redis_handler.get_msg_list(f'{wx_user_id}_{room_id}_msg_list'),
+        "online_img_info": lambda: Variable.get(f"{wx_user_name}_{room_id}_online_img_info", default_var={}, deserialize_json=True),
+    })
+    room_name, sender_name, dify_user_id, conversation_id = prefetched["room_info"]
+    dify_api_key = prefetched["dify_api_key"]
+    room_msg_list = prefetched["room_msg_list"]
+    online_img_info = prefetched["online_img_info"]
 
     # 打印调试信息
     print(f"房间信息: {room_id}({room_name}), 发送者: {sender}({sender_name})")
 
-    # 如果是群聊，先检查是否有群聊专用的API key
-    if is_group:
-        try:
-            dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_group_dify_api_key")
-        except:
-            dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
-    else:
-        dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
-        
-    dify_agent = DifyAgent(api_key=dify_api_key, base_url=Variable.get("DIFY_BASE_URL"))
-
-    # 获取会话ID
-    dify_user_id = f"{wx_user_name}_{wx_user_id}_{room_name}"
-    conversation_id = dify_agent.get_conversation_id_for_room(dify_user_id, room_id)
+    dify_agent = DifyAgent(api_key=dify_api_key, base_url=prefetched["dify_base_url"])
 
     # 检查是否需要提前停止流程
     should_pre_stop(message_data, wx_user_id, room_id)
 
     # 如果开启AI，则遍历近期的消息是否已回复，没有回复，则合并到这次提问
-    redis_handler = RedisHandler()
-    room_msg_list = redis_handler.get_msg_list(f'{wx_user_id}_{room_id}_msg_list')
     up_for_reply_msg_content_list = []
     up_for_reply_msg_id_list = []
     for msg in room_msg_list[-5:]:  # 只取最近的5条消息
@@ -114,9 +187,8 @@ def handler_text_msg(**context):
     # 检查是否需要提前停止流程
     should_pre_stop(message_data, wx_user_id, room_id)
 
-    # 获取在线图片信息
+    # 在线图片信息
     dify_files = []
-    online_img_info = Variable.get(f"{wx_user_name}_{room_id}_online_img_info", default_var={}, deserialize_json=True)
     if online_img_info:
         dify_files.append({
             "type": "image",
@@ -124,32 +196,76 @@ def handler_text_msg(**context):
             "upload_file_id": online_img_info.get("id", "")
         })
     
-    # 获取AI回复
-    full_answer, metadata = dify_agent.create_chat_message_stream(
+    # 回复缓存（按账号开启）: 只用于独立的首轮问题，且没有待识别的图片
+    reply_cache = ReplyCache(wx_user_name, wx_user_id, dify_api_key)
+    use_reply_cache = reply_cache.enabled and not dify_files and is_standalone_question(wx_user_id, room_id, room_msg_list)
+    if use_reply_cache:
+        cached_reply = reply_cache.get(question)
+        if cached_reply:
+            should_pre_stop(message_data, wx_user_id, room_id)
+            for response_part in PARAGRAPH_SEPARATOR.split(cached_reply):
+                if response_part.strip():
+                    send_reply_part(source_ip, room_id, response_part)
+
+            # 删除缓存的消息
+            redis_handler.delete_msg_key(f'{wx_user_id}_{room_id}_msg_list')
+
+            # 保存AI回复到DB，交给后台执行
+            enqueue_ai_reply(message_data, wx_account_info, cached_reply)
+            context['task_instance'].xcom_push(key='ai_reply_msg', value=cached_reply)
+            return
+
+    # 获取AI回复，每生成完一个段落就立即发送，不等待整个回答生成完毕
+    collector = StreamCollector()
+    events = dify_agent.iter_chat_message_stream(
         query=question,
         user_id=dify_user_id,
         conversation_id=conversation_id,
-        files=dify_files
+        files=dify_files,
+        collector=collector
     )
-    print(f"full_answer: {full_answer}")
-    print(f"metadata: {metadata}")
-    response = full_answer
+    sent_parts = []
+    send_error = None
+    try:
+        for paragraph in iter_reply_paragraphs(events):
+            response_part = strip_control_tags(paragraph)
+            if not response_part.strip() or send_error:
+                continue
 
-    if not conversation_id:
-        # 新会话，重命名会话
-        conversation_id = metadata.get("conversation_id")
-        dify_agent.rename_conversation(conversation_id, dify_user_id, room_name)
+            # 发送第一段之前检查是否需要提前停止流程
+            if not sent_parts:
+                should_pre_stop(message_data, wx_user_id, room_id)
 
-        # 保存会话ID
-        conversation_infos = Variable.get(f"{dify_user_id}_conversation_infos", default_var={}, deserialize_json=True)
-        conversation_infos[room_id] = conversation_id
-        Variable.set(f"{dify_user_id}_conversation_infos", conversation_infos, serialize_json=True)
-    else:
-        # 旧会话，不重命名
-        pass
-    
-    # 检查是否需要提前停止流程
-    should_pre_stop(message_data, wx_user_id, room_id)
+            try:
+                send_reply_part(source_ip, room_id, response_part)
+                sent_parts.append(response_part)
+            except Exception as error:
+                # 发送失败后不再发送后续段落，但继续读完流式响应以获取元数据
+                print(f"[WATCHER] 发送消息失败: {error}")
+                send_error = error
+    finally:
+        full_answer, metadata = collector.result()
+        print(f"full_answer: {full_answer}")
+        print(f"metadata: {metadata}")
+        print(f"[TEXT_MSG] 流式回复, {collector.summary()}, 已发送 {len(sent_parts)} 段")
+
+        if metadata.get("conversation_id") and metadata.get("conversation_id") != conversation_id:
+            # 新会话（或缓存的会话已失效），保存会话ID，下一条消息需要立即使用
+            conversation_id = metadata.get("conversation_id")
+            save_room_conversation_id(dify_user_id, room_id, conversation_id)
+
+            # 重命名会话不影响回复，交给后台执行
+            enqueue_side_effect('rename_conversation', {
+                'wx_user_name': wx_user_name,
+                'wx_user_id': wx_user_id,
+                'is_group': is_group,
+                'conversation_id': conversation_id,
+                'dify_user_id': dify_user_id,
+                'name': room_name,
+            })
+
+    response = full_answer
+    has_control_tag = any(tag in response for tag in CONTROL_TAGS)
 
     # 判断是否转人工
     if "#转人工#" in response.strip().lower():
@@ -159,49 +275,41 @@ def handler_text_msg(**context):
         human_room_ids.append(room_id)
         human_room_ids = list(set(human_room_ids))  # 去重
         Variable.set(f"{wx_user_name}_{wx_user_id}_human_room_ids", human_room_ids, serialize_json=True)
+
+        try:
+            # 转人工次数计入数据大屏的小时汇总
+            record_handoff(wx_user_id, room_id)
+        except Exception as error:
+            # 不影响主流程
+            print(f"[WATCHER] 记录转人工次数失败: {error}")
         
         # 删除缓存的消息
         redis_handler.delete_msg_key(f'{wx_user_id}_{room_id}_msg_list')
-        # 删除标签
-        response = response.replace("#转人工#", "")
     
     if "#沉默#" in response.strip().lower():
         # 删除缓存的消息
         redis_handler.delete_msg_key(f'{wx_user_id}_{room_id}_msg_list')
-        # 删除标签
-        response = response.replace("#沉默#", "")
-    
-    # 开启AI，且不是自己发送的消息，则自动回复消息
-    if response.strip():
-        dify_msg_id = metadata.get("message_id")
-        try:
-            for response_part in re.split(r'\\n\\n|\n\n', response):
-                response_part = response_part.replace('\\n', '\n')
-                if response_part.strip().endswith('.png'):
-                    # 发送图片
-                    image_file_path = f"C:/Users/Administrator/Desktop/files/{response_part.strip()}"
-                    send_wx_image(wcf_ip=source_ip, image_path=image_file_path, receiver=room_id)
-                elif response_part.strip().endswith('.mp4'):
-                    # 发送视频
-                    image_file_path = f"C:/Users/Administrator/Desktop/files/{response_part.strip()}"
-                    send_wx_image(wcf_ip=source_ip, image_path=image_file_path, receiver=room_id)
-                else:
-                    # 发送文本
-                    send_wx_msg(wcf_ip=source_ip, message=response_part, receiver=room_id)
-            
-            # 删除缓存的消息
-            redis_handler.delete_msg_key(f'{wx_user_id}_{room_id}_msg_list')
 
-            # 删除缓存的在线图片信息
-            try:
-                Variable.delete(f"{wx_user_name}_{room_id}_online_img_info")
-            except Exception as e:
-                print(f"[WATCHER] 删除缓存的在线图片信息失败: {e}")
+    # 删除标签
+    response = strip_control_tags(response)
 
-            # response缓存到xcom中
-            context['task_instance'].xcom_push(key='ai_reply_msg', value=response)
+    if send_error:
+        # 记录消息回复失败
+        dify_agent.create_message_feedback(message_id=metadata.get("message_id"), user_id=dify_user_id, rating="dislike", content=f"微信自动回复失败, {send_error}")
+    elif sent_parts:
+        # 删除缓存的消息
+        redis_handler.delete_msg_key(f'{wx_user_id}_{room_id}_msg_list')
 
-        except Exception as error:
-            print(f"[WATCHER] 发送消息失败: {error}")
-            # 记录消息已被成功回复
-            dify_agent.create_message_feedback(message_id=dify_msg_id, user_id=dify_user_id, rating="dislike", content=f"微信自动回复失败, {error}")
+        # 删除缓存的在线图片信息
+        if online_img_info:
+            enqueue_side_effect('delete_variable', {'key': f"{wx_user_name}_{room_id}_online_img_info"})
+
+        # 保存AI回复到DB，交给后台执行
+        enqueue_ai_reply(message_data, wx_account_info, response)
+
+        # 写入回复缓存（转人工、沉默等带控制标签的回答不缓存）
+        if use_reply_cache and not has_control_tag:
+            reply_cache.set(question, response)
+
+        # response缓存到xcom中
+        context['task_instance'].xcom_push(key='ai_reply_msg', value=response)
@@ -14,10 +14,18 @@ from airflow.exceptions import AirflowException
 from airflow.models.variable import Variable
 
 # 自定义库导入
+from utils.audio_prep import prepare_audio
 from utils.dify_sdk import DifyAgent
+from utils.dify_sdk import get_room_conversation_id
+from utils.dify_sdk import save_room_conversation_id
+from utils.concurrency import prefetch
 from utils.wechat_channl import send_wx_msg
 from utils.redis import RedisHandler
 from wx_dags.common.wx_tools import get_contact_name
+from wx_dags.common.wx_tools import get_dify_api_key
+from wx_dags.common.rollup_tools import record_handoff
+from wx_dags.common.side_effects import enqueue_side_effect
+from wx_dags.common.side_effects import enqueue_ai_reply
 from wx_dags.common.wx_tools import download_voice_from_windows_server
 
 
@@ -46,32 +54,33 @@ def handler_voice_msg(**context):
     wx_user_name = wx_account_info['name']
     wx_user_id = wx_account_info['wxid']
 
-    # 1. 下载语音
-    voice_file_path = download_voice_from_windows_server(source_ip, msg_id)
+    # 1. 下载语音，同时读取联系人名称、Dify配置和会话ID（互相独立，并发执行）
+    def get_room_info():
+        # 会话ID按房间名称区分Dify用户，需要在获取房间名称之后读取
+        room_name = get_contact_name(source_ip, room_id, wx_user_name)
+        sender_name = get_contact_name(source_ip, sender, wx_user_name) or (wx_user_name if is_self else None)
+        dify_user_id = f"{wx_user_name}_{wx_user_id}_{room_name}"
+        return room_name, sender_name, dify_user_id, get_room_conversation_id(dify_user_id, room_id)
 
-    # 获取房间和发送者信息
-    room_name = get_contact_name(source_ip, room_id, wx_user_name)
-    sender_name = get_contact_name(source_ip, sender, wx_user_name) or (wx_user_name if is_self else None)
+    prefetched = prefetch({
+        "voice_file_path": lambda: download_voice_from_windows_server(source_ip, msg_id),
+        "room_info": get_room_info,
+        "dify_api_key": lambda: get_dify_api_key(wx_user_name, wx_user_id, is_group),
+        "dify_base_url": lambda: Variable.get("DIFY_BASE_URL"),
+    }, timeouts={"voice_file_path": 60})
+    voice_file_path = prefetched["voice_file_path"]
+    room_name, sender_name, dify_user_id, conversation_id = prefetched["room_info"]
 
     # 初始化dify
-    # 如果是群聊，先检查是否有群聊专用的API key
-    if is_group:
-        try:
-            dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_group_dify_api_key")
-        except:
-            dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
-    else:
-        dify_api_key = Variable.get(f"{wx_user_name}_{wx_user_id}_dify_api_key")
-        
-    dify_agent = DifyAgent(api_key=dify_api_key, base_url=Variable.get("DIFY_BASE_URL"))
-    
-    # 获取会话ID
-    dify_user_id = f"{wx_user_name}_{wx_user_id}_{room_name}"
-    conversation_id = dify_agent.get_conversation_id_for_room(dify_user_id, room_id)
+    dify_agent = DifyAgent(api_key=prefetched["dify_api_key"], base_url=prefetched["dify_base_url"])
 
     # 2. 语音转文字
     try:
-        transcribed_text = dify_agent.audio_to_text(voice_file_path)
+        # 预处理（解码、16kHz单声道、去掉首尾静音、压缩）后识别，相同语音直接使用缓存的识别结果
+        transcribed_text = dify_agent.audio_to_text_cached(
+            voice_file_path,
+            preprocess=lambda path: prepare_audio(path).path
+        )
         print(f"[WATCHER] 语音转文字结果: {transcribed_text}")
         
         if not transcribed_text.strip():
@@ -123,6 +132,13 @@ def handler_voice_msg(**context):
         human_room_ids.append(room_id)
         human_room_ids = list(set(human_room_ids))  # 去重
         Variable.set(f"{wx_user_name}_{wx_user_id}_human_room_ids", human_room_ids, serialize_json=True)
+
+        try:
+            # 转人工次数计入数据大屏的小时汇总
+            record_handoff(wx_user_id, room_id)
+        except Exception as error:
+            # 不影响主流程
+            print(f"[WATCHER] 记录转人工次数失败: {error}")
         
         # 删除缓存的消息
         redis_handler.delete_msg_key(f'{wx_user_id}_{room_id}_msg_list')
@@ -136,18 +152,21 @@ def handler_voice_msg(**context):
         response = response.replace("#沉默#", "")
     
     # 处理会话ID相关逻辑
-    if not conversation_id:
-        print(f"[WATCHER] 会话ID不存在，创建新会话")
-        # 新会话，重命名会话
+    if metadata.get("conversation_id") and metadata.get("conversation_id") != conversation_id:
+        print(f"[WATCHER] 会话ID不存在或已失效，创建新会话")
+        # 新会话，保存会话ID
         conversation_id = metadata.get("conversation_id")
-        # 获取房间和发送者信息
-        room_name = get_contact_name(source_ip, room_id, wx_user_name)
-        dify_agent.rename_conversation(conversation_id, dify_user_id, room_name)
+        save_room_conversation_id(dify_user_id, room_id, conversation_id)
 
-        # 保存会话ID
-        conversation_infos = Variable.get(f"{dify_user_id}_conversation_infos", default_var={}, deserialize_json=True)
-        conversation_infos[room_id] = conversation_id
-        Variable.set(f"{dify_user_id}_conversation_infos", conversation_infos, serialize_json=True)
+        # 重命名会话不影响回复，交给后台执行
+        enqueue_side_effect('rename_conversation', {
+            'wx_user_name': wx_user_name,
+            'wx_user_id': wx_user_id,
+            'is_group': is_group,
+            'conversation_id': conversation_id,
+            'dify_user_id': dify_user_id,
+            'name': room_name,
+        })
     else:
         print(f"[WATCHER] 会话ID已存在: {conversation_id}")
     
@@ -156,5 +175,8 @@ def handler_voice_msg(**context):
         response_part = response_part.replace('\\n', '\n')
         send_wx_msg(wcf_ip=source_ip, message=response_part, receiver=room_id)
 
+    # 保存AI回复到DB，交给后台执行
+    enqueue_ai_reply(message_data, wx_account_info, response)
+
     # 将转写文本和回复保存到xcom中
     context['task_instance'].xcom_push(key='ai_reply_msg', value=response)
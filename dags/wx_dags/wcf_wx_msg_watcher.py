@@ -18,12 +18,10 @@ import json
 import os
 import re
 import time
-import uuid
 from datetime import datetime, timedelta
 
 # Airflow相关导入
 from airflow import DAG
-from airflow.models.variable import Variable
 from airflow.operators.python import BranchPythonOperator, PythonOperator
 
 # 自定义库导入
@@ -31,7 +29,11 @@ from wx_dags.common.wx_tools import WX_MSG_TYPES
 from wx_dags.common.wx_tools import update_wx_user_info
 from wx_dags.common.wx_tools import get_contact_name
 from wx_dags.common.wx_tools import check_ai_enable
+from wx_dags.common.wx_tools import publish_wx_event
 from wx_dags.common.mysql_tools import save_data_to_db
+from wx_dags.common.side_effects import enqueue_side_effect
+from utils.dify_sdk import clear_room_conversation_id
+from wx_dags.common.reply_cache import invalidate_reply_cache
 from utils.wechat_channl import send_wx_msg
 from utils.redis import RedisHandler
 
@@ -66,16 +68,21 @@ def check_admin_command(message_data, wx_account_info):
         # 获取会话ID
         dify_user_id = f"{wx_user_name}_{wx_user_id}_{room_name}"
 
-        # 从本地存储中移除该映射关系
-        conversation_infos = Variable.get(f"{dify_user_id}_conversation_infos", default_var={}, deserialize_json=True)
-        if room_id in conversation_infos:
-            del conversation_infos[room_id]
-            Variable.set(f"{dify_user_id}_conversation_infos", conversation_infos, serialize_json=True)
+        # 从缓存中移除该映射关系
+        clear_room_conversation_id(dify_user_id, room_id)
         print(f"已清除用户 {dify_user_id} 在房间 {room_id} 的会话记录")
         
         # 发送消息给管理员
         send_wx_msg(wcf_ip=source_ip, message=f"😊", receiver=sender)
 
+        return True
+    elif content.lower().endswith('clearcache'):
+        # 智能体配置修改后，清除账号的回复缓存
+        invalidate_reply_cache(wx_account_info['name'], wx_account_info['wxid'])
+
+        # 发送消息给管理员
+        send_wx_msg(wcf_ip=source_ip, message=f"😊", receiver=sender)
+
         return True
     else:
         return False
@@ -130,10 +137,21 @@ def process_wx_message(**context):
     # 将微信账号信息传递到xcom中供后续任务使用
     context['task_instance'].xcom_push(key='wx_account_info', value=wx_account_info)
 
-    # 账号的消息计时器+1
+    # 推送新消息事件到前端
+    publish_wx_event('message', wx_user_id, {
+        'msg_id': msg_id,
+        'room_id': room_id,
+        'sender_id': sender,
+        'msg_type': msg_type,
+        'content': content,
+        'is_self': is_self,
+        'is_group': is_group,
+        'msg_timestamp': current_msg_timestamp,
+    })
+
+    # 账号的消息计时器+1，交给后台执行
     try:
-        msg_count = Variable.get(f"{wx_user_name}_msg_count", default_var=0, deserialize_json=True)
-        Variable.set(f"{wx_user_name}_msg_count", msg_count+1, serialize_json=True)
+        enqueue_side_effect('incr_msg_count', {'wx_user_name': wx_user_name})
     except Exception as error:
         print(f"[WATCHER] 更新消息计时器失败: {error}")
 
@@ -314,55 +332,6 @@ def save_msg_to_db(**context):
     save_data_to_db(save_msg)
 
 
-def save_ai_reply_msg_to_db(**context):
-    """
-    保存AI回复的消息到DB
-    """
-    # 获取传入的消息数据
-    message_data = context.get('dag_run').conf      
-    
-    # 获取AI回复的消息
-    ai_reply_msg = context.get('task_instance').xcom_pull(key='ai_reply_msg')
-
-    if not ai_reply_msg:
-        print("[WATCHER] 没有收到AI回复的消息")
-        return
-
-    wx_account_info = context.get('task_instance').xcom_pull(key='wx_account_info')
-
-    # 提取消息信息
-    save_msg = {}
-    save_msg['room_id'] = message_data.get('roomid', '')
-    save_msg['sender_id'] = wx_account_info.get('wxid', '')
-    save_msg['msg_id'] = str(uuid.uuid4())
-    save_msg['msg_type'] = 1  # 消息类型
-    save_msg['msg_type_name'] = WX_MSG_TYPES.get(save_msg['msg_type'], '文本')
-    save_msg['content'] = ai_reply_msg
-    save_msg['is_self'] = True  # 是否自己发送的消息
-    save_msg['is_group'] = message_data.get('is_group', False)  # 是否群聊
-    save_msg['msg_timestamp'] = int(datetime.now().timestamp())
-    save_msg['msg_datetime'] = datetime.now()
-    save_msg['source_ip'] = message_data.get('source_ip', '')
-    save_msg['wx_user_name'] = wx_account_info.get('name', '')
-    save_msg['wx_user_id'] = wx_account_info.get('wxid', '')
-
-    # 获取房间和发送者信息
-    room_name = get_contact_name(save_msg['source_ip'], save_msg['room_id'], save_msg['wx_user_name'])
-    save_msg['room_name'] = room_name
-    save_msg['sender_name'] = save_msg['wx_user_name']
-
-    # 保存消息到DB
-    save_data_to_db(save_msg)
-
-    try:
-        # 账号的消息计时器+1
-        msg_count = Variable.get(f"{wx_account_info['name']}_msg_count", default_var=0, deserialize_json=True)
-        Variable.set(f"{wx_account_info['name']}_msg_count", msg_count+1, serialize_json=True)
-    except Exception as error:
-        # 不影响主流程
-        print(f"[WATCHER] 更新消息计时器失败: {error}")
-
-
 # 创建DAG
 dag = DAG(
     dag_id=DAG_ID,
@@ -416,14 +385,6 @@ save_message_task = PythonOperator(
     dag=dag
 )
 
-# 保存AI回复的消息到数据库
-save_ai_reply_msg_task = PythonOperator(
-    task_id='save_ai_reply_msg_to_db',
-    python_callable=save_ai_reply_msg_to_db,
-    provide_context=True,
-    dag=dag
-)
-
 # 保存图片消息到数据库
 save_image_to_db_task = PythonOperator(
     task_id='save_image_to_db',
@@ -440,19 +401,11 @@ save_voice_to_db_task = PythonOperator(
     dag=dag
 )
 
-# 保存语音消息到数据库
-save_ai_reply_msg_task_for_voice = PythonOperator(
-    task_id='save_ai_reply_msg_to_db_for_voice',
-    python_callable=save_ai_reply_msg_to_db,
-    provide_context=True,
-    dag=dag
-)
-
 # 设置任务依赖关系
 process_message_task >> [handler_text_msg_task, handler_image_msg_task, handler_voice_msg_task, save_message_task]
 
-handler_text_msg_task >> save_ai_reply_msg_task  # 因为消息文本不需要处理，前面的任务先保存了
-
 handler_image_msg_task >> save_image_to_db_task  # 图片消息不会进行单独AI回复
 
-handler_voice_msg_task >> [save_voice_to_db_task, save_ai_reply_msg_task_for_voice]  
+handler_voice_msg_task >> save_voice_to_db_task
+
+# AI回复由消息处理任务写入后台副作用队列，wx_side_effect_worker 负责保存到数据库  
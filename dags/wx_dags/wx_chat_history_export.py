@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录导出
+
+使用服务端游标流式读取聊天室的全部聊天记录，分块写入gzip压缩的NDJSON或CSV文件。
+内存占用与聊天室大小无关，中断后重新触发会从上次写入的位置继续导出。
+"""
+
+# 标准库导入
+from datetime import datetime
+import csv
+import gzip
+import io
+import json
+import os
+import re
+
+# Airflow相关导入
+from airflow import DAG
+from airflow.models.variable import Variable
+from airflow.operators.python import PythonOperator
+
+# 自定义库导入
+from wx_dags.common.mysql_tools import iter_wx_chat_records
+
+
+DAG_ID = "wx_chat_history_export"
+
+# 支持的导出格式
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# 每个分块的记录数，每写完一块落盘并更新断点
+EXPORT_CHUNK_SIZE = 5000
+
+
+def safe_filename_part(value: str) -> str:
+    """
+    把id中文件名不允许的字符（路径分隔符、..等）替换为下划线，防止导出文件写到导出目录之外
+    """
+    return re.sub(r'[^\w@.-]', '_', str(value)).strip('.') or '_'
+
+
+def load_export_state(state_path: str) -> dict:
+    """
+    读取导出断点，不存在时返回初始状态
+    """
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'last_id': 0, 'row_count': 0, 'file_size': 0, 'finished': False}
+
+
+def save_export_state(state_path: str, state: dict):
+    """
+    原子地写入导出断点，避免写入过程中中断导致断点文件损坏
+    """
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def encode_chunk(rows: list, export_format: str, columns: list, write_header: bool) -> bytes:
+    """
+    将一个分块的记录编码为NDJSON或CSV文本
+    """
+    if export_format == 'ndjson':
+        return ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    if write_header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def write_chunk(export_path: str, state_path: str, state: dict, rows: list, export_format: str):
+    """
+    以独立gzip成员的方式追加写入一个分块，写完后更新断点
+
+    多个gzip成员首尾相接仍是合法的gzip文件，gunzip/zcat可以直接解压
+    """
+    columns = state.setdefault('columns', list(rows[0].keys()))
+    data = encode_chunk(rows, export_format, columns, write_header=state['row_count'] == 0)
+
+    with open(export_path, 'ab') as f:
+        f.write(gzip.compress(data))
+        f.flush()
+        os.fsync(f.fileno())
+        state['file_size'] = f.tell()
+
+    state['last_id'] = rows[-1]['id']
+    state['row_count'] += len(rows)
+    save_export_state(state_path, state)
+    print(f"已导出 {state['row_count']} 条记录, last_id: {state['last_id']}")
+
+
+def export_chat_history(**context):
+    """
+    导出聊天记录
+    """
+    # 获取输入参数
+    input_data = context.get('dag_run').conf or {}
+    print(f"输入数据: {input_data}")
+
+    room_id = input_data.get('room_id')
+    wx_user_id = input_data.get('wx_user_id')
+    export_format = input_data.get('format', 'ndjson')
+
+    if not room_id:
+        raise ValueError("缺少必填参数: room_id")
+    if not wx_user_id:
+        raise ValueError("缺少必填参数: wx_user_id")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {export_format}, 可选: {EXPORT_FORMATS}")
+
+    # 导出目录
+    export_dir = os.path.realpath(Variable.get("WX_EXPORT_DIR", default_var="/tmp/wx_chat_exports"))
+    os.makedirs(export_dir, exist_ok=True)
+    export_path = os.path.join(export_dir, f"{safe_filename_part(wx_user_id)}_{safe_filename_part(room_id)}.{export_format}.gz")
+    if os.path.dirname(os.path.realpath(export_path)) != export_dir:
+        raise ValueError(f"导出路径不在导出目录中: {export_path}")
+    state_path = f"{export_path}.state.json"
+
+    # 读取断点，重新导出时删除旧文件
+    if input_data.get('restart'):
+        for path in (export_path, state_path):
+            if os.path.exists(path):
+                os.remove(path)
+    state = load_export_state(state_path)
+    if state.get('format', export_format) != export_format:
+        raise ValueError(f"已存在 {state['format']} 格式的导出断点，请使用 restart=true 重新导出")
+    state['format'] = export_format
+
+    # 截断到断点记录的文件大小，丢弃上次中断时写了一半或未记录断点的分块
+    if os.path.exists(export_path) and os.path.getsize(export_path) != state['file_size']:
+        print(f"导出文件大小与断点不一致，截断到 {state['file_size']} 字节")
+        with open(export_path, 'r+b') as f:
+            f.truncate(state['file_size'])
+
+    print(f"开始导出: {export_path}, 从id {state['last_id']} 之后继续, 已导出 {state['row_count']} 条")
+
+    # 流式读取并分块写入
+    chunk = []
+    for row in iter_wx_chat_records(room_id=room_id, wx_user_id=wx_user_id, after_id=state['last_id']):
+        chunk.append(row)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            write_chunk(export_path, state_path, state, chunk, export_format)
+            chunk = []
+    if chunk:
+        write_chunk(export_path, state_path, state, chunk, export_format)
+
+    state['finished'] = True
+    state['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    save_export_state(state_path, state)
+
+    print(f"导出完成: {export_path}, 共 {state['row_count']} 条记录")
+    return {
+        'export_path': export_path,
+        'format': export_format,
+        'row_count': state['row_count'],
+        'last_id': state['last_id']
+    }
+
+
+# 创建DAG
+dag = DAG(
+    dag_id=DAG_ID,
+    default_args={'owner': 'claude89757'},
+    start_date=datetime(2024, 1, 1),
+    schedule_interval=None,
+    catchup=False,
+    max_active_runs=1,
+    tags=['个人微信'],
+    description='聊天记录导出'
+)
+
+# 为DAG添加文档说明
+dag.doc_md = """
+## 聊天记录导出DAG
+
+此DAG用于导出微信聊天室的全部聊天记录，输出gzip压缩的NDJSON或CSV文件。
+
+### 如何使用:
+1. 点击"Trigger DAG"按钮
+2. 选择"Trigger DAG w/ config"
+3. 在配置框中输入JSON格式的参数:
+```json
+{
+  "room_id": "你的微信会话ID",
+  "wx_user_id": "你的微信用户ID",
+  "format": "ndjson"
+}
+```
+
+### 参数:
+- `room_id`: 微信会话ID（必填）
+- `wx_user_id`: 微信用户ID（必填）
+- `format`: 导出格式，`ndjson`（默认）或 `csv`
+- `restart`: 为true时删除已有的导出文件和断点，从头导出
+
+### 输出:
+- 导出文件: `{WX_EXPORT_DIR}/{wx_user_id}_{room_id}.{format}.gz`
+- 断点文件: 导出文件名加 `.state.json`，任务中断后重新触发会从断点继续
+"""
+
+# 创建导出任务
+export_chat_history_task = PythonOperator(
+    task_id='export_chat_history',
+    python_callable=export_chat_history,
+    provide_context=True,
+    dag=dag
+)
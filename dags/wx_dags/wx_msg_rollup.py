@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天数据小时级汇总
+
+定时从水位之后增量汇总新写入的聊天记录到 wx_msg_hourly_rollup，供数据大屏查询
+"""
+
+# 标准库导入
+from datetime import datetime, timedelta
+
+# Airflow相关导入
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+
+# 自定义库导入
+from wx_dags.common.rollup_tools import init_rollup_tables
+from wx_dags.common.rollup_tools import rollup_new_messages
+
+
+DAG_ID = "wx_msg_rollup"
+
+
+def rollup_chat_records(**context):
+    """
+    增量汇总聊天记录
+    """
+    # 建表语句幂等，首次运行时自动创建汇总表和水位表
+    init_rollup_tables()
+
+    result = rollup_new_messages()
+    print(f"汇总完成: {result}")
+    return result
+
+
+# 创建DAG
+dag = DAG(
+    dag_id=DAG_ID,
+    default_args={'owner': 'claude89757'},
+    start_date=datetime(2024, 1, 1),
+    schedule_interval=timedelta(minutes=1),
+    dagrun_timeout=timedelta(minutes=5),
+    catchup=False,
+    max_active_runs=1,
+    tags=['个人微信'],
+    description='聊天数据小时级汇总'
+)
+
+# 创建汇总任务
+rollup_chat_records_task = PythonOperator(
+    task_id='rollup_chat_records',
+    python_callable=rollup_chat_records,
+    provide_context=True,
+    dag=dag
+)
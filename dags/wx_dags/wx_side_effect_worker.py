@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台副作用队列执行DAG
+
+每分钟启动一次，持续从 wx_side_effect_queue 读取消息处理流程写入的收尾任务并执行，
+失败的任务按退避时间重试，超过重试次数后写入死信队列 wx_side_effect_dead_letter
+"""
+
+# 标准库导入
+from datetime import datetime, timedelta
+
+# Airflow相关导入
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+
+# 自定义库导入
+from wx_dags.common.side_effects import run_side_effect_worker
+
+
+DAG_ID = "wx_side_effect_worker"
+
+
+def process_side_effects(**context):
+    """
+    执行后台副作用任务，运行约55秒后退出，由下一次调度接续
+    """
+    stats = run_side_effect_worker(max_seconds=55)
+    print(f"执行完成: {stats}")
+    return stats
+
+
+# 创建DAG
+dag = DAG(
+    dag_id=DAG_ID,
+    default_args={'owner': 'claude89757'},
+    start_date=datetime(2024, 1, 1),
+    schedule_interval=timedelta(minutes=1),
+    dagrun_timeout=timedelta(minutes=5),
+    catchup=False,
+    # 同时只运行一个实例，启动时才能安全地恢复上次未完成的任务
+    max_active_runs=1,
+    tags=['个人微信'],
+    description='后台副作用队列执行'
+)
+
+# 创建执行任务
+process_side_effects_task = PythonOperator(
+    task_id='process_side_effects',
+    python_callable=process_side_effects,
+    provide_context=True,
+    dag=dag
+)
@@ -24,7 +24,7 @@ from airflow.operators.python import PythonOperator
 from airflow.models.variable import Variable
 
 # 自定义库导入
-from utils.wechat_mp_channl import WeChatMPBot
+from utils.wechat_mp_token import create_mp_bot
 
 
 DAG_ID = "wx_mp_msg_sender"
@@ -48,7 +48,7 @@ def send_wx_mp_msg(**context):
     app_secret = Variable.get('WX_MP_SECRET')
 
     # 创建微信机器人实例
-    wx_mp_bot = WeChatMPBot(appid=app_id, appsecret=app_secret)
+    wx_mp_bot = create_mp_bot(appid=app_id, appsecret=app_secret)
     
     # 获取access_token
     wx_mp_bot.get_access_token()
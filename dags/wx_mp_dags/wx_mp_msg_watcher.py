@@ -23,7 +23,6 @@ from threading import Thread
 
 # 第三方库导入
 import requests
-from pydub import AudioSegment
 
 # Airflow相关导入
 from airflow import DAG
@@ -39,8 +38,11 @@ from airflow.utils.state import DagRunState
 
 # 自定义库导入
 from utils.dify_sdk import DifyAgent
-from utils.wechat_mp_channl import WeChatMPBot
-from utils.tts import text_to_speech
+from utils.dify_sdk import save_user_conversation_id
+from utils.audio_prep import prepare_audio
+from utils.wechat_mp_token import create_mp_bot
+from utils.wechat_mp_profile import MPProfileCache
+from utils.mp_voice_reply import send_voice_reply
 from utils.redis import RedisHandler
 
 
@@ -81,8 +83,10 @@ def process_wx_message(**context):
     print("--------------------------------")
 
     # 获取用户信息(注意，微信公众号并未提供详细的用户消息）
-    mp_bot = WeChatMPBot(appid=Variable.get("WX_MP_APP_ID"), appsecret=Variable.get("WX_MP_SECRET"))
-    user_info = mp_bot.get_user_info(message_data.get('FromUserName'))
+    # 优先读取Redis中缓存的用户资料，未命中时才调用接口（缓存由 wx_mp_profile_refresh 定时批量刷新）
+    appid = Variable.get("WX_MP_APP_ID")
+    mp_bot = create_mp_bot(appid=appid, appsecret=Variable.get("WX_MP_SECRET"))
+    user_info = MPProfileCache(appid).get_or_fetch(message_data.get('FromUserName'), mp_bot)
     print(f"FromUserName: {message_data.get('FromUserName')}, 用户信息: {user_info}")
     # user_info = mp_bot.get_user_info(message_data.get('ToUserName'))
     # print(f"ToUserName: {message_data.get('ToUserName')}, 用户信息: {user_info}")
@@ -117,7 +121,7 @@ def handler_text_msg(**context):
     msg_id = message_data.get('MsgId')  # 消息ID
     
     print(f"收到来自 {from_user_name} 的消息: {content}")
-    
+
     # 获取微信公众号配置和初始化客户端
     appid = Variable.get("WX_MP_APP_ID", default_var="")
     appsecret = Variable.get("WX_MP_SECRET", default_var="")
@@ -130,7 +134,7 @@ def handler_text_msg(**context):
     redis_handler = RedisHandler()
 
     # 初始化微信公众号机器人
-    mp_bot = WeChatMPBot(appid=appid, appsecret=appsecret)
+    mp_bot = create_mp_bot(appid=appid, appsecret=appsecret)
     
     # 初始化dify
     dify_api_key = Variable.get("WX_MP_DIFY_API_KEYS", default_var={}, deserialize_json=True)[appid]
@@ -147,11 +151,31 @@ def handler_text_msg(**context):
     # 缩短等待时间到3秒，给更多消息合并的机会
     time.sleep(5)
 
+    # webhook只在5秒截止前返回被动回复时才写入标记，合并等待之后标记一定已写入；
+    # 在提前停止检查之前取出并删除标记（提前停止的运行也不会遗留标记），并把本条消息移出待回复列表，之后的运行不会重复回复
+    msg_list_key = f'{from_user_name}_{to_user_name}_msg_list'
+    current_message = message_data
+    passive_reply_key = f"mp_passive_reply_{msg_id}"
+    passive_reply = Variable.get(passive_reply_key, default_var=None)
+    if passive_reply:
+        Variable.delete(passive_reply_key)
+        room_msg_list = redis_handler.get_msg_list(msg_list_key)
+        redis_handler.client.lrem(msg_list_key, 0, json.dumps(message_data, ensure_ascii=False))
+        pending_msgs = [msg for msg in room_msg_list if msg.get('MsgId') != msg_id]
+        if not pending_msgs or room_msg_list[-1].get('MsgId') != msg_id:
+            # 没有其他待回复的消息，或者有更新的消息（由其对应的运行合并回复）
+            print(f"[WATCHER] 已被动回复，跳过异步回复: {passive_reply}")
+            context['task_instance'].xcom_push(key='ai_reply_msg', value=passive_reply)
+            return
+        # 之前的消息因为本条消息而提前停止，由本次运行继续回复
+        print(f"[WATCHER] 本条消息已被动回复，继续回复之前未回复的 {len(pending_msgs)} 条消息")
+        current_message = pending_msgs[-1]
+
     # 重新获取消息列表前先检查是否需要提前停止
-    should_pre_stop(message_data, from_user_name, to_user_name)
+    should_pre_stop(current_message, from_user_name, to_user_name)
     
     # 读取消息列表
-    room_msg_list = redis_handler.get_msg_list(f'{from_user_name}_{to_user_name}_msg_list')
+    room_msg_list = redis_handler.get_msg_list(msg_list_key)
     
     # 整合未回复的消息
     # 获取最近5条消息内容并合并
@@ -187,7 +211,7 @@ def handler_text_msg(**context):
     #     print("[WATCHER] 没有发现图片信息")
 
     # 在发送到Dify之前再次检查是否需要提前停止
-    should_pre_stop(message_data, from_user_name, to_user_name)
+    should_pre_stop(current_message, from_user_name, to_user_name)
 
     # 获取AI回复
     full_answer, metadata = dify_agent.create_chat_message_stream(
@@ -199,8 +223,8 @@ def handler_text_msg(**context):
     print(f"metadata: {metadata}")
     response = full_answer
 
-    if not conversation_id:
-        # 新会话，重命名会话
+    if metadata.get("conversation_id") and metadata.get("conversation_id") != conversation_id:
+        # 新会话（或缓存的会话已失效），重命名会话
         try:
             conversation_id = metadata.get("conversation_id")
             dify_agent.rename_conversation(conversation_id, f"微信公众号用户_{from_user_name[:8]}", "公众号对话")
@@ -208,9 +232,7 @@ def handler_text_msg(**context):
             print(f"[WATCHER] 重命名会话失败: {e}")
         
         # 保存会话ID
-        conversation_infos = Variable.get("wechat_mp_conversation_infos", default_var={}, deserialize_json=True)
-        conversation_infos[from_user_name] = conversation_id
-        Variable.set("wechat_mp_conversation_infos", conversation_infos, serialize_json=True)
+        save_user_conversation_id(from_user_name, conversation_id)
 
     # 发送回复消息时的智能处理
     for response_part in re.split(r'\\n\\n|\n\n', response):
@@ -471,7 +493,7 @@ def handler_image_msg(**context):
         return
     
     # 初始化微信公众号机器人
-    mp_bot = WeChatMPBot(appid=appid, appsecret=appsecret)
+    mp_bot = create_mp_bot(appid=appid, appsecret=appsecret)
     
     # 初始化redis
     redis_handler = RedisHandler()
@@ -529,7 +551,7 @@ def handler_voice_msg(**context):
         return
     
     # 初始化微信公众号机器人
-    mp_bot = WeChatMPBot(appid=appid, appsecret=appsecret)
+    mp_bot = create_mp_bot(appid=appid, appsecret=appsecret)
     
     # 初始化dify
     dify_api_key = Variable.get("WX_MP_DIFY_API_KEYS", default_var={}, deserialize_json=True)[appid]
@@ -558,23 +580,11 @@ def handler_voice_msg(**context):
         
         # 2. 语音转文字
         try:
-            # 转换音频格式 - 如果是AMR格式，转换为WAV格式
-            converted_file_path = None
-            if format_type.lower() == 'amr':                
-                # 创建转换后的文件路径
-                converted_file_path = os.path.join(temp_dir, f"wx_voice_{from_user_name}_{timestamp}.wav")
-                
-                # 进行格式转换
-                print(f"[WATCHER] 正在将AMR格式转换为WAV格式...")
-                sound = AudioSegment.from_file(voice_file_path, format="amr")
-                sound.export(converted_file_path, format="wav")
-                print(f"[WATCHER] 音频格式转换成功，WAV文件保存在: {converted_file_path}")
-                
-            # 使用可能转换过的文件路径进行语音转文字
-            file_to_use = converted_file_path if converted_file_path else voice_file_path
-            print(f"[WATCHER] 用于语音转文字的文件: {file_to_use}")
-            
-            transcribed_text = dify_agent.audio_to_text(file_to_use)
+            # 预处理（解码、16kHz单声道、去掉首尾静音、压缩）后识别，相同语音直接使用缓存的识别结果
+            transcribed_text = dify_agent.audio_to_text_cached(
+                voice_file_path,
+                preprocess=lambda path: prepare_audio(path, source_format=format_type.lower()).path
+            )
             print(f"[WATCHER] 语音转文字结果: {transcribed_text}")
             
             if not transcribed_text.strip():
@@ -602,8 +612,8 @@ def handler_voice_msg(**context):
         response = full_answer
         
         # 处理会话ID相关逻辑
-        if not conversation_id:
-            # 新会话，重命名会话
+        if metadata.get("conversation_id") and metadata.get("conversation_id") != conversation_id:
+            # 新会话（或缓存的会话已失效），重命名会话
             try:
                 conversation_id = metadata.get("conversation_id")
                 dify_agent.rename_conversation(conversation_id, f"微信公众号用户_{from_user_name[:8]}", "公众号语音对话")
@@ -611,43 +621,14 @@ def handler_voice_msg(**context):
                 print(f"[WATCHER] 重命名会话失败: {e}")
             
             # 保存会话ID
-            conversation_infos = Variable.get("wechat_mp_conversation_infos", default_var={}, deserialize_json=True)
-            conversation_infos[from_user_name] = conversation_id
-            Variable.set("wechat_mp_conversation_infos", conversation_infos, serialize_json=True)
+            save_user_conversation_id(from_user_name, conversation_id)
         
-        # 4. 使用阿里云的文字转语音功能
-        audio_response_path = os.path.join(temp_dir, f"wx_audio_response_{from_user_name}_{timestamp}.mp3")
-        try:
-            # 调用阿里云的TTS服务 - 直接生成MP3格式
-            success, _ = text_to_speech(
-                text=response, 
-                output_path=audio_response_path, 
-                model="cosyvoice-v2", 
-                voice="longxiaoxia_v2"
-            )
-            
-            if not success:
-                raise Exception("文字转语音失败")
-                
-            print(f"[WATCHER] 文字转语音成功，保存到: {audio_response_path}")
-            
-            # 5. 上传语音文件到微信获取media_id
-            upload_result = mp_bot.upload_temporary_media("voice", audio_response_path)
-            response_media_id = upload_result.get('media_id')
-            print(f"[WATCHER] 语音文件上传成功，media_id: {response_media_id}")
-            
-            # 6. 发送语音回复
-            mp_bot.send_voice_message(from_user_name, response_media_id)
-            print(f"[WATCHER] 语音回复发送成功")
-            
-            # 语音回复成功，不需要发送文字回复
-            send_text_response = False
-                
-        except Exception as e:
-            print(f"[WATCHER] 语音回复失败: {e}")
-            send_text_response = True
+        # 4. 语音回复: 分段在内存中合成、并发上传，按顺序发送（某一段失败时剩余段落改为文字）
+        voice_sent, text_sent = send_voice_reply(mp_bot, from_user_name, response,
+                                                 model="cosyvoice-v2", voice="longxiaoxia_v2")
         
-        # 只有在语音回复失败时才发送文字回复
+        # 只有在没有发出任何内容时才整段发送文字回复，避免重复发送
+        send_text_response = voice_sent == 0 and text_sent == 0
         if send_text_response:
             try:
                 # 将长回复拆分成多条消息发送
@@ -655,7 +636,6 @@ def handler_voice_msg(**context):
                     response_part = response_part.replace('\\n', '\n')
                     if response_part.strip():  # 确保不发送空消息
                         mp_bot.send_text_message(from_user_name, response_part)
-                        time.sleep(0.5)  # 避免发送过快
                         
                 print(f"[WATCHER] 文字回复发送成功")
             except Exception as text_error:
@@ -684,10 +664,6 @@ def handler_voice_msg(**context):
             temp_files = []
             if 'voice_file_path' in locals() and voice_file_path:
                 temp_files.append(voice_file_path)
-            if 'audio_response_path' in locals() and audio_response_path:
-                temp_files.append(audio_response_path)
-            if 'converted_file_path' in locals() and converted_file_path:
-                temp_files.append(converted_file_path)
             
             # 删除所有临时文件
             for file_path in temp_files:
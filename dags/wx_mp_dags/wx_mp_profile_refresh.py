@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+微信公众号用户资料刷新DAG
+
+功能：
+1. 删除7天内没有发消息的用户的资料
+2. 找出最近活跃、且缓存超过1天的用户资料
+3. 通过 user/info/batchget 批量刷新（每次100个用户），删除已取消关注的用户
+
+特点：
+1. 每6小时执行一次
+2. 最大并发运行数为1
+3. 消息处理时只读取缓存（见 utils.wechat_mp_profile），不再逐条调用 user/info
+"""
+
+# 标准库导入
+from datetime import datetime, timedelta
+
+# Airflow相关导入
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+from airflow.models.variable import Variable
+
+# 自定义库导入
+from utils.wechat_mp_profile import MPProfileCache
+from utils.wechat_mp_token import create_mp_bot
+
+
+DAG_ID = "wx_mp_profile_refresh"
+
+
+def refresh_mp_profiles(**context):
+    """
+    批量刷新最近活跃用户即将过期的资料，删除不活跃用户的资料
+    """
+    appid = Variable.get("WX_MP_APP_ID")
+    profile_cache = MPProfileCache(appid)
+    evicted = profile_cache.evict_inactive()
+    openids = profile_cache.stale_openids()
+    print(f"[PROFILE_REFRESH] 删除不活跃用户: {evicted}, 需要刷新的用户数: {len(openids)}")
+    if not openids:
+        return {'evicted': evicted, 'refreshed': 0, 'unsubscribed': 0}
+
+    mp_bot = create_mp_bot(appid=appid, appsecret=Variable.get("WX_MP_SECRET"))
+    refreshed, unsubscribed = profile_cache.refresh(mp_bot, openids)
+    return {'evicted': evicted, 'refreshed': refreshed, 'unsubscribed': unsubscribed}
+
+
+# 创建DAG
+dag = DAG(
+    dag_id=DAG_ID,
+    default_args={'owner': 'claude89757'},
+    start_date=datetime(2024, 1, 1),
+    schedule_interval=timedelta(hours=6),
+    max_active_runs=1,
+    dagrun_timeout=timedelta(minutes=30),
+    catchup=False,
+    tags=['微信公众号'],
+    description='微信公众号用户资料批量刷新',
+)
+
+# 创建刷新用户资料的任务
+refresh_profiles_task = PythonOperator(
+    task_id='refresh_mp_profiles',
+    python_callable=refresh_mp_profiles,
+    provide_context=True,
+    dag=dag
+)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Message Push Server using FastAPI (SSE)
+=======================================
+
+功能：
+1. 通过 Server-Sent Events 把微信账号的新消息、AI回复实时推送给前端
+2. 支持断线重连后从上次收到的事件继续推送（Last-Event-ID）
+
+数据来源：
+- Airflow 的 wcf_wx_msg_watcher 在收到消息、保存AI回复时，把事件写入 Redis Stream `{wx_user_id}_events`
+- 本服务使用 XREAD BLOCK 读取 Stream，事件ID即 SSE 的 id，浏览器重连时会自动带上 Last-Event-ID 请求头
+
+前端使用示例：
+   const source = new EventSource(`/events/${wxUserId}?token=xxx`);
+   source.addEventListener('message', e => console.log(JSON.parse(e.data)));
+   source.addEventListener('ai_reply', e => console.log(JSON.parse(e.data)));
+
+使用方法：
+1. 创建 .env 文件并配置环境变量:
+   REDIS_HOST=<Redis地址>
+   REDIS_PORT=<Redis端口，默认6379>
+   REDIS_PASSWORD=<Redis密码，可选>
+   REDIS_DB=<Redis库，默认0>
+   PUSH_TOKEN=<前端连接时需要携带的token，必填，未配置时服务拒绝启动>
+
+2. 运行服务器（SSE为长连接，使用异步worker）:
+   uvicorn push_server:app --host 0.0.0.0 --port 5001 --workers 2
+"""
+
+import os
+import hmac
+import json
+import logging
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+import redis.asyncio as aioredis
+from fastapi import FastAPI, Request, Header, Query, status
+from fastapi.responses import StreamingResponse, JSONResponse
+from dotenv import load_dotenv
+
+# =====================
+# Configuration
+# =====================
+
+load_dotenv()
+
+REDIS_HOST = os.environ.get("REDIS_HOST", "127.0.0.1")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD") or None
+REDIS_DB = int(os.environ.get("REDIS_DB", 0))
+PUSH_TOKEN = os.environ.get("PUSH_TOKEN", "")
+
+# 事件流包含账号的全部聊天内容，未配置token时拒绝启动
+if not PUSH_TOKEN:
+    raise RuntimeError("未配置PUSH_TOKEN，推送服务拒绝启动")
+
+# XREAD 单次阻塞的毫秒数，超时后发送心跳，避免代理因空闲断开连接
+BLOCK_MS = 15000
+
+# 单次最多读取的事件数
+READ_COUNT = 100
+
+# 浏览器断线后的重连间隔（毫秒）
+RETRY_MS = 3000
+
+# =====================
+# Logging Configuration
+# =====================
+
+def setup_logging():
+    logger = logging.getLogger("push_server")
+    logger.setLevel(logging.INFO)
+
+    # 将日志输出到标准输出，这样可以通过docker logs查看
+    handler = logging.StreamHandler()
+    formatter = logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+    )
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    return logger
+
+logger = setup_logging()
+
+# =====================
+# FastAPI App Initialization
+# =====================
+
+app = FastAPI(title="Message Push Server")
+
+redis_client = aioredis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    password=REDIS_PASSWORD,
+    db=REDIS_DB,
+    decode_responses=True
+)
+
+# =====================
+# Routes
+# =====================
+
+@app.get("/events/{wx_user_id}")
+async def stream_events(
+    request: Request,
+    wx_user_id: str,
+    token: str = Query(""),
+    last_event_id: Optional[str] = Query(None),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """
+    推送指定微信账号的事件流
+
+    断线重连时优先使用浏览器自动携带的 Last-Event-ID 请求头，也可以通过 last_event_id 参数指定；
+    都没有时只推送连接之后的新事件
+    """
+    if not hmac.compare_digest(token.encode("utf-8"), PUSH_TOKEN.encode("utf-8")):
+        return JSONResponse(status_code=status.HTTP_401_UNAUTHORIZED, content={"message": "token无效"})
+
+    start_id = last_event_id_header or last_event_id or "$"
+    logger.info(f"客户端 {request.client.host} 订阅 {wx_user_id}, 起始事件ID: {start_id}")
+
+    return StreamingResponse(
+        event_generator(request, f"{wx_user_id}_events", start_id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            # 关闭nginx的响应缓冲，否则事件会被攒批发送
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@app.get("/health")
+async def health_check():
+    """
+    健康检查端点
+    """
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"status": "healthy", "timestamp": datetime.now().isoformat()}
+    )
+
+# =====================
+# Helper Functions
+# =====================
+
+def format_sse(event_id: str, event_type: str, data: str) -> str:
+    """
+    格式化为SSE消息
+    """
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+async def event_generator(request: Request, stream_key: str, start_id: str):
+    """
+    循环读取Redis Stream并输出SSE消息，客户端断开时退出
+    """
+    yield f"retry: {RETRY_MS}\n\n"
+
+    last_id = start_id
+    if last_id == "$":
+        # "$" 只在第一次XREAD时有意义，这里换成当前最新的事件ID，避免两次读取之间的事件丢失
+        latest = await redis_client.xrevrange(stream_key, count=1)
+        last_id = latest[0][0] if latest else "0-0"
+
+    try:
+        while not await request.is_disconnected():
+            result = await redis_client.xread({stream_key: last_id}, count=READ_COUNT, block=BLOCK_MS)
+            if not result:
+                # 心跳（SSE注释行），同时用于检测客户端是否已断开
+                yield ": ping\n\n"
+                continue
+
+            for _, events in result:
+                for event_id, fields in events:
+                    last_id = event_id
+                    data = fields.get("data", "{}")
+                    try:
+                        event_type = json.loads(data).get("type", "message")
+                    except json.JSONDecodeError:
+                        event_type = "message"
+                    yield format_sse(event_id, event_type, data)
+    except asyncio.CancelledError:
+        logger.info(f"客户端断开连接: {stream_key}, 最后事件ID: {last_id}")
+        raise
+    except Exception as e:
+        logger.error(f"读取事件流失败: {stream_key}, {e}")
@@ -1,79 +1,82 @@
 import json
-import os
-import pymysql
 import logging
-import random
+import os
 from datetime import datetime
 
+from db_conn import run_with_retry
+
 # 配置日志
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def get_db_connection():
+# 小时汇总表，由Airflow的 wx_msg_rollup DAG 维护；与大屏不在同一个库时配置为 库名.表名
+ROLLUP_TABLE = os.environ.get('ROLLUP_TABLE', 'wx_msg_hourly_rollup')
+
+
+def query_account_stats(cursor):
     """
-    获取数据库连接
+    从小时汇总表查询今天和昨天各账号的统计数据（只读取两天内的汇总行）
     """
-    try:
-        # 从环境变量获取数据库连接信息
-        db_name = os.environ.get('DB_NAME')
-        db_ip = os.environ.get('DB_IP')
-        db_port = int(os.environ.get('DB_PORT', 3306))
-        db_user = os.environ.get('DB_USER')
-        db_password = os.environ.get('DB_PASSWORD')
-        
-        # 创建数据库连接
-        connection = pymysql.connect(
-            host=db_ip,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        
-        return connection
-    except Exception as e:
-        logger.error(f"数据库连接失败: {str(e)}")
-        raise e
+    sql = f"""
+        SELECT
+            wx_user_id,
+            stat_hour >= CURDATE() AS is_today,
+            SUM(inbound_count) AS inbound_count,
+            SUM(ai_reply_count) AS ai_reply_count,
+            SUM(handoff_count) AS handoff_count,
+            SUM(reply_latency_sum) AS reply_latency_sum,
+            SUM(reply_latency_count) AS reply_latency_count
+        FROM {ROLLUP_TABLE}
+        WHERE stat_hour >= CURDATE() - INTERVAL 1 DAY
+        GROUP BY wx_user_id, is_today
+    """
+    cursor.execute(sql)
+    return cursor.fetchall()
 
 
-def update_current_answer(connection):
+def update_current_answer(cursor):
     """
-    更新 current_answer 表中的 today 字段，增加一个 1～10 的随机数
+    用今天和昨天的AI回复总数更新 current_answer 表，并返回各账号今天的统计数据
     """
-    try:
-        with connection.cursor() as cursor:
-            # 生成 1～10 的随机数
-            random_value = random.randint(1, 10)
-            
-            # 更新 today 字段
-            sql = "UPDATE current_answer SET today = today + %s"
-            cursor.execute(sql, (random_value,))
-            connection.commit()
-            logger.info(f"成功更新 today 字段，增加了 {random_value}")
-    except Exception as e:
-        logger.error(f"更新数据失败: {str(e)}")
-        connection.rollback()
+    rows = query_account_stats(cursor)
+
+    today = sum(int(row['ai_reply_count'] or 0) for row in rows if row['is_today'])
+    yesterday = sum(int(row['ai_reply_count'] or 0) for row in rows if not row['is_today'])
+
+    # 更新 today / yesterday 字段（连接为自动提交模式）
+    sql = "UPDATE current_answer SET today = %s, yesterday = %s"
+    cursor.execute(sql, (today, yesterday))
+    logger.info(f"成功更新 current_answer, today: {today}, yesterday: {yesterday}")
+
+    accounts = []
+    for row in rows:
+        if not row['is_today']:
+            continue
+        latency_count = int(row['reply_latency_count'] or 0)
+        accounts.append({
+            "wx_user_id": row['wx_user_id'],
+            "inbound_count": int(row['inbound_count'] or 0),
+            "ai_reply_count": int(row['ai_reply_count'] or 0),
+            "handoff_count": int(row['handoff_count'] or 0),
+            "avg_reply_latency": round(int(row['reply_latency_sum'] or 0) / latency_count, 1) if latency_count else None
+        })
+    return {"today": today, "yesterday": yesterday, "accounts": accounts}
 
 
 def update_data_process():
     """
-    数据更新处理函数：连接数据库并更新 today 字段
+    数据更新处理函数：连接数据库并根据小时汇总表更新 current_answer
     """
     try:
-        # 获取数据库连接
-        connection = get_db_connection()
-        logger.info("成功连接到数据库")
-        
-        # 更新 today 字段
-        update_current_answer(connection)
-        
-        # 关闭数据库连接
-        connection.close()
-        logger.info("数据库连接已关闭")
+        # 在共享连接上执行，连接失效时重连并重试一次
+        stats = run_with_retry(update_current_answer)
         
-        return {"status": "success", "message": "成功更新 today 字段"}
+        return {
+            "status": "success",
+            "message": "成功更新 current_answer",
+            "data": stats,
+            "updated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
         
     except Exception as e:
         error_msg = f"执行过程中出错: {str(e)}"
@@ -85,10 +88,8 @@ def main_handler(event, context):
     """
     云函数入口函数
     
-    该函数设计为由定时触发器每 5 秒触发一次，每次更新 today 字段
-    要实现每 5 秒更新一次，持续 1 分钟，请在设置定时触发器时配置为：
-    - 触发周期：每 5 秒触发一次（配置 cron 表达式为 "*/5 * * * * *"）
-    - 触发次数：配置为 12 次（或者手动停止）
+    该函数由定时触发器周期性触发（如每分钟一次，配置 cron 表达式为 "0 */1 * * * * *"），
+    每次从 wx_msg_hourly_rollup 汇总表读取今天和昨天的数据更新大屏，不读取原始聊天记录
     
     Args:
         event: 触发事件
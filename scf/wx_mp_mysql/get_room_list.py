@@ -8,43 +8,15 @@ Date: 2025-03-04
 """
 
 import json
-import os
-import pymysql
 import logging
 from datetime import datetime
 
+from db_conn import run_with_retry
+
 # 配置日志
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def get_db_connection():
-    """
-    获取数据库连接
-    """
-    try:
-        # 从环境变量获取数据库连接信息
-        db_name = os.environ.get('DB_NAME')
-        db_ip = os.environ.get('DB_IP')
-        db_port = int(os.environ.get('DB_PORT', 3306))
-        db_user = os.environ.get('DB_USER')
-        db_password = os.environ.get('DB_PASSWORD')
-        
-        # 创建数据库连接
-        connection = pymysql.connect(
-            host=db_ip,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        
-        return connection
-    except Exception as e:
-        logger.error(f"数据库连接失败: {str(e)}")
-        raise e
-
 def main_handler(event, context):
     """
     云函数入口函数，获取微信公众号的会话列表和最新消息
@@ -59,9 +31,6 @@ def main_handler(event, context):
     logger.info(f"收到请求: {json.dumps(event, ensure_ascii=False)}")
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # 使用子查询找到每个用户与公众号的最新消息
         query = """
         WITH latest_messages AS (
@@ -109,8 +78,12 @@ def main_handler(event, context):
         ORDER BY msg_datetime DESC
         """
         
-        cursor.execute(query)
-        results = cursor.fetchall()
+        def _query(cursor):
+            cursor.execute(query)
+            return cursor.fetchall()
+        
+        # 在共享连接上执行查询
+        results = run_with_retry(_query)
         
         # 格式化日期时间
         for row in results:
@@ -130,8 +103,3 @@ def main_handler(event, context):
             'message': f"获取公众号会话列表失败: {str(e)}",
             'data': None
         }
-    finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
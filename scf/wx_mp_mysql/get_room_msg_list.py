@@ -7,43 +7,15 @@ Author: lys
 Date: 2025-03-04
 """
 import json
-import os
-import pymysql
 import logging
 from datetime import datetime
 
+from db_conn import run_with_retry
+
 # 配置日志
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def get_db_connection():
-    """
-    获取数据库连接
-    """
-    try:
-        # 从环境变量获取数据库连接信息
-        db_name = os.environ.get('DB_NAME')
-        db_ip = os.environ.get('DB_IP')
-        db_port = int(os.environ.get('DB_PORT', 3306))
-        db_user = os.environ.get('DB_USER')
-        db_password = os.environ.get('DB_PASSWORD')
-        
-        # 创建数据库连接
-        connection = pymysql.connect(
-            host=db_ip,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        
-        return connection
-    except Exception as e:
-        logger.error(f"数据库连接失败: {str(e)}")
-        raise e
-
 def main_handler(event, context):
     """
     云函数入口函数，用于查询微信公众号聊天数据并以JSON格式返回
@@ -140,11 +112,7 @@ def main_handler(event, context):
     if conditions:
         count_sql += " WHERE " + " AND ".join(conditions)
     
-    try:
-        # 获取数据库连接
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
+    def _query(cursor):
         # 查询总记录数
         cursor.execute(count_sql, params[:-2])
         total_count = cursor.fetchone()['total']
@@ -152,7 +120,11 @@ def main_handler(event, context):
         # 执行查询
         logger.info(f"执行SQL: {sql}, 参数: {params}")
         cursor.execute(sql, params)
-        records = cursor.fetchall()
+        return total_count, cursor.fetchall()
+    
+    try:
+        # 在共享连接上执行查询
+        total_count, records = run_with_retry(_query)
         
         # 处理日期时间格式
         for record in records:
@@ -180,9 +152,3 @@ def main_handler(event, context):
             "message": f"查询失败: {str(e)}",
             "data": None
         }
-    
-    finally:
-        if 'cursor' in locals() and cursor:
-            cursor.close()
-        if 'conn' in locals() and conn:
-            conn.close()
\ No newline at end of file
@@ -18,6 +18,14 @@
 - ENCODING_AES_KEY: 消息加解密密钥
 - APPID: 微信公众号的AppID
 - AIRFLOW_*: Airflow相关配置
+- PASSIVE_REPLY_BUDGET: 被动回复的时间预算（秒），默认3秒
+- WX_MP_KEYWORD_REPLIES: 关键词回复，JSON格式: {"关键词": "回复内容"}
+- FAST_LLM_*: 被动回复使用的快速模型（OpenAI兼容接口），未配置时不使用
+
+被动回复:
+收到消息后立即在后台触发Airflow，同时在预算内尝试得到答案（关键词、缓存的答案、快速模型）。
+得到答案且能在5秒截止前写入被动回复标记（Airflow变量 mp_passive_reply_{MsgId}）时直接在响应中回复，
+Airflow合并消息后看到标记就不再回复；否则返回success，由Airflow异步回复。
 
 Author: by cursor
 Date: 2025-02-27
@@ -25,8 +33,11 @@ Date: 2025-02-27
 
 import json
 import os
+import re
 import time
 import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import requests
 import ierror
 import xml.etree.cElementTree as ET
@@ -43,6 +54,50 @@ AIRFLOW_USERNAME = os.getenv("AIRFLOW_USERNAME")
 AIRFLOW_PASSWORD = os.getenv("AIRFLOW_PASSWORD")
 AIRFLOW_DAG_ID = os.getenv("AIRFLOW_DAG_ID", "wx_mp_msg_watcher")
 
+# 微信服务器等待响应的时间（秒），超时后不再接受被动回复并重试推送
+WX_MP_REPLY_DEADLINE = 5.0
+
+# 在截止时间前预留的余量（秒），用于网络传输和云函数返回
+WX_MP_REPLY_MARGIN = 0.8
+
+# 被动回复的时间预算（秒），剩余时间留给写入被动回复标记
+PASSIVE_REPLY_BUDGET = float(os.getenv("PASSIVE_REPLY_BUDGET", "3.0"))
+
+# 剩余时间少于该值时不再请求快速模型（秒）
+FAST_LLM_MIN_TIMEOUT = 0.5
+
+# 快速模型配置（OpenAI兼容接口）
+FAST_LLM_BASE_URL = os.getenv("FAST_LLM_BASE_URL")
+FAST_LLM_API_KEY = os.getenv("FAST_LLM_API_KEY")
+FAST_LLM_MODEL = os.getenv("FAST_LLM_MODEL")
+FAST_LLM_SYSTEM_PROMPT = os.getenv("FAST_LLM_SYSTEM_PROMPT", "你是微信公众号的智能助手，请用简洁的中文回答用户的问题。")
+
+# 被动回复的最大字数，更长的答案交给Airflow分段发送
+PASSIVE_REPLY_MAX_CHARS = 600
+
+# 答案缓存（云函数实例复用时保留）的有效期（秒）和最大条数
+REPLY_CACHE_TTL = 60 * 60
+REPLY_CACHE_MAX_SIZE = 500
+_reply_cache = OrderedDict()
+
+# 被动回复标记的Airflow变量名，Airflow看到标记后不再回复该消息
+PASSIVE_REPLY_VARIABLE = "mp_passive_reply_{msg_id}"
+
+# 后台触发Airflow和写入标记的线程池（云函数实例复用时保留）
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+def load_keyword_replies():
+    """读取关键词回复配置"""
+    try:
+        return json.loads(os.getenv("WX_MP_KEYWORD_REPLIES") or "{}")
+    except ValueError as e:
+        print(f"关键词回复配置格式错误: {str(e)}")
+        return {}
+
+
+KEYWORD_REPLIES = load_keyword_replies()
+
 
 def json_to_xml(json_data):
     """将JSON格式的消息转换为XML格式"""
@@ -211,7 +266,163 @@ def encrypt_message(wx_crypt, reply_msg, nonce, timestamp=None):
         print("解析加密XML出错:", str(e))
         return ierror.WXBizMsgCrypt_ParseXml_Error, None
 
-def handle_message(msg):
+def normalize_question(content):
+    """归一化问题文本，作为关键词和缓存的键"""
+    return re.sub(r'\s+', ' ', (content or '').strip().lower())
+
+def get_cached_reply(question):
+    """读取缓存的答案，不存在或过期时返回None"""
+    cached = _reply_cache.get(question)
+    if not cached:
+        return None
+    answer, cached_at = cached
+    if time.time() - cached_at > REPLY_CACHE_TTL:
+        _reply_cache.pop(question, None)
+        return None
+    _reply_cache.move_to_end(question)
+    return answer
+
+def put_cached_reply(question, answer):
+    """缓存答案，超出最大条数时淘汰最久未使用的"""
+    _reply_cache[question] = (answer, time.time())
+    _reply_cache.move_to_end(question)
+    while len(_reply_cache) > REPLY_CACHE_MAX_SIZE:
+        _reply_cache.popitem(last=False)
+
+def ask_fast_llm(question, timeout):
+    """请求快速模型，超时或失败时返回None"""
+    try:
+        response = requests.post(
+            f"{FAST_LLM_BASE_URL.rstrip('/')}/chat/completions",
+            json={
+                "model": FAST_LLM_MODEL,
+                "messages": [
+                    {"role": "system", "content": FAST_LLM_SYSTEM_PROMPT},
+                    {"role": "user", "content": question},
+                ],
+                "max_tokens": 512,
+            },
+            headers={"Authorization": f"Bearer {FAST_LLM_API_KEY}"},
+            timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"].strip()
+    except Exception as e:
+        print(f"快速模型未能在{timeout:.2f}秒内回答: {str(e)}")
+        return None
+
+def get_passive_reply(msg, start_time):
+    """在时间预算内获取被动回复的内容
+
+    按 关键词 -> 缓存的答案 -> 快速模型 的顺序尝试，只处理文本消息
+
+    返回:
+        tuple: (回复内容, 来源)，无法在预算内回答时回复内容为None
+    """
+    if msg.get('MsgType') != 'text':
+        return None, "非文本消息"
+
+    question = normalize_question(msg.get('Content'))
+    if not question:
+        return None, "空消息"
+
+    for keyword, reply in KEYWORD_REPLIES.items():
+        if normalize_question(keyword) == question:
+            return reply, "关键词"
+
+    answer = get_cached_reply(question)
+    if answer:
+        return answer, "缓存"
+
+    if not (FAST_LLM_BASE_URL and FAST_LLM_API_KEY and FAST_LLM_MODEL):
+        return None, "未配置快速模型"
+
+    timeout = PASSIVE_REPLY_BUDGET - (time.perf_counter() - start_time)
+    if timeout < FAST_LLM_MIN_TIMEOUT:
+        return None, "剩余时间不足"
+
+    answer = ask_fast_llm(msg.get('Content', '').strip(), timeout)
+    if not answer:
+        return None, "快速模型超时"
+    if len(answer) > PASSIVE_REPLY_MAX_CHARS:
+        return None, "答案过长"
+    put_cached_reply(question, answer)
+    return answer, "快速模型"
+
+def build_text_reply(msg, content):
+    """构造被动回复的文本消息"""
+    return {
+        "ToUserName": msg.get('FromUserName', ''),
+        "FromUserName": msg.get('ToUserName', ''),
+        "CreateTime": int(time.time()),
+        "MsgType": "text",
+        "Content": content
+    }
+
+def dispatch_message(msg, start_time):
+    """触发Airflow，同时尝试被动回复
+
+    Airflow在收到消息时立即在后台触发，不等待快速模型；所有等待都不超过截止时间（预留余量）。
+    只有被动回复标记在截止前写入成功时才返回被动回复，否则返回None，由Airflow异步回复。
+
+    返回:
+        dict: 被动回复的消息，无法在截止前回答时返回None
+    """
+    deadline = start_time + WX_MP_REPLY_DEADLINE - WX_MP_REPLY_MARGIN
+    trigger = _executor.submit(send_message_to_airflow, msg, WX_MP_REPLY_DEADLINE - WX_MP_REPLY_MARGIN)
+
+    passive_reply, source = get_passive_reply(msg, start_time)
+    passive_ms = (time.perf_counter() - start_time) * 1000
+    print(f"[TIMING] 被动回复: {'命中' if passive_reply else '未命中'}({source}), 耗时: {passive_ms:.0f}ms")
+
+    if passive_reply:
+        marker = _executor.submit(mark_passive_reply, msg, passive_reply, deadline - time.perf_counter())
+        if not wait_until(marker, deadline):
+            print("[TIMING] 被动回复标记未能在截止前写入，改为由Airflow异步回复")
+            passive_reply = None
+
+    if wait_until(trigger, deadline):
+        print("成功发送消息到Airflow进行处理")
+    else:
+        print("发送消息到Airflow失败或未在截止前完成")
+
+    total_ms = (time.perf_counter() - start_time) * 1000
+    remaining_ms = WX_MP_REPLY_DEADLINE * 1000 - total_ms
+    print(f"[TIMING] 总耗时: {total_ms:.0f}ms, 距5秒截止: {remaining_ms:.0f}ms")
+
+    return build_text_reply(msg, passive_reply) if passive_reply else None
+
+def wait_until(future, deadline):
+    """等待后台任务到截止时间，返回任务结果，超时或失败时返回False"""
+    try:
+        return future.result(timeout=max(deadline - time.perf_counter(), 0))
+    except FutureTimeoutError:
+        return False
+    except Exception as e:
+        print(f"后台任务失败: {str(e)}")
+        return False
+
+def mark_passive_reply(msg, reply, timeout):
+    """写入被动回复标记（Airflow变量），值为回复内容，供Airflow保存"""
+    if timeout <= 0 or not all([AIRFLOW_BASE_URL, AIRFLOW_USERNAME, AIRFLOW_PASSWORD]):
+        return False
+    try:
+        response = requests.post(
+            f"{AIRFLOW_BASE_URL}/api/v1/variables",
+            json={"key": PASSIVE_REPLY_VARIABLE.format(msg_id=msg['MsgId']), "value": reply},
+            headers={'Content-Type': 'application/json'},
+            auth=(AIRFLOW_USERNAME, AIRFLOW_PASSWORD),
+            timeout=timeout
+        )
+        if response.status_code in [200, 201]:
+            return True
+        print(f"写入被动回复标记失败: {response.status_code} - {response.text}")
+        return False
+    except Exception as e:
+        print(f"写入被动回复标记失败: {str(e)}")
+        return False
+
+def handle_message(msg, start_time=None):
     """处理解密后的消息，并返回响应"""
     # 打印解密后的消息，用于调试
     print("收到消息: ", json.dumps(msg, ensure_ascii=False))
@@ -222,42 +433,32 @@ def handle_message(msg):
     
     print(f"消息类型: {msg_type}, 事件类型: {event_type}")
     
-    # 异步发送消息到Airflow进行处理
+    if start_time is None:
+        start_time = time.perf_counter()
+
+    # 尝试被动回复，并发送消息到Airflow进行处理
     try:
-        # 在后台发送消息到Airflow
-        send_result = send_message_to_airflow(msg)
-        if send_result:
-            print("成功发送消息到Airflow进行处理")
-        else:
-            print("发送消息到Airflow失败")
+        passive_reply = dispatch_message(msg, start_time)
     except Exception as e:
         print(f"发送消息到Airflow时出错: {str(e)}")
+        passive_reply = None
     
     # 这里可以根据需要处理不同类型的消息
     if msg_type == 'event' and event_type == 'debug_demo':
         # 处理debug_demo事件
-        reply = {
-            "ToUserName": msg.get('FromUserName', ''),
-            "FromUserName": msg.get('ToUserName', ''),
-            "CreateTime": int(time.time()),
-            "MsgType": "text",
-            "Content": "good luck"
-        }
+        reply = build_text_reply(msg, "good luck")
         print(f"回复debug_demo事件: {json.dumps(reply, ensure_ascii=False)}")
         return reply
+
+    if passive_reply:
+        print(f"被动回复: {json.dumps(passive_reply, ensure_ascii=False)}")
+        return passive_reply
     
-    # 默认回复
-    reply = {
-        "ToUserName": msg.get('FromUserName', ''),
-        "FromUserName": msg.get('ToUserName', ''),
-        "CreateTime": int(time.time()),
-        "MsgType": "text",
-        "Content": "收到消息"
-    }
-    print(f"默认回复: {json.dumps(reply, ensure_ascii=False)}")
-    return reply
+    # 无法在预算内回答，由Airflow异步回复
+    print("默认回复: success")
+    return "success"
 
-def send_message_to_airflow(msg):
+def send_message_to_airflow(msg, timeout=10):
     """把收到的消息作为airflow流程的触发参数，触发airflow流程"""
     print(f"发送消息到Airflow: {msg}")
     
@@ -290,7 +491,7 @@ def send_message_to_airflow(msg):
             json=airflow_payload,
             headers={'Content-Type': 'application/json'},
             auth=(AIRFLOW_USERNAME, AIRFLOW_PASSWORD),
-            timeout=10
+            timeout=timeout
         )
         
         if response.status_code in [200, 201]:
@@ -305,6 +506,8 @@ def send_message_to_airflow(msg):
         return False
 
 def main_handler(event, context):
+    # 从收到请求开始计时，微信服务器最多等待5秒
+    start_time = time.perf_counter()
     print("收到事件: " + json.dumps(event, indent=2, ensure_ascii=False))
     print("环境变量TOKEN: " + TOKEN)
     print("环境变量ENCODING_AES_KEY: " + ENCODING_AES_KEY)
@@ -385,11 +588,11 @@ def main_handler(event, context):
                     
                     # 处理解密后的消息
                     print("处理解密后的消息, 发送消息到Airflow进行处理")
-                    reply_content = send_message_to_airflow(decrypted_msg)
+                    passive_reply = dispatch_message(decrypted_msg, start_time)
                     
-                    # 加密回复消息
+                    # 加密回复消息（无法在预算内回答时回复success，由Airflow异步回复）
                     print("加密回复消息")
-                    reply_content = "success"
+                    reply_content = passive_reply or "success"
                     ret, encrypted_reply = encrypt_message(wx_crypt, reply_content, nonce, timestamp)
                     
                     if ret != 0:
@@ -403,7 +606,7 @@ def main_handler(event, context):
                 else:
                     # 明文模式，直接处理
                     print("使用明文模式处理消息")
-                    reply_content = handle_message(body)
+                    reply_content = handle_message(body, start_time)
                     print(f"返回明文回复: {json.dumps(reply_content, ensure_ascii=False)}")
                     return reply_content
         
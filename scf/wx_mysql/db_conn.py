@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+"""
+云函数共享的MySQL连接管理
+
+云函数实例热启动时会复用模块级变量，这里保留一个模块级连接，避免每次请求都重新
+进行TCP/TLS握手和MySQL认证:
+1. 每次使用前通过 ping(reconnect=True) 校验连接
+2. 遇到连接失效类错误时丢弃旧连接，重连后重试一次
+3. 建立连接时设置连接/读写超时和语句超时，避免慢查询拖住函数实例
+
+注意: 各云函数目录需要各自携带一份本文件（云函数按目录独立部署）
+"""
+import os
+import logging
+
+import pymysql
+
+logger = logging.getLogger()
+
+# 超时配置（秒），语句超时单位为毫秒，仅对SELECT生效
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+DB_READ_TIMEOUT = int(os.environ.get('DB_READ_TIMEOUT', 10))
+DB_WRITE_TIMEOUT = int(os.environ.get('DB_WRITE_TIMEOUT', 10))
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+
+# 连接失效类错误码: 2006 MySQL server has gone away, 2013 查询中丢失连接,
+# 2055 读写时丢失连接, 4031 连接因空闲被服务端断开
+STALE_CONNECTION_ERROR_CODES = (2006, 2013, 2055, 4031)
+
+# 模块级连接，热启动时复用
+_connection = None
+
+
+def _create_connection():
+    """
+    创建新的数据库连接
+    """
+    return pymysql.connect(
+        host=os.environ.get('DB_IP'),
+        port=int(os.environ.get('DB_PORT', 3306)),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        database=os.environ.get('DB_NAME'),
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        read_timeout=DB_READ_TIMEOUT,
+        write_timeout=DB_WRITE_TIMEOUT,
+        # 长连接必须自动提交，否则同一个事务快照内读不到新数据
+        autocommit=True,
+        # 重连时pymysql会再次执行init_command，语句超时始终生效
+        init_command=f"SET SESSION MAX_EXECUTION_TIME={DB_STATEMENT_TIMEOUT_MS}"
+    )
+
+
+def get_db_connection():
+    """
+    获取数据库连接，优先复用模块级连接
+    """
+    global _connection
+    try:
+        if _connection is None:
+            _connection = _create_connection()
+            logger.info("创建新的数据库连接")
+        else:
+            _connection.ping(reconnect=True)
+        return _connection
+    except Exception as e:
+        logger.error(f"数据库连接失败: {str(e)}")
+        reset_db_connection()
+        raise e
+
+
+def reset_db_connection():
+    """
+    丢弃当前的模块级连接，下次获取时重新创建
+    """
+    global _connection
+    if _connection is not None:
+        try:
+            _connection.close()
+        except Exception:
+            pass
+    _connection = None
+
+
+def is_stale_connection_error(error):
+    """
+    判断异常是否由连接失效引起
+    """
+    if isinstance(error, pymysql.err.InterfaceError):
+        return True
+    if isinstance(error, pymysql.err.OperationalError) and error.args:
+        return error.args[0] in STALE_CONNECTION_ERROR_CODES
+    return False
+
+
+def run_with_retry(func):
+    """
+    在共享连接上执行 func(cursor)，连接失效时重连并重试一次
+
+    Args:
+        func: 接收游标的函数，返回值会原样返回
+
+    Returns:
+        func的返回值
+    """
+    for attempt in range(2):
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                return func(cursor)
+        except Exception as e:
+            if attempt == 0 and is_stale_connection_error(e):
+                logger.warning(f"数据库连接已失效，重连后重试: {str(e)}")
+                reset_db_connection()
+                continue
+            raise
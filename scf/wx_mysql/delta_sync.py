@@ -0,0 +1,117 @@
+# -*- coding: utf8 -*-
+"""
+增量同步（delta sync）公共函数
+
+前端轮询时携带上次返回的 next_since_id，云函数只返回 id 大于该值的新数据；
+同时返回 ETag，请求头带 If-None-Match 且数据未变化时直接返回 304，不执行查询。
+
+说明:
+- 游标使用自增主键 id（单调递增），msg_datetime 只用于排序展示
+- wx_user_id / room_id 的二级索引隐含主键 id，"wx_user_id = ? AND id > ?" 可以直接走索引范围扫描
+- 增量接口使用API网关的集成响应格式（statusCode/headers/body），以便设置 ETag 和返回 304
+- 多个任务并发写入时，较小的id可能晚于较大的id提交；next_since_id 只推进到写入超过
+  SYNC_SETTLE_SECONDS 的消息，更新的消息本次照常返回、下次会再次返回，客户端按id去重
+"""
+import hashlib
+import json
+from datetime import datetime
+
+# 写入超过该时间（秒）的消息视为已提交，之前的id不会再出现新行（与汇总任务的 ROLLUP_SETTLE_SECONDS 一致）
+SYNC_SETTLE_SECONDS = 30
+
+
+def get_request_header(event, name):
+    """
+    读取请求头（不区分大小写）
+    """
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def get_sync_ids(cursor, wx_user_id):
+    """
+    查询账号最新一条消息的id（作为ETag的依据），以及写入超过 SYNC_SETTLE_SECONDS 的最新消息id（游标上限）
+
+    两个 MAX(id) 都在 wx_user_id 索引上从最大的id倒序扫描，只需读取最近几行，开销远小于实际的列表查询
+
+    Returns:
+        tuple: (max_id, settled_id)
+    """
+    cursor.execute(
+        """
+        SELECT
+            (SELECT MAX(id) FROM wx_chat_records WHERE wx_user_id = %s) AS max_id,
+            (SELECT MAX(id) FROM wx_chat_records
+             WHERE wx_user_id = %s AND created_at < NOW() - INTERVAL %s SECOND) AS settled_id
+        """,
+        (wx_user_id, wx_user_id, SYNC_SETTLE_SECONDS)
+    )
+    row = cursor.fetchone()
+    return row['max_id'] or 0, row['settled_id'] or 0
+
+
+def next_cursor(since_id, ids, settled_id):
+    """
+    计算 next_since_id: 本次返回的id中不超过 settled_id 的最大值，更新的消息下次会再次返回
+    """
+    return max([since_id] + [msg_id for msg_id in ids if msg_id <= settled_id])
+
+
+def make_etag(*parts):
+    """
+    根据请求参数和数据版本生成弱ETag
+    """
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def is_not_modified(event, etag):
+    """
+    判断客户端缓存的ETag是否仍然有效
+    """
+    if_none_match = get_request_header(event, 'If-None-Match')
+    if not if_none_match:
+        return False
+    return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+def format_datetimes(records):
+    """
+    处理日期时间格式，使其可JSON序列化
+    """
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, datetime):
+                record[key] = value.strftime('%Y-%m-%d %H:%M:%S')
+    return records
+
+
+def not_modified_response(etag):
+    """
+    304响应，不返回响应体
+    """
+    return {
+        "isBase64Encoded": False,
+        "statusCode": 304,
+        "headers": {"ETag": etag, "Cache-Control": "no-cache"},
+        "body": ""
+    }
+
+
+def json_response(result, etag=None):
+    """
+    带ETag的JSON响应（API网关集成响应格式）
+    """
+    headers = {"Content-Type": "application/json; charset=utf-8", "Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    return {
+        "isBase64Encoded": False,
+        "statusCode": 200,
+        "headers": headers,
+        "body": json.dumps(result, ensure_ascii=False)
+    }
@@ -0,0 +1,130 @@
+# -*- coding: utf8 -*-
+"""
+导出指定聊天室的全部聊天记录
+
+云函数本身不读取聊天记录（响应大小和执行时长都有限制），而是触发Airflow的
+wx_chat_history_export DAG，由DAG使用服务端游标流式导出为gzip压缩的NDJSON/CSV文件。
+同一聊天室同一格式的导出使用固定的文件名，重复触发会从上次的断点继续。
+
+环境变量:
+- AIRFLOW_BASE_URL / AIRFLOW_USERNAME / AIRFLOW_PASSWORD: Airflow API配置
+"""
+import json
+import logging
+import os
+import time
+
+import requests
+
+# 配置日志
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+AIRFLOW_BASE_URL = os.getenv("AIRFLOW_BASE_URL")
+AIRFLOW_USERNAME = os.getenv("AIRFLOW_USERNAME")
+AIRFLOW_PASSWORD = os.getenv("AIRFLOW_PASSWORD")
+AIRFLOW_EXPORT_DAG_ID = os.getenv("AIRFLOW_EXPORT_DAG_ID", "wx_chat_history_export")
+
+# 支持的导出格式
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+
+def main_handler(event, context):
+    """
+    云函数入口函数，触发聊天记录导出
+
+    Args:
+        event: 触发事件，包含查询参数
+            - wx_user_id: 微信账号ID（必填）
+            - room_id: 聊天室ID（必填）
+            - format: 导出格式，ndjson（默认）或 csv
+            - restart: 是否丢弃已有断点从头导出
+        context: 函数上下文
+
+    Returns:
+        JSON格式的结果，包含Airflow的dag_run_id
+    """
+    logger.info(f"收到请求: {json.dumps(event, ensure_ascii=False)}")
+
+    # 解析查询参数
+    query_params = {}
+    if 'queryString' in event:
+        query_params = event['queryString']
+    elif 'body' in event:
+        try:
+            if isinstance(event['body'], str):
+                query_params = json.loads(event['body'])
+            else:
+                query_params = event['body']
+        except:
+            pass
+
+    wx_user_id = query_params.get('wx_user_id', '')
+    room_id = query_params.get('room_id', '')
+    export_format = query_params.get('format', 'ndjson')
+    restart = str(query_params.get('restart', '')).lower() in ('1', 'true')
+
+    if not wx_user_id or not room_id:
+        return {
+            "code": -1,
+            "message": "wx_user_id 和 room_id 为必填参数",
+            "data": None
+        }
+    if export_format not in EXPORT_FORMATS:
+        return {
+            "code": -1,
+            "message": f"不支持的导出格式: {export_format}",
+            "data": None
+        }
+    if not all([AIRFLOW_BASE_URL, AIRFLOW_USERNAME, AIRFLOW_PASSWORD]):
+        return {
+            "code": -1,
+            "message": "缺少Airflow配置环境变量",
+            "data": None
+        }
+
+    # DAG run ID只保留字母数字和下划线
+    dag_run_id = "export_" + "".join(c if c.isalnum() else "_" for c in f"{wx_user_id}_{room_id}") + f"_{int(time.time())}"
+
+    try:
+        response = requests.post(
+            f"{AIRFLOW_BASE_URL}/api/v1/dags/{AIRFLOW_EXPORT_DAG_ID}/dagRuns",
+            json={
+                "conf": {
+                    "wx_user_id": wx_user_id,
+                    "room_id": room_id,
+                    "format": export_format,
+                    "restart": restart
+                },
+                "dag_run_id": dag_run_id,
+                "note": "Triggered by export SCF"
+            },
+            headers={'Content-Type': 'application/json'},
+            auth=(AIRFLOW_USERNAME, AIRFLOW_PASSWORD),
+            timeout=10
+        )
+        if response.status_code not in [200, 201]:
+            logger.error(f"触发导出DAG失败: {response.status_code} - {response.text}")
+            return {
+                "code": -1,
+                "message": f"触发导出失败: {response.status_code}",
+                "data": None
+            }
+
+        return {
+            "code": 0,
+            "message": "success",
+            "data": {
+                "dag_id": AIRFLOW_EXPORT_DAG_ID,
+                "dag_run_id": dag_run_id,
+                "format": export_format
+            }
+        }
+
+    except Exception as e:
+        logger.error(f"触发导出失败: {str(e)}")
+        return {
+            "code": -1,
+            "message": f"触发导出失败: {str(e)}",
+            "data": None
+        }
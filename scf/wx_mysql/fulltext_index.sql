@@ -0,0 +1,10 @@
+-- 为已有的聊天记录表添加中文全文索引（search_msgs 云函数依赖该索引）
+-- 新建的表在 mysql_tools.init_wx_chat_records_table 中已包含该索引
+--
+-- ngram 分词长度由 MySQL 启动参数 ngram_token_size 控制，默认为 2，
+-- 短于该长度的关键词无法命中全文索引，search_msgs 会自动退化为 LIKE 查询
+--
+-- 注意: 大表上创建全文索引耗时较长，建议在业务低峰期执行
+
+ALTER TABLE `wx_chat_records`
+    ADD FULLTEXT KEY `ft_content` (`content`) WITH PARSER ngram;
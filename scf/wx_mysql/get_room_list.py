@@ -9,42 +9,90 @@ Date: 2025-03-01
 """
 
 import json
-import os
-import pymysql
 import logging
 from datetime import datetime
 
+from db_conn import run_with_retry
+from delta_sync import format_datetimes, get_sync_ids, is_not_modified, json_response, make_etag, not_modified_response
+
 # 配置日志
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def get_db_connection():
+
+def get_room_list_delta(event, wx_user_id, since_id):
+    """
+    增量查询: 只返回id大于since_id的消息所涉及的聊天室及其最新消息，数据未变化时返回304
+
+    Args:
+        event: 触发事件，用于读取 If-None-Match 请求头
+        wx_user_id: 微信账号ID
+        since_id: 客户端上次收到的 next_since_id，首次同步传0（返回全部聊天室）
+
+    最近有消息写入的聊天室可能在下次同步时再次返回（见 delta_sync），客户端按 room_id 覆盖即可
     """
-    获取数据库连接
+    query = """
+    WITH room_messages AS (
+        SELECT 
+            id,
+            room_id,
+            room_name,
+            wx_user_id,
+            wx_user_name,
+            sender_id,
+            sender_name,
+            msg_id,
+            content as msg_content,
+            msg_datetime,
+            msg_type,
+            is_group,
+            ROW_NUMBER() OVER (PARTITION BY room_id ORDER BY msg_datetime DESC, id DESC) as rn
+        FROM wx_chat_records
+        WHERE wx_user_id = %s AND id > %s
+    )
+    SELECT 
+        room_id,
+        room_name,
+        wx_user_id,
+        wx_user_name,
+        sender_id,
+        sender_name,
+        msg_id,
+        msg_content,
+        msg_datetime,
+        msg_type,
+        is_group
+    FROM room_messages
+    WHERE rn = 1
+    ORDER BY msg_datetime DESC
     """
+
+    def _query(cursor):
+        # 账号最新消息id未变化时不执行列表查询，游标只推进到已提交的消息
+        max_id, settled_id = get_sync_ids(cursor, wx_user_id)
+        etag = make_etag('room_list', wx_user_id, since_id, max_id, settled_id)
+        if is_not_modified(event, etag) or max_id <= since_id:
+            return etag, settled_id, []
+        cursor.execute(query, (wx_user_id, since_id))
+        return etag, settled_id, cursor.fetchall()
+
     try:
-        # 从环境变量获取数据库连接信息
-        db_name = os.environ.get('DB_NAME')
-        db_ip = os.environ.get('DB_IP')
-        db_port = int(os.environ.get('DB_PORT', 3306))
-        db_user = os.environ.get('DB_USER')
-        db_password = os.environ.get('DB_PASSWORD')
-        
-        # 创建数据库连接
-        connection = pymysql.connect(
-            host=db_ip,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        
-        return connection
+        etag, settled_id, results = run_with_retry(_query)
+        if is_not_modified(event, etag):
+            return not_modified_response(etag)
+
+        return json_response({
+            'code': 0,
+            'message': 'success',
+            'data': {
+                'rooms': format_datetimes(results),
+                'since_id': since_id,
+                'next_since_id': max(since_id, settled_id)
+            }
+        }, etag)
     except Exception as e:
-        logger.error(f"数据库连接失败: {str(e)}")
-        raise e
+        logger.error(f"增量获取聊天室列表失败: {str(e)}")
+        return json_response({'code': -1, 'message': f"增量获取聊天室列表失败: {str(e)}", 'data': None})
 
 
 def main_handler(event, context):
@@ -77,12 +125,13 @@ def main_handler(event, context):
     # 提取查询参数
     wx_user_id = query_params.get('wx_user_id', '')
     
+    # 携带since_id时只返回有新消息的聊天室
+    if wx_user_id and 'since_id' in query_params:
+        return get_room_list_delta(event, wx_user_id, int(query_params.get('since_id') or 0))
+    
     # 如果是获取聊天室列表请求
     if wx_user_id:
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
             # 使用子查询找到每个聊天室的最新消息
             query = """
             WITH room_messages AS (
@@ -119,8 +168,12 @@ def main_handler(event, context):
             ORDER BY msg_datetime DESC
             """
             
-            cursor.execute(query, (wx_user_id,))
-            results = cursor.fetchall()
+            def _query(cursor):
+                cursor.execute(query, (wx_user_id,))
+                return cursor.fetchall()
+            
+            # 在共享连接上执行查询
+            results = run_with_retry(_query)
             
             # 格式化日期时间
             for row in results:
@@ -138,11 +191,6 @@ def main_handler(event, context):
                 'message': f"获取聊天室列表失败: {str(e)}",
                 'data': None
             }
-        finally:
-            # 关闭数据库连接
-            if 'conn' in locals() and conn:
-                cursor.close()
-                conn.close()
     else:
         return {
             'code': -1,
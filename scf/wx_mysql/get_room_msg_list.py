@@ -6,42 +6,78 @@ Author: by cursor
 Date: 2025-03-01
 """
 import json
-import os
-import pymysql
 import logging
 from datetime import datetime
 
+from db_conn import run_with_retry
+from delta_sync import format_datetimes, get_sync_ids, is_not_modified, json_response, make_etag, next_cursor, not_modified_response
+from recent_cache import get_cached_msg_count, get_recent_msgs, put_cached_msg_count
+
 # 配置日志
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-def get_db_connection():
+
+def get_room_msg_delta(event, wx_user_id, room_id, since_id, limit, after_id=0):
     """
-    获取数据库连接
+    增量查询: 返回聊天室中id大于since_id（翻页时大于after_id）的消息（按id升序），数据未变化时返回304
+
+    Args:
+        event: 触发事件，用于读取 If-None-Match 请求头
+        wx_user_id: 微信账号ID
+        room_id: 聊天室ID
+        since_id: 客户端上次收到的 next_since_id，首次同步传0
+        limit: 单次返回的最大条数，超过时 has_more 为 true
+        after_id: 翻页游标，has_more 为 true 时传上一页返回的 next_after_id 继续拉取，since_id 传上一页的 next_since_id
+
+    next_since_id 只推进到已提交的消息，最近写入的消息很多时可能不前进，所以翻页使用单独的游标 next_after_id（本页最大id）。
+    最近写入的消息可能在下次同步时再次返回（见 delta_sync），客户端需要按id去重
     """
-    try:
-        # 从环境变量获取数据库连接信息
-        db_name = os.environ.get('DB_NAME')
-        db_ip = os.environ.get('DB_IP')
-        db_port = int(os.environ.get('DB_PORT', 3306))
-        db_user = os.environ.get('DB_USER')
-        db_password = os.environ.get('DB_PASSWORD')
-        
-        # 创建数据库连接
-        connection = pymysql.connect(
-            host=db_ip,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
+    if not wx_user_id or not room_id:
+        return json_response({"code": -1, "message": "增量同步需要 wx_user_id 和 room_id", "data": None})
+
+    def _query(cursor):
+        # 先用账号最新消息id判断数据是否变化，未变化时不执行列表查询
+        max_id, settled_id = get_sync_ids(cursor, wx_user_id)
+        etag = make_etag('room_msg_list', wx_user_id, room_id, since_id, after_id, limit, max_id, settled_id)
+        if is_not_modified(event, etag):
+            return etag, settled_id, None
+
+        cursor.execute(
+            """
+            SELECT * FROM wx_chat_records
+            WHERE room_id = %s AND wx_user_id = %s AND id > %s
+            ORDER BY id ASC
+            LIMIT %s
+            """,
+            (room_id, wx_user_id, max(since_id, after_id), limit + 1)
         )
-        
-        return connection
+        return etag, settled_id, cursor.fetchall()
+
+    try:
+        etag, settled_id, records = run_with_retry(_query)
+        if records is None:
+            return not_modified_response(etag)
+
+        has_more = len(records) > limit
+        records = format_datetimes(records[:limit])
+
+        return json_response({
+            "code": 0,
+            "message": "success",
+            "data": {
+                "records": records,
+                "since_id": since_id,
+                "next_since_id": next_cursor(since_id, [record['id'] for record in records], settled_id),
+                "has_more": has_more,
+                "next_after_id": records[-1]['id'] if has_more else None
+            }
+        }, etag)
+
     except Exception as e:
-        logger.error(f"数据库连接失败: {str(e)}")
-        raise e
+        logger.error(f"增量查询失败: {str(e)}")
+        return json_response({"code": -1, "message": f"增量查询失败: {str(e)}", "data": None})
+
 
 def main_handler(event, context):
     """
@@ -79,6 +115,11 @@ def main_handler(event, context):
     limit = int(query_params.get('limit', 100))  # 默认限制100条
     offset = int(query_params.get('offset', 0))  # 默认从0开始
     
+    # 携带since_id时只返回新消息
+    if 'since_id' in query_params:
+        return get_room_msg_delta(event, wx_user_id, room_id, int(query_params.get('since_id') or 0), limit,
+                                  int(query_params.get('after_id') or 0))
+    
     # 构建查询条件
     conditions = []
     params = []
@@ -117,19 +158,36 @@ def main_handler(event, context):
     if conditions:
         count_sql += " WHERE " + " AND ".join(conditions)
     
-    try:
-        # 获取数据库连接
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
+    # 指定聊天室的前几页且不带发送者/时间过滤时，消息列表直接从最近消息缓存读取，
+    # 总数使用缓存的完整列表长度或短时缓存的COUNT结果，命中时不访问MySQL
+    cached_records = cached_total = None
+    if room_id and wx_user_id and not sender_id and not start_time and not end_time:
+        cached_records, cached_total = get_recent_msgs(wx_user_id, room_id, limit, offset)
+        if cached_records is not None and cached_total is None:
+            cached_total = get_cached_msg_count(wx_user_id, room_id)
+    
+    def _query(cursor):
         # 查询总记录数
         cursor.execute(count_sql, params[:-2] if conditions else [])
         total_count = cursor.fetchone()['total']
         
+        if cached_records is not None:
+            put_cached_msg_count(wx_user_id, room_id, total_count)
+            logger.info(f"从最近消息缓存读取消息列表, 数量: {len(cached_records)}")
+            return total_count, cached_records
+        
         # 执行查询
         logger.info(f"执行SQL: {sql}, 参数: {params}")
         cursor.execute(sql, params)
-        records = cursor.fetchall()
+        return total_count, cursor.fetchall()
+    
+    try:
+        if cached_records is not None and cached_total is not None:
+            logger.info(f"从最近消息缓存读取消息列表和总数, 数量: {len(cached_records)}")
+            total_count, records = cached_total, cached_records
+        else:
+            # 在共享连接上执行查询
+            total_count, records = run_with_retry(_query)
         
         # 处理日期时间格式，使其可JSON序列化
         for record in records:
@@ -158,9 +216,3 @@ def main_handler(event, context):
             "message": f"查询失败: {str(e)}",
             "data": None
         }
-    
-    finally:
-        # 关闭数据库连接
-        if 'conn' in locals() and conn:
-            cursor.close()
-            conn.close()
\ No newline at end of file
@@ -0,0 +1,112 @@
+# -*- coding: utf8 -*-
+"""
+读取Airflow写入的聊天室最近消息缓存（Redis列表）
+
+缓存由 dags/wx_dags/common/mysql_tools.py 在保存消息时维护:
+- 键名: {wx_user_id}_{room_id}_recent_msgs
+- 内容: 最新的 RECENT_MSG_CACHE_SIZE 条消息，最新的在最前面，字段与 wx_chat_records 一致
+- 完整标记: {wx_user_id}_{room_id}_recent_msgs_complete，存在时列表包含聊天室的全部消息
+
+未配置 REDIS_HOST 或未安装 redis 依赖时不使用缓存，直接查询MySQL
+"""
+import json
+import logging
+import os
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger()
+
+# 需与 mysql_tools.RECENT_MSG_CACHE_SIZE 保持一致
+RECENT_MSG_CACHE_SIZE = int(os.environ.get('RECENT_MSG_CACHE_SIZE', 100))
+
+# 聊天室消息总数的缓存时间（秒），分页的总数允许短暂滞后
+MSG_COUNT_CACHE_TTL = int(os.environ.get('MSG_COUNT_CACHE_TTL', 60))
+
+# 模块级客户端，热启动时复用
+_client = None
+
+
+def get_redis_client():
+    """
+    获取Redis客户端，未配置时返回None
+    """
+    global _client
+    if redis is None or not os.environ.get('REDIS_HOST'):
+        return None
+    if _client is None:
+        _client = redis.Redis(
+            host=os.environ.get('REDIS_HOST'),
+            port=int(os.environ.get('REDIS_PORT', 6379)),
+            password=os.environ.get('REDIS_PASSWORD') or None,
+            db=int(os.environ.get('REDIS_DB', 0)),
+            socket_connect_timeout=1,
+            socket_timeout=1,
+            decode_responses=True
+        )
+    return _client
+
+
+def get_recent_msgs(wx_user_id, room_id, limit, offset=0):
+    """
+    从缓存读取聊天室的最近消息
+
+    Returns:
+        tuple: (消息列表, 总条数)。缓存不可用或条数不足且不完整时消息列表为None，调用方需回退到MySQL；
+               列表包含聊天室的全部消息时总条数为列表长度，否则为None
+    """
+    if offset + limit > RECENT_MSG_CACHE_SIZE:
+        return None, None
+
+    client = get_redis_client()
+    if client is None:
+        return None, None
+
+    key = f'{wx_user_id}_{room_id}_recent_msgs'
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.lrange(key, offset, offset + limit - 1)
+        pipe.exists(f'{key}_complete')
+        pipe.llen(key)
+        data, complete, length = pipe.execute()
+    except Exception as e:
+        logger.warning(f"读取最近消息缓存失败, 回退到MySQL: {str(e)}")
+        return None, None
+
+    # 条数不足时，只有缓存包含聊天室的全部消息才能判断已是全部记录
+    if complete:
+        return [json.loads(item) for item in data], length
+    if len(data) < limit:
+        return None, None
+    return [json.loads(item) for item in data], None
+
+
+def get_cached_msg_count(wx_user_id, room_id):
+    """
+    读取缓存的聊天室消息总数，未缓存时返回None
+    """
+    client = get_redis_client()
+    if client is None:
+        return None
+    try:
+        value = client.get(f'{wx_user_id}_{room_id}_msg_count')
+    except Exception as e:
+        logger.warning(f"读取消息总数缓存失败: {str(e)}")
+        return None
+    return int(value) if value is not None else None
+
+
+def put_cached_msg_count(wx_user_id, room_id, total):
+    """
+    缓存聊天室消息总数 MSG_COUNT_CACHE_TTL 秒
+    """
+    client = get_redis_client()
+    if client is None:
+        return
+    try:
+        client.set(f'{wx_user_id}_{room_id}_msg_count', total, ex=MSG_COUNT_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"写入消息总数缓存失败: {str(e)}")
@@ -0,0 +1,226 @@
+# -*- coding: utf8 -*-
+"""
+按关键词搜索聊天记录
+
+基于 wx_chat_records.content 上的 ngram 全文索引（见 fulltext_index.sql），
+按相关度排序返回命中的消息，并对命中的关键词做高亮处理。
+分页方式与 get_room_msg_list 一致（limit + offset）。
+"""
+import html
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+from db_conn import run_with_retry
+
+# 配置日志
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# 需与MySQL的 ngram_token_size 保持一致，短于该长度的关键词无法命中全文索引
+NGRAM_TOKEN_SIZE = int(os.environ.get('NGRAM_TOKEN_SIZE', 2))
+
+# 单页最大返回条数
+MAX_LIMIT = 100
+
+# 高亮摘要中命中词前后保留的字符数
+SNIPPET_CONTEXT_CHARS = 30
+
+# BOOLEAN MODE 下有特殊含义的字符
+BOOLEAN_MODE_SPECIAL_CHARS = re.compile(r'[+\-<>()~*"@]')
+
+
+def parse_keywords(keyword):
+    """
+    将用户输入的关键词拆分为检索词，去掉全文检索的特殊字符
+    """
+    keyword = BOOLEAN_MODE_SPECIAL_CHARS.sub(' ', keyword)
+    return [term for term in keyword.split() if term]
+
+
+def build_highlight(content, terms):
+    """
+    截取第一个命中词附近的摘要，并用<em>标签包裹所有命中词
+
+    Args:
+        content: 消息内容
+        terms: 检索词列表
+
+    Returns:
+        str: 已做HTML转义的高亮摘要
+    """
+    if not content:
+        return ''
+
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+
+    # 截取摘要
+    match = pattern.search(content)
+    if match:
+        start = max(match.start() - SNIPPET_CONTEXT_CHARS, 0)
+        end = min(match.end() + SNIPPET_CONTEXT_CHARS, len(content))
+    else:
+        start, end = 0, min(len(content), SNIPPET_CONTEXT_CHARS * 2)
+    snippet = content[start:end]
+
+    # 先转义再高亮，避免消息内容中的HTML被前端渲染
+    parts = []
+    last_end = 0
+    for m in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[last_end:m.start()]))
+        parts.append(f"<em>{html.escape(m.group(0))}</em>")
+        last_end = m.end()
+    parts.append(html.escape(snippet[last_end:]))
+
+    prefix = '...' if start > 0 else ''
+    suffix = '...' if end < len(content) else ''
+    return prefix + ''.join(parts) + suffix
+
+
+def main_handler(event, context):
+    """
+    云函数入口函数，按关键词搜索微信聊天记录
+
+    Args:
+        event: 触发事件，包含查询参数
+            - wx_user_id: 微信账号ID（必填）
+            - keyword: 搜索关键词，多个关键词用空格分隔，需全部命中（必填）
+            - room_id / sender_id / start_time / end_time: 可选的过滤条件
+            - limit / offset: 分页参数
+        context: 函数上下文
+
+    Returns:
+        JSON格式的查询结果，每条记录带有相关度 score 和高亮摘要 highlight
+    """
+    logger.info(f"收到请求: {json.dumps(event, ensure_ascii=False)}")
+
+    # 解析查询参数
+    query_params = {}
+    if 'queryString' in event:
+        query_params = event['queryString']
+    elif 'body' in event:
+        try:
+            if isinstance(event['body'], str):
+                query_params = json.loads(event['body'])
+            else:
+                query_params = event['body']
+        except:
+            pass
+
+    wx_user_id = query_params.get('wx_user_id', '')
+    keyword = query_params.get('keyword', '')
+    room_id = query_params.get('room_id', '')
+    sender_id = query_params.get('sender_id', '')
+    start_time = query_params.get('start_time', '')
+    end_time = query_params.get('end_time', '')
+    limit = min(int(query_params.get('limit', 20)), MAX_LIMIT)  # 默认限制20条
+    offset = int(query_params.get('offset', 0))  # 默认从0开始
+
+    terms = parse_keywords(keyword)
+    if not wx_user_id or not terms:
+        return {
+            "code": -1,
+            "message": "wx_user_id 和 keyword 为必填参数",
+            "data": None
+        }
+
+    # 构建过滤条件
+    conditions = ["wx_user_id = %s"]
+    params = [wx_user_id]
+
+    if room_id:
+        conditions.append("room_id = %s")
+        params.append(room_id)
+
+    if sender_id:
+        conditions.append("sender_id = %s")
+        params.append(sender_id)
+
+    if start_time:
+        conditions.append("msg_datetime >= %s")
+        params.append(start_time)
+
+    if end_time:
+        conditions.append("msg_datetime <= %s")
+        params.append(end_time)
+
+    columns = """
+        id, msg_id, wx_user_id, room_id, room_name, sender_id, sender_name,
+        msg_type, content, is_self, is_group, msg_datetime
+    """
+
+    if all(len(term) >= NGRAM_TOKEN_SIZE for term in terms):
+        # 使用全文索引检索，每个检索词作为短语且必须命中
+        against = ' '.join(f'+"{term}"' for term in terms)
+        match_sql = "MATCH(content) AGAINST(%s IN BOOLEAN MODE)"
+        where_sql = " AND ".join([match_sql] + conditions)
+        where_params = [against] + params
+
+        sql = f"""
+            SELECT {columns}, {match_sql} AS score
+            FROM wx_chat_records
+            WHERE {where_sql}
+            ORDER BY score DESC, msg_datetime DESC
+            LIMIT %s OFFSET %s
+        """
+        sql_params = [against] + where_params + [limit, offset]
+    else:
+        # 检索词短于ngram分词长度时无法使用全文索引，退化为LIKE查询（依赖其他条件缩小范围）
+        like_conditions = ["content LIKE %s" for _ in terms]
+        where_sql = " AND ".join(like_conditions + conditions)
+        where_params = [f"%{term}%" for term in terms] + params
+
+        sql = f"""
+            SELECT {columns}, 0 AS score
+            FROM wx_chat_records
+            WHERE {where_sql}
+            ORDER BY msg_datetime DESC
+            LIMIT %s OFFSET %s
+        """
+        sql_params = where_params + [limit, offset]
+
+    count_sql = f"SELECT COUNT(*) as total FROM wx_chat_records WHERE {where_sql}"
+
+    def _query(cursor):
+        # 查询总记录数
+        cursor.execute(count_sql, where_params)
+        total_count = cursor.fetchone()['total']
+
+        # 执行查询
+        logger.info(f"执行SQL: {sql}, 参数: {sql_params}")
+        cursor.execute(sql, sql_params)
+        return total_count, cursor.fetchall()
+
+    try:
+        # 在共享连接上执行查询
+        total_count, records = run_with_retry(_query)
+
+        for record in records:
+            # 处理日期时间格式，使其可JSON序列化
+            for key, value in record.items():
+                if isinstance(value, datetime):
+                    record[key] = value.strftime('%Y-%m-%d %H:%M:%S')
+            record['score'] = float(record['score'] or 0)
+            record['highlight'] = build_highlight(record.get('content'), terms)
+
+        return {
+            "code": 0,
+            "message": "success",
+            "data": {
+                "total": total_count,
+                "records": records,
+                "keyword": keyword,
+                "limit": limit,
+                "offset": offset
+            }
+        }
+
+    except Exception as e:
+        logger.error(f"搜索失败: {str(e)}")
+        return {
+            "code": -1,
+            "message": f"搜索失败: {str(e)}",
+            "data": None
+        }